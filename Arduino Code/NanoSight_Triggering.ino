@@ -1,5 +1,186 @@
 char recieved_char;
-bool autosampler_output_latch = false;
+volatile bool autosampler_output_latch = false;
+
+//In push mode every autosampler pulse is sent to the host as soon as it is seen
+//instead of waiting for the host to poll for it.
+bool push_mode = false;
+
+//Pulses on pin 7 are counted by an interrupt so none are missed between polls.
+//The count and the time of the last pulse are reported in push mode.
+const unsigned long debounce_millis = 50;
+volatile unsigned long autosampler_pulse_count = 0;
+volatile unsigned long autosampler_pulse_millis = 0;
+unsigned long reported_pulse_count = 0;
+
+//Commands can also be sent as frames instead of single characters:
+//  0xA5, opcode, sequence number, payload length, payload, CRC-8 of opcode through payload.
+//A framed command is answered with a frame that has the opcode of the command with the top bit set
+//and the command's sequence number, and a payload of 1 byte for the commands that answer yes or no.
+//A frame with a bad CRC is answered with a NAK frame with the sequence number it had.
+//A 'B' turns binary mode on and an 'X' turns it off again. In binary mode pulses are pushed as 'E'
+//frames with sequence number 0 and the pulse count and time as two little endian 4 byte numbers,
+//and anything outside a frame is ignored.
+const byte frame_sync = 0xA5;
+const byte frame_nak = 0x15;
+const byte max_payload_length = 8;
+bool binary_mode = false;
+
+byte frame[4 + max_payload_length];
+byte frame_position = 0;
+
+
+void autosampler_pulse() {
+  //The autosampler pulls pin 7 low, so only count the falling edge.
+  if (digitalRead(7) == LOW){
+    unsigned long now = millis();
+    if (autosampler_pulse_count == 0 || now - autosampler_pulse_millis > debounce_millis){
+      autosampler_pulse_count++;
+      autosampler_pulse_millis = now;
+    }
+    autosampler_output_latch = true;
+  }
+}
+
+
+//Pin 7 is not an external interrupt pin on the Uno, so use its pin change interrupt there.
+#if defined(__AVR_ATmega328P__) || defined(__AVR_ATmega168__)
+ISR(PCINT2_vect){
+  autosampler_pulse();
+}
+#endif
+
+
+//CRC-8 with polynomial 0x07 and an initial value of 0.
+byte crc8(const byte *data, byte length){
+  byte crc = 0;
+  for (byte i = 0; i < length; i++){
+    crc ^= data[i];
+    for (byte bit = 0; bit < 8; bit++){
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+
+void send_frame(byte opcode, byte sequence, const byte *payload, byte length){
+  byte header[3 + max_payload_length];
+  header[0] = opcode;
+  header[1] = sequence;
+  header[2] = length;
+  for (byte i = 0; i < length; i++){
+    header[3 + i] = payload[i];
+  }
+
+  Serial.write(frame_sync);
+  Serial.write(header, 3 + length);
+  Serial.write(crc8(header, 3 + length));
+}
+
+
+void put_long(byte *payload, unsigned long value){
+  for (byte i = 0; i < 4; i++){
+    payload[i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+
+//Answers a command with a line of text, or with a reply frame if the command was framed.
+//answer is the payload of the reply frame, or -1 for no payload.
+void reply(char command, byte sequence, bool framed, int answer, const char *text){
+  if (framed){
+    byte payload = answer;
+    send_frame(command | 0x80, sequence, &payload, answer < 0 ? 0 : 1);
+  }
+  else{
+    Serial.println(text);
+  }
+}
+
+
+void handle_command(char command, byte sequence, bool framed){
+  if (command == 'T'){
+    digitalWrite(5, LOW);
+    delay(2000);
+    digitalWrite(5, HIGH);
+    reply(command, sequence, framed, -1, "Signal Sent To Autosampler");
+  }
+  else if (command == 'R'){
+    if (digitalRead(7) == LOW){
+      reply(command, sequence, framed, 1, "Signal From Autosampler Detected");
+    }
+    else{
+      reply(command, sequence, framed, 0, "No Signal From Autosampler");
+    }
+  }
+  else if (command == 'S'){
+    if (autosampler_output_latch){
+      reply(command, sequence, framed, 1, "Autosampler Signal Latched As True");
+    }
+    else {
+      reply(command, sequence, framed, 0, "Autosampler Signal Latched As False");
+    }
+  }
+  else if (command == 'C'){
+    autosampler_output_latch = false;
+    reply(command, sequence, framed, -1, "Autosampler Signal Latch Cleared");
+  }
+  else if (command == 'P'){
+    //Only pulses after push mode is turned on are sent.
+    noInterrupts();
+    reported_pulse_count = autosampler_pulse_count;
+    interrupts();
+    push_mode = true;
+    reply(command, sequence, framed, -1, "Push Mode Enabled");
+  }
+  else if (command == 'N'){
+    push_mode = false;
+    reply(command, sequence, framed, -1, "Push Mode Disabled");
+  }
+  else if (command == 'B'){
+    reply(command, sequence, framed, -1, "Binary Mode Enabled");
+    binary_mode = true;
+  }
+  else if (command == 'X' && binary_mode){
+    reply(command, sequence, framed, -1, "Text Mode Enabled");
+    binary_mode = false;
+  }
+}
+
+
+//Adds a byte to the frame being read and handles the frame once it is complete.
+void read_frame_byte(byte received_byte){
+  if (frame_position == 0){
+    //Skip anything between frames until the start of the next one.
+    if (received_byte == frame_sync){
+      frame_position = 1;
+    }
+    return;
+  }
+
+  frame[frame_position - 1] = received_byte;
+  frame_position++;
+
+  //The length is the third byte after the sync byte.
+  if (frame_position == 4 && frame[2] > max_payload_length){
+    frame_position = 0;
+    return;
+  }
+
+  if (frame_position < 5 || frame_position < 5 + frame[2]){
+    return;
+  }
+
+  byte length = 3 + frame[2];
+  frame_position = 0;
+  if (crc8(frame, length) == frame[length]){
+    handle_command(frame[0], frame[1], true);
+  }
+  else{
+    send_frame(frame_nak, frame[1], 0, 0);
+  }
+}
+
 
 void setup() {
   pinMode(5, OUTPUT);
@@ -8,6 +189,13 @@ void setup() {
 
   digitalWrite(5, HIGH);
 
+#if defined(__AVR_ATmega328P__) || defined(__AVR_ATmega168__)
+  PCICR |= (1 << PCIE2);
+  PCMSK2 |= (1 << PCINT23);
+#else
+  attachInterrupt(digitalPinToInterrupt(7), autosampler_pulse, FALLING);
+#endif
+
 }
 
 void loop() {
@@ -17,36 +205,41 @@ void loop() {
   }
 
 
-  //Look for a T sent through the serial port.
-  //If found then toggle the output high to signal the autosampler.
-  if (Serial.available() >0){
-    recieved_char = Serial.read();
-    if (recieved_char == 'T'){
-      digitalWrite(5, LOW);
-      delay(2000);
-      digitalWrite(5, HIGH);
-      Serial.println("Signal Sent To Autosampler");
-    }
-    else if (recieved_char == 'R'){
-      if (digitalRead(7) == LOW){
-        Serial.println("Signal From Autosampler Detected");
+  //In push mode send a line for every new pulse with the pulse count and the time it happened.
+  if (push_mode){
+    noInterrupts();
+    unsigned long pulse_count = autosampler_pulse_count;
+    unsigned long pulse_millis = autosampler_pulse_millis;
+    interrupts();
+
+    if (pulse_count != reported_pulse_count){
+      reported_pulse_count = pulse_count;
+      if (binary_mode){
+        byte payload[8];
+        put_long(payload, pulse_count);
+        put_long(payload + 4, pulse_millis);
+        send_frame('E', 0, payload, 8);
       }
       else{
-        Serial.println("No Signal From Autosampler");
-      } 
-    }
-    else if (recieved_char == 'S'){
-      if (autosampler_output_latch){
-        Serial.println("Autosampler Signal Latched As True");
-      }
-      else {
-        Serial.println("Autosampler Signal Latched As False");
+        Serial.print("Autosampler Signal Event ");
+        Serial.print(pulse_count);
+        Serial.print(" ");
+        Serial.println(pulse_millis);
       }
     }
-    else if (recieved_char == 'C'){
-      autosampler_output_latch = false;
-      Serial.println("Autosampler Signal Latch Cleared");
+  }
+
+
+  //Look for a command sent through the serial port, a single character or a frame, and handle it.
+  //Frames are read in text mode too, so the bytes of a frame sent just after a restart aren't taken as commands.
+  if (Serial.available() >0){
+    recieved_char = Serial.read();
+    if (binary_mode || frame_position > 0 || (byte)recieved_char == frame_sync){
+      read_frame_byte(recieved_char);
+    }
+    else{
+      handle_command(recieved_char, 0, false);
     }
   }
-  
+
 }
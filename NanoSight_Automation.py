@@ -1,556 +1,3863 @@
-import wx
 import threading
-from pywinauto.application import Application
-import pywinauto
 import time
 import re
-import serial
-import serial.tools.list_ports
-import pandas
 import os
-import uiautomation as automation
 import errno
-import wx.lib.agw.genericmessagedialog as GMD
+import collections
+import queue
+import contextlib
+import functools
+import json
+import csv
+import concurrent.futures
+import hashlib
+import importlib.util
+import sys
+import struct
+import select
+import random
+import ctypes
+import ctypes.util
+import argparse
+import asyncio
+
+## wx, pandas, and pyserial take a while to import, so they are imported where they are first needed, 
+## and the GUI is in NanoSight_GUI.py. A headless batch then doesn't import wx at all. 
+## NanoSight_Benchmark.py --import-time checks that importing this module stays fast.
 
 __version__ = "1.0.0"
 
 
-EVT_PULLED_PLUG = wx.NewId()
-EVT_THREAD_ABORTED = wx.NewId()
+## The events the batch thread posts to the GUI through its drivers.
+EVT_PULLED_PLUG = "Pulled Plug"
+EVT_THREAD_ABORTED = "Thread Aborted"
+
+class BatchEvent(object):
+    """An event posted by the batch thread. It has GetEventType like a wx event, and the GUI posts 
+    a wx event of the matching type for it."""
+    def __init__(self, event_type):
+        self.event_type = event_type
+    
+    def GetEventType(self):
+        return self.event_type
+        
+
+
 
-## Make new events so the thread can signal the main GUI.
-class PulledPlugEvent(wx.PyEvent):
+class PulledPlugEvent(BatchEvent):
     def __init__(self):
-        wx.PyEvent.__init__(self)
-        self.SetEventType(EVT_PULLED_PLUG)
+        BatchEvent.__init__(self, EVT_PULLED_PLUG)
         
 
 
 
-class ThreadAbortedEvent(wx.PyEvent):
+class ThreadAbortedEvent(BatchEvent):
     def __init__(self):
-        wx.PyEvent.__init__(self)
-        self.SetEventType(EVT_THREAD_ABORTED)
+        BatchEvent.__init__(self, EVT_THREAD_ABORTED)
         
 
+
+
+## The buttons and icons of the messages the batch shows through its drivers' ui, and the buttons 
+## Show_Message returns. They have the values of the wx constants of the same names so the GUI can 
+## pass them to wx.MessageDialog as they are.
+MESSAGE_OK = 0x4
+MESSAGE_YES_NO = 0xA
+ICON_EXCLAMATION = 0x100
+ICON_ERROR = 0x200
+ICON_QUESTION = 0x400
+ID_OK = 5100
+ID_YES = 5103
+ID_NO = 5104
+
         
         
 
-## Class taken from https://wiki.wxpython.org/LongRunningTasks and modified.
-# Thread class that executes processing
-class BatchThread(threading.Thread):
-    """Batch Thread Class."""
-    def __init__(self, batch_data):
-        """Init Serial Thread Class."""
-        threading.Thread.__init__(self)
-        self.batch_data = batch_data
-        self.sample_df = batch_data.sample_df
-        self.want_abort = False
-        self.daemon = True
-        # This starts the thread running on creation, but you could
-        # also make the GUI thread responsible for calling this
-        self.start() 
+## How long to wait for the Arduino to respond to a command, in seconds.
+SERIAL_RESPONSE_TIMEOUT = 1
+## The Arduino holds the trigger output for 2 seconds before responding to a "T".
+SERIAL_TRIGGER_RESPONSE_TIMEOUT = 3
+## How long to wait between polls of the Arduino, in seconds.
+SERIAL_POLL_INTERVAL = 0.1
+## How long to keep looking for the Arduino after it is disconnected before aborting the batch, in seconds. 0 aborts straight away.
+ARDUINO_RECONNECT_GRACE = 60
+## How often to look for the Arduino while it is disconnected, in seconds.
+ARDUINO_RECONNECT_POLL_INTERVAL = 0.5
+## The Arduino restarts when its port is opened and ignores commands until its bootloader is done, in seconds.
+ARDUINO_BOOT_TIME = 2
+
+
+## How long to wait for the NTA window to be ready before carrying on anyway, in seconds.
+NTA_READY_TIMEOUT = 2
+## How long to wait for an NTA control to reach the expected state before giving up, in seconds.
+NTA_WAIT_TIMEOUT = 10
+## How often to check the condition in Wait_For, in seconds.
+WAIT_POLL_INTERVAL = 0.1
+## How long to wait after the autosampler signals before triggering it, so it has moved on to its trigger command and the 
+## same output signal isn't latched twice, and after starting an acquisition before resetting the latch, so the autosampler 
+## has turned off its output, in seconds.
+AS_TRIGGER_SETTLE_TIME = 6
+AS_ACQUIRE_SETTLE_TIME = 5
+## If True the waits above end once the Arduino reports the autosampler output off and AS_SETTLE_TIME more seconds have passed, 
+## instead of always taking their full time.
+AS_SETTLE_ON_OUTPUT_OFF = False
+AS_SETTLE_TIME = 1
+
+## What the steps that wait for something return when they give up waiting.
+TIME_OUT = "Time Out"
+
+## NTA 3.3 seems to lock up after processing about 4 samples in a row, so restart it after this many. 0 turns periodic restarts off.
+NTA_RESTART_EVERY = 4
+## How long NTA has to become enabled after an export before it is considered unresponsive, in seconds.
+NTA_HEALTH_TIMEOUT = 10
+## How long to wait for NTA to start again after restarting it, in seconds.
+NTA_RESTART_TIMEOUT = 180
+## How many times a step that timed out or failed, like signalling the autosampler, is tried before the operator is asked 
+## what to do, and how long to wait before the first retry and at most before any retry, in seconds.
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 1
+RETRY_MAX_BACKOFF = 30
+## Shown after the message of a wait for the end of an NTA script that is given up, since the batch goes on without it.
+NTA_SCRIPT_GAVE_UP = "The batch is carrying on with the next step."
+## How long processing a sample is assumed to take, in seconds, when deciding whether it fits in an autosampler move 
+## before any sample of the batch has been processed. After that the longest time processing has taken is used.
+PIPELINE_PROCESSING_ESTIMATE = 30
+
+## The states a batch ends in when it doesn't complete. Leaving an acquisition state for one of these cancels the acquisition.
+BATCH_FAILURE_STATES = ["Stopped", "Aborted", "Pulled Plug"]
+
+
+## Polling schedule for NTA_Window_Check, in seconds. The first check after a UI action is 
+## repeated quickly and the interval grows by the backoff factor up to the max interval, which 
+## is longer for waits of more than a minute.
+WINDOW_CHECK_FIRST_INTERVAL = 0.05
+WINDOW_CHECK_BACKOFF = 1.5
+WINDOW_CHECK_SHORT_MAX_INTERVAL = 0.5
+WINDOW_CHECK_LONG_MAX_INTERVAL = 2
+
+
+## Lines sent by the Arduino and the kind of event each one is parsed into.
+ARDUINO_RESPONSES = {"Signal Sent To Autosampler":"Signal Sent",
+                     "Signal From Autosampler Detected":"Signal Detected",
+                     "No Signal From Autosampler":"No Signal",
+                     "Autosampler Signal Latched As True":"Latched",
+                     "Autosampler Signal Latched As False":"Not Latched",
+                     "Autosampler Signal Latch Cleared":"Latch Cleared",
+                     "Push Mode Enabled":"Push Mode Enabled",
+                     "Push Mode Disabled":"Push Mode Disabled",
+                     "Binary Mode Enabled":"Binary Mode Enabled",
+                     "Text Mode Enabled":"Text Mode Enabled"}
+
+## Line pushed by the Arduino in push mode for every autosampler pulse with the pulse count and the Arduino's millis().
+PUSH_EVENT_REGEX = re.compile(r"Autosampler Signal Event (\d+) (\d+)$")
+
+
+## Talk to the Arduino in framed binary instead of lines of text. Only turn this on for Arduinos with firmware 
+## that supports it. Even then the batch asks for it with the text command "B" before sending any frame.
+ARDUINO_BINARY_PROTOCOL = False
+
+## Binary frames are FRAME_SYNC, opcode, sequence number, payload length, payload, and the CRC-8 of opcode through payload.
+## A reply has the opcode of its command with FRAME_REPLY_BIT set and the command's sequence number.
+FRAME_SYNC = 0xA5
+FRAME_REPLY_BIT = 0x80
+FRAME_NAK = 0x15
+FRAME_PULSE = ord("E")
+FRAME_MAX_PAYLOAD = 8
+
+## Event kinds of the replies to each command in binary mode, indexed by the reply's payload byte, 0 if it has none.
+BINARY_RESPONSES = {"T":["Signal Sent"],
+                    "R":["No Signal", "Signal Detected"],
+                    "S":["Not Latched", "Latched"],
+                    "C":["Latch Cleared"],
+                    "P":["Push Mode Enabled"],
+                    "N":["Push Mode Disabled"],
+                    "B":["Binary Mode Enabled"],
+                    "X":["Text Mode Enabled"]}
+
+
+## count is the number of autosampler pulses the host had seen when the event was read.
+## millis is the Arduino's clock when a pulse happened and is only set for pulse events.
+## sequence is the sequence number of the binary frame the event came in, and None for text.
+SerialEvent = collections.namedtuple("SerialEvent", ["kind", "line", "time", "count", "millis", "sequence"])
+SerialEvent.__new__.__defaults__ = (None, None, None)
+
+
+
+
+def CRC8(data):
+    """Returns the CRC-8 of data with polynomial 0x07 and an initial value of 0, as the Arduino works it out."""
     
+    crc = 0
+    for byte in bytearray(data):
+        crc ^= byte
+        for bit in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+
+
+def Encode_Frame(opcode, sequence, payload = b""):
+    """Returns the bytes of a binary frame."""
     
-    def run(self):
-        """Run Batch Thread."""
-        
-        ## Create save directories.
-        if not self.Create_Save_Directories():
-            wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-            return
-        
-        
-        ## Connect to Arduino, NTA, and CETAC.
-        Arduino_connect_result = self.Connect_To_Arduino()
-        if not Arduino_connect_result or not self.Connect_To_NTA() or not self.Connect_To_CETAC():
-            if Arduino_connect_result:
-                self.ComPort.close()
-            wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-            return
-        
-        
-        ## Reset output latch in Arduino.
-        ## This reset of the latch is to make sure the latch starts from a known state before the batch begins.
-        while True:
-            send_response = self.Reset_AS_Output_Latch()
-            
-            if send_response == "Latch Cleared":
-                break
-            
-            elif send_response == "Abort":
-                self.Abort_Clean_Up()
-                return
-            
-            elif send_response == "Pulled Plug":
-                self.PP_Clean_Up()
-                return
-            
-            elif send_response == "Time Out":
-                message = "Time out reached while trying to communicate with the Arduino. \nCheck that the Arduino is functioning properly. \nClick Yes to try sending the signal again."
-                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.YES_NO | wx.ICON_QUESTION)
-                answer = msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-                if not answer == wx.ID_YES:
-                    self.Abort_Clean_Up()
-                    return
+    body = bytes(bytearray([opcode, sequence, len(payload)])) + payload
+    return bytes(bytearray([FRAME_SYNC])) + body + bytes(bytearray([CRC8(body)]))
 
+
+
+
+def Decode_Frame(received):
+    """Finds the first whole frame with a good CRC in the bytes received. Returns (opcode, sequence, 
+    payload, frame bytes) or None if there isn't a whole frame yet, the bytes left after it, and the 
+    number of corrupt frames skipped. Bytes outside a frame, which are what is left of a frame whose 
+    sync byte was corrupted, and frames with a bad CRC are skipped and counted as corrupt frames."""
+    
+    bad_frames = 0
+    while True:
+        start = received.find(bytes(bytearray([FRAME_SYNC])))
+        if start != 0 and len(received) > 0:
+            bad_frames += 1
+        if start < 0:
+            return None, b"", bad_frames
+        received = received[start:]
+        
+        if len(received) < 4:
+            return None, received, bad_frames
+        length = bytearray(received)[3]
+        if length > FRAME_MAX_PAYLOAD:
+            received = received[1:]
+            bad_frames += 1
+            continue
+        if len(received) < 5 + length:
+            return None, received, bad_frames
+        
+        frame = received[:5 + length]
+        if CRC8(frame[1:-1]) != bytearray(frame)[-1]:
+            received = received[1:]
+            bad_frames += 1
+            continue
+        
+        opcode, sequence = bytearray(frame)[1:3]
+        return (opcode, sequence, frame[4:-1], frame), received[5 + length:], bad_frames
+
+
+
+
+class SerialIOThread(threading.Thread):
+    """Serial I/O Thread Class. Owns the serial connection to the Arduino. Commands from the batch
+    thread are written to the Arduino and every line read from it is parsed into a SerialEvent and
+    put on the events queue. If the connection is lost and there is no reconnector, or the reconnector 
+    can't find the Arduino again, a \"Disconnected\" event is queued and the thread stops.
+    
+    When the Arduino is in push mode it sends a \"Pulse\" event for every autosampler pulse. These are also 
+    counted so waiting code can tell whether a pulse happened since some earlier event without polling."""
+    def __init__(self, ComPort, profiler = None, clock = None, reconnector = None):
+        """Init Serial I/O Thread Class."""
+        threading.Thread.__init__(self)
+        self.ComPort = ComPort
+        self.profiler = profiler
+        ## Timeouts are measured with the clock so they run at the same speed as a simulated Arduino.
+        self.clock = clock if clock is not None else SystemClock()
+        ## Use a short read timeout so commands don't wait behind a read.
+        self.ComPort.timeout = 0.02
+        self.reconnector = reconnector
+        self.events = queue.Queue()
+        self.commands = queue.Queue()
+        self.want_stop = False
+        self.disconnected = False
+        self.reconnecting = False
+        self.push_mode = False
+        ## True from reconnecting in push mode until the Arduino answers the latch check that follows.
+        self.resync_pending = False
+        ## In binary mode commands are sent as frames and replies are matched to them by sequence number.
+        self.binary_mode = False
+        self.sequence = 0
+        self.bad_frames = 0
+        
+        self.pulse_count = 0
+        ## The Arduino counts pulses from 0 again when it restarts, so its counts are added to the count before the restart.
+        self.pulse_offset = 0
+        self.pulse_millis = []
+        self.missed_pulses = 0
+        self.pulse_condition = threading.Condition()
         
-        ## Make sure CETAC is connected to the autosampler.
-        if not self.CETAC_Check_For_COM():
-            self.ComPort.close()
-            wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-            return
-        
-        ## Make sure CETAC has a script loaded.
-        if not self.CETAC_Check_For_Active_Script():
-            self.ComPort.close()
-            wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-            return
-        
-        ######################
-        ## Acquire the samples.
-        ######################
-        for i in range(len(self.sample_df)):
-            
-            ## Before starting make sure the user hasn't already wanted to abort.
-            if self.want_abort:
-                self.Abort_Clean_Up()
-                return
-            
-            ## Set the label in acquistion progress to in progress and change color to blue.
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "In Progress")
-            self.batch_data.sample_list_ctrl.SetItemBackgroundColour(i, "light blue")
-            
-            ## Set base filename for sample.
-            if not self.NTA_Set_Filename(self.sample_df.loc[:, "Save Directory"][i], self.sample_df.loc[:, "Sample Name"][i]):
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            ## Set up correct script in autosampler and NanoSight.
-            if not self.NTA_Load_Script(self.sample_df.loc[:, "Acquire Script"][i]):
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            
-            ## Check for abort again.
-            if self.want_abort:
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            
+        self.daemon = True
+        self.start()
 
-            
-            ## Flush the input buffer before starting the autosampler script to make sure
-            ## signals from a previous run or false signals aren't misinterpreted.
-            self.ComPort.reset_input_buffer()
-            self.ComPort.flushInput()
 
-            
-            ## If this is the first sample start the script, otherwise send trigger to MVX if it is ready.
-            if i == 0:
-                
-                ## Close any windows that may be left open by the user.
-                self.CETAC_Close_All_Windows()
-            
-                ## Start autosampler script.
-                run_response = self.CETAC_Run_Script()
-                if run_response == "Run Script Button Disabled" or run_response == "Abort Script Button Disabled" or run_response == "No Samples Selected":
-                    self.ComPort.close()
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-                    return
-                
-                ## Check for errors after starting the script.
-                if self.CETAC_Check_For_Errors():
-                    self.ComPort.close()
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-                    return
-                
+    def run(self):
+        """Run Serial I/O Thread."""
 
-            else:    
-            
-                ## Check for errors.
-                if self.CETAC_Check_For_Errors():
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    self.Abort_Clean_Up()
-                    return
-                
-                ## Wait for signal from autosampler.
-                timeout = 15
-                listen_response = self.Check_AS_Output_Latch(timeout)
-                ## Check to see if the batch was aborted while listening or the Arduino was disconnected.
-                if listen_response == "Abort" or listen_response == "Time Out":
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    self.Abort_Clean_Up()
-                    return
+        received = b""
+        while not self.want_stop:
+            try:
+                while not self.commands.empty():
+                    self.ComPort.write(self.commands.get_nowait())
+
+                data = self.ComPort.read(max(1, self.ComPort.in_waiting))
+
+            ## pyserial's SerialException is an OSError, so the port failing is caught here without importing pyserial.
+            except OSError:
+                if self.Reconnect():
+                    received = b""
+                    continue
                 
-                elif listen_response == "Pulled Plug":
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    self.PP_Clean_Up()
-                    return
+                with self.pulse_condition:
+                    self.disconnected = True
+                    self.events.put(SerialEvent("Disconnected", "", time.time(), self.pulse_count))
+                    self.pulse_condition.notify_all()
+                return
+
+            received += data
+            while True:
+                ## The mode is checked for every event since the reply that switches it is followed by the other format.
+                if self.binary_mode:
+                    frame, received, bad_frames = Decode_Frame(received)
+                    self.bad_frames += bad_frames
+                    if frame is None:
+                        break
+                    event = self.Parse_Frame(*frame)
                 
+                elif b"\n" in received:
+                    line, received = received.split(b"\n", 1)
+                    event = self.Parse_Line(line)
                 
+                else:
+                    break
                 
-                ## Wait some time before sending signal to autosampler to make sure 
-                ## it has had time to move on to the trigger command, and so we do 
-                ## not relatch the same output signal twice.
-                time.sleep(6)
+                if event.kind == "Pulse":
+                    self.Record_Pulse(event)
+                elif event.kind in ["Push Mode Enabled", "Push Mode Disabled"]:
+                    self.push_mode = event.kind == "Push Mode Enabled"
+                elif event.kind in ["Binary Mode Enabled", "Text Mode Enabled"]:
+                    self.binary_mode = event.kind == "Binary Mode Enabled"
+                elif event.kind in ["Latched", "Not Latched"] and self.resync_pending:
+                    self.Resynchronise_Latch(event)
                 
-                ## Reset output latch in Arduino.
-                ## If something goes wrong with the Arduino at this point then it can
-                ## be fixed or replaced and the batch can continue so allow the user to retry sending the signal to the Arduino.
-                while True:
-                    send_response = self.Reset_AS_Output_Latch()
-                    
-                    if send_response == "Latch Cleared":
-                        break
-                    
-                    elif send_response == "Abort":
-                        self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                        self.Abort_Clean_Up()
-                        return
-                    
-                    elif send_response == "Pulled Plug":
-                        self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                        self.PP_Clean_Up()
-                        return
-                    
-                    elif send_response == "Time Out":
-                        message = "Time out reached while trying to communicate with the Arduino. \nCheck that the Arduino is functioning properly. \nClick Yes to try sending the signal again."
-                        msg_dlg = wx.MessageDialog(None, message, "Warning", wx.YES_NO | wx.ICON_QUESTION)
-                        answer = msg_dlg.ShowModal()
-                        msg_dlg.Destroy()
-                        if not answer == wx.ID_YES:
-                            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                            self.Abort_Clean_Up()
-                            return
-                        
-           
-            
-            
-                ## Send signal to autosampler.
-                ## If something goes wrong with the Arduino at this point then it can
-                ## be fixed or replaced and the batch can continue so allow the user to retry sending the signal to the AS.
-                while True:
-                    send_response = self.Send_Signal_To_AS()
-                    
-                    if send_response == "Signal Sent":
-                        break
-                    
-                    elif send_response == "Abort":
-                        self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                        self.Abort_Clean_Up()
-                        return
-                    
-                    elif send_response == "Pulled Plug":
-                        self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                        self.PP_Clean_Up()
-                        return
-                    
-                    elif send_response == "Time Out":
-                        message = "Time out reached while trying to signal the autosampler. \nCheck that the Arduino is functioning properly. \nClick Yes to try sending the signal again."
-                        msg_dlg = wx.MessageDialog(None, message, "Warning", wx.YES_NO | wx.ICON_QUESTION)
-                        answer = msg_dlg.ShowModal()
-                        msg_dlg.Destroy()
-                        if not answer == wx.ID_YES:
-                            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                            self.Abort_Clean_Up()
-                            return
-                        
-                        
-                        
-                ## Check that script is still running in CETAC.
-                ## If it is not then the most likely cause is that less samples 
-                ## were selected in Select Sample Set than were in the sample list file.
-                time.sleep(5)
-                if not self.CETAC_Is_Script_Running():
-                    message = "The CETAC script is no longer running. The most likely cause is that there were more samples in the Sample List File than were selected in Select Sample Set."
-                    msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-                    answer = msg_dlg.ShowModal()
-                    msg_dlg.Destroy()
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    self.Abort_Clean_Up()
-                    return
-            
-            
-            
-            
-        
-            ## Wait for signal from autosampler.
-            timeout = 15
-            listen_response = self.Check_AS_Output_Latch(timeout)
-            ## Check to see if the batch was aborted while listening or the Arduino was disconnected.
-            if listen_response == "Abort" or listen_response == "Time Out":
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
+                self.events.put(event)
+
+
+
+
+    def Reconnect(self):
+        """Waits for the reconnector to find and reopen the Arduino after the connection was lost. 
+        Commands queued while it was disconnected are thrown away, since whoever sent them has timed 
+        out and will send them again. Returns True if the Arduino is connected again."""
+        
+        if self.reconnector is None or self.want_stop:
+            return False
+        
+        self.reconnecting = True
+        try:
+            try:
+                self.ComPort.close()
+            except OSError:
+                pass
             
-            elif listen_response == "Pulled Plug":
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.PP_Clean_Up()
-                return
+            if self.profiler is None:
+                ComPort = self.reconnector.Reconnect(lambda: self.want_stop)
+            else:
+                with self.profiler.Span("Arduino Reconnect", category = "serial"):
+                    ComPort = self.reconnector.Reconnect(lambda: self.want_stop)
             
+            if ComPort is None:
+                return False
             
+            ComPort.timeout = 0.02
+            self.ComPort = ComPort
+            while not self.commands.empty():
+                self.commands.get_nowait()
+            self.Resynchronise()
+            self.events.put(SerialEvent("Reconnected", "", time.time(), self.pulse_count))
+            return True
+        
+        finally:
+            self.reconnecting = False
+
+
+
+
+    def Resynchronise(self):
+        """The Arduino restarts when its port is opened, so push mode is turned off, its pulse count starts 
+        from 0, and its latch only remembers the autosampler output if the output is still on. Turns push 
+        mode back on if it was on and asks for the latch, which Resynchronise_Latch turns into the pulse 
+        that the Arduino can't push for an output that was already on when it restarted."""
+        
+        with self.pulse_condition:
+            self.pulse_offset = self.pulse_count
+            ## Cycle times aren't measured across the restart since the Arduino's clock restarts too.
+            self.pulse_millis.append(None)
+        
+        ## The Arduino restarts in text mode, so binary mode is turned back on after the other commands.
+        binary_mode = self.binary_mode
+        self.binary_mode = False
+        if self.push_mode:
+            self.resync_pending = True
+            self.Write(b"P")
+            self.Write(b"S")
+        if binary_mode:
+            self.Write(b"B")
+
+
+
+
+    def Resynchronise_Latch(self, event):
+        """Counts a pulse for the latch being set after a reconnect in push mode, unless a pulse was pushed since."""
+        
+        self.resync_pending = False
+        with self.pulse_condition:
+            if event.kind == "Latched" and self.pulse_count == self.pulse_offset:
+                self.pulse_count += 1
+                self.pulse_offset = self.pulse_count
+                self.pulse_condition.notify_all()
+
+
+
+
+    def Parse_Line(self, line):
+        """Turns a line of bytes read from the Arduino into a SerialEvent. Lines that are
+        not recognized are given the kind \"Unknown\"."""
+
+        line = line.decode("ascii", errors = "replace").strip()
         
+        push_match = PUSH_EVENT_REGEX.match(line)
+        if push_match:
+            return SerialEvent("Pulse", line, time.time(), self.pulse_offset + int(push_match.group(1)), int(push_match.group(2)))
         
-            ## Start NanoSight script.
-            if not self.NTA_Run_Script():
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.PP_Clean_Up()
-                return
-            
-            
-            ## Reset output latch in Arduino.
-            ## If something goes wrong with the Arduino at this point then it can
-            ## be fixed or replaced and the batch can continue so allow the user to retry sending the signal to the Arduino.
-            ## Wait for 5 seconds before resetting latch to make sure the autosampler has turned off its output.
-            time.sleep(5)
+        return SerialEvent(ARDUINO_RESPONSES.get(line, "Unknown"), line, time.time(), self.pulse_count)
+
+
+
+
+    def Parse_Frame(self, opcode, sequence, payload, frame):
+        """Turns a binary frame read from the Arduino into a SerialEvent. A NAK, sent by the Arduino 
+        for a command frame that arrived corrupted, is given the kind \"Bad Frame\"."""
+        
+        line = frame.hex()
+        if opcode == FRAME_PULSE and len(payload) == 8:
+            pulse_count, pulse_millis = struct.unpack("<II", payload)
+            return SerialEvent("Pulse", line, time.time(), self.pulse_offset + pulse_count, pulse_millis, sequence)
+        
+        elif opcode == FRAME_NAK:
+            return SerialEvent("Bad Frame", line, time.time(), self.pulse_count, None, sequence)
+        
+        kinds = BINARY_RESPONSES.get(chr(opcode & ~FRAME_REPLY_BIT & 0xFF), []) if opcode & FRAME_REPLY_BIT else []
+        index = bytearray(payload)[0] if len(payload) > 0 else 0
+        kind = kinds[index] if index < len(kinds) else "Unknown"
+        return SerialEvent(kind, line, time.time(), self.pulse_count, None, sequence)
+
+
+
+
+    def Record_Pulse(self, event):
+        """Updates the pulse count from a \"Pulse\" event and wakes up anything waiting for a pulse.
+        Gaps in the Arduino's pulse counter mean pulse lines were lost and are added to missed_pulses."""
+
+        with self.pulse_condition:
+            if self.pulse_millis and event.count > self.pulse_count + 1:
+                self.missed_pulses += event.count - self.pulse_count - 1
+
+            self.pulse_count = event.count
+            self.pulse_millis.append(event.millis)
+            self.pulse_condition.notify_all()
+
+
+
+
+    def Wait_For_Pulse(self, after_count, timeout):
+        """Waits up to timeout seconds for the pulse count to go above after_count. Returns
+        \"Pulse\" if it did, \"Disconnected\" if the connection was lost, or None if timeout
+        seconds passed without a pulse."""
+
+        deadline = self.clock.time() + timeout
+        with self.pulse_condition:
             while True:
-                send_response = self.Reset_AS_Output_Latch()
-                
-                if send_response == "Latch Cleared":
-                    break
-                
-                elif send_response == "Abort":
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    self.Abort_Clean_Up()
-                    return
-                
-                elif send_response == "Pulled Plug":
-                    self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                    self.PP_Clean_Up()
-                    return
-                
-                elif send_response == "Time Out":
-                    message = "Time out reached while trying to communicate with the Arduino. \nCheck that the Arduino is functioning properly. \nClick Yes to try sending the signal again."
-                    msg_dlg = wx.MessageDialog(None, message, "Warning", wx.YES_NO | wx.ICON_QUESTION)
-                    answer = msg_dlg.ShowModal()
-                    msg_dlg.Destroy()
-                    if not answer == wx.ID_YES:
-                        self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                        self.Abort_Clean_Up()
-                        return
-            
-            
-
-            ## Wait for end of script signal from NanoSight.
-            listen_response = self.Listen_For_End_Of_Script_NTA_Signal()
-            ## Check to see if the batch was aborted while listening.
-            if listen_response == "Aborted":
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
+                if self.pulse_count > after_count:
+                    return "Pulse"
+                elif self.disconnected:
+                    return "Disconnected"
+
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    return None
+
+                self.pulse_condition.wait(self.clock.real_seconds(remaining))
+
+
+
+
+    def Cycle_Times(self):
+        """Returns the times in seconds between consecutive autosampler pulses as measured by the Arduino."""
+
+        return [(later - earlier)/1000 for earlier, later in zip(self.pulse_millis, self.pulse_millis[1:]) if earlier is not None and later is not None]
+
+
+
+
+    def Write(self, command):
+        """Queues the command bytes to be written to the Arduino."""
+
+        self.commands.put(command)
+
+
+
+
+    def Clear_Events(self):
+        """Throws away any events that haven't been handled yet. A \"Disconnected\" event is
+        kept so that it is still seen by the next wait."""
+
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event.kind == "Disconnected":
+                self.events.put(event)
+                break
+
+
+
+
+    def Wait_For_Event(self, kinds, timeout, sequence = None):
+        """Waits up to timeout seconds for an event with a kind in kinds, and the sequence number 
+        sequence if it is given. Other events are thrown away, so a late reply to an earlier command 
+        isn't mistaken for the reply to this one. Returns the event, a \"Disconnected\" event if the 
+        connection was lost, or None if timeout seconds passed without a matching event."""
+
+        deadline = self.clock.time() + timeout
+        while True:
+            remaining = deadline - self.clock.time()
+
+            ## A command sent while the Arduino is being reconnected is lost, so wait for the reconnect to finish before timing out.
+            if remaining <= 0 and self.reconnecting:
+                remaining = SERIAL_POLL_INTERVAL
+            elif remaining <= 0:
+                return None
+
+            try:
+                event = self.events.get(timeout = self.clock.real_seconds(remaining))
+            except queue.Empty:
+                if self.reconnecting:
+                    continue
+                return None
+
+            if event.kind == "Disconnected" or (event.kind in kinds and (sequence is None or event.sequence == sequence)):
+                return event
+
+
+
+
+    def Request(self, command, kinds, timeout):
+        """Writes command to the Arduino and waits up to timeout seconds for a response with
+        a kind in kinds. Returns the same as Wait_For_Event."""
+
+        if self.disconnected:
+            return SerialEvent("Disconnected", "", time.time(), self.pulse_count)
+
+        if self.profiler is None:
+            return self._Request(command, kinds, timeout)
+
+        with self.profiler.Span("Serial " + command.decode("ascii", errors = "replace"), category = "serial"):
+            return self._Request(command, kinds, timeout)
+
+
+    def _Request(self, command, kinds, timeout):
+        if not self.binary_mode:
+            self.Write(command)
+            return self.Wait_For_Event(kinds, timeout)
+
+        ## Sequence number 0 is left for frames the Arduino pushes without being asked.
+        self.sequence = self.sequence % 255 + 1
+        frame = Encode_Frame(bytearray(command)[0], self.sequence)
+        deadline = self.clock.time() + timeout
+        self.Write(frame)
+        while True:
+            event = self.Wait_For_Event(kinds + ["Bad Frame"], deadline - self.clock.time(), self.sequence)
+            ## The Arduino got the command corrupted, so send it again.
+            if event is not None and event.kind == "Bad Frame":
+                self.Write(frame)
+                continue
+            return event
+
+
+
+
+    def Close(self):
+        """Stops the thread and closes the serial connection."""
+
+        self.want_stop = True
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(1)
+
+        try:
+            self.ComPort.close()
+        except OSError:
+            pass
+
+
+
+
+class ArduinoReconnector(object):
+    """Finds the Arduino again after its USB connection drops. The USB identity of the port it was 
+    connected on is remembered, and the serial ports are polled for the same identity, which may come 
+    back under a different port name, until grace seconds have passed. port_identities() returns a 
+    dictionary of port name -> USB identity and open_port(port_name) opens and configures a port."""
+    
+    def __init__(self, port_identities, open_port, port_name, clock, grace = ARDUINO_RECONNECT_GRACE, poll_interval = ARDUINO_RECONNECT_POLL_INTERVAL):
+        self.port_identities = port_identities
+        self.open_port = open_port
+        self.port_name = port_name
+        self.clock = clock
+        self.grace = grace
+        self.poll_interval = poll_interval
+        self.reconnects = 0
+        
+        try:
+            self.identity = port_identities().get(port_name)
+        except OSError:
+            self.identity = None
+    
+    
+    def Find_Port(self):
+        """Returns the name of the port the Arduino is on, or None if it isn't back or can't be told apart."""
+        
+        identities = self.port_identities()
+        if self.identity is None:
+            return self.port_name if self.port_name in identities else None
+        
+        port_names = [port_name for port_name, identity in identities.items() if identity == self.identity]
+        if self.port_name in port_names:
+            return self.port_name
+        elif len(port_names) == 1:
+            return port_names[0]
+        else:
+            return None
+    
+    
+    def Reconnect(self, should_stop = lambda: False):
+        """Polls for the Arduino until it can be opened again, grace seconds pass, or should_stop() is True. 
+        Returns the opened port once the Arduino has finished restarting, or None if it wasn't found."""
+        
+        deadline = self.clock.time() + self.grace
+        while self.clock.time() < deadline and not should_stop():
+            self.clock.sleep(self.poll_interval)
             
+            try:
+                port_name = self.Find_Port()
+                if port_name is None:
+                    continue
+                ComPort = self.open_port(port_name)
+            ## The port is listed before it is ready to be opened.
+            except OSError:
+                continue
             
-            ## Set the label in acquistion progress to Complete and change color back to normal.
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Complete")
-            self.batch_data.sample_list_ctrl.SetItemBackgroundColour(i, "white")
+            self.port_name = port_name
+            self.reconnects += 1
+            self.clock.sleep(ARDUINO_BOOT_TIME)
+            return ComPort
+        
+        return None
+
+
+
+
+
+
+## How long the window registry trusts its index before enumerating the desktop again, in seconds.
+WINDOW_REGISTRY_TTL = 0.5
+
+
+
+
+class Win32WindowBackend(object):
+    """Window backend that reads the top level windows on the desktop through pywinauto."""
+
+    def __init__(self):
+        ## pywinauto only exists on Windows, so it is imported when the backend is made.
+        import pywinauto.findwindows
+        import pywinauto.handleprops
+        self.findwindows = pywinauto.findwindows
+        self.handleprops = pywinauto.handleprops
+
+    def enum_windows(self):
+        """Returns the handles of all top level windows."""
+        return self.findwindows.enum_windows()
+
+    def is_visible(self, handle):
+        """Returns True if the window is visible."""
+        return self.handleprops.isvisible(handle)
+
+    def text(self, handle):
+        """Returns the title of the window."""
+        return self.handleprops.text(handle)
+
+    def process_id(self, handle):
+        """Returns the ID of the process that owns the window."""
+        return self.handleprops.processid(handle)
+
+    def owner(self, handle):
+        """Returns the handle of the window that owns the window, such as the program a dialog 
+        belongs to, or None if it has no owner."""
+        return self.handleprops.parent(handle) or None
+
+
+
+
+class FakeWindowBackend(object):
+    """Window backend holding a list of windows that is set directly, so the window registry
+    can be used and benchmarked without a Windows desktop."""
+
+    def __init__(self):
+        self.windows = collections.OrderedDict()
+        self.next_handle = 1
+        self.enum_count = 0
+
+    def Add_Window(self, title, process_id, visible = True, owner = None):
+        """Adds a window, owned by the window with the handle owner if given, and returns its handle."""
+        handle = self.next_handle
+        self.next_handle += 1
+        self.windows[handle] = [title, process_id, visible, owner]
+        return handle
+
+    def Remove_Window(self, handle):
+        """Removes the window with the given handle."""
+        self.windows.pop(handle, None)
+
+    def Set_Title(self, handle, title):
+        """Changes the title of the window with the given handle."""
+        self.windows[handle][0] = title
+
+    def enum_windows(self):
+        self.enum_count += 1
+        return list(self.windows.keys())
+
+    def is_visible(self, handle):
+        return self.windows[handle][2]
+
+    def text(self, handle):
+        return self.windows[handle][0]
+
+    def process_id(self, handle):
+        return self.windows[handle][1]
+
+    def owner(self, handle):
+        return self.windows[handle][3]
+
+
+
+
+class WindowRegistry(object):
+    """Keeps an index of the visible top level windows that match a set of registered title patterns.
+
+    Each pattern is compiled once and only matched against a window when the window is new or its
+    title changed. The index is rebuilt from the desktop at most once every ttl seconds, or sooner
+    after Invalidate is called, so existence and dialog checks are dictionary lookups the rest of
+    the time. Checks can be scoped to a process ID, such as the NTA or CETAC process, so windows
+    from other programs with similar titles are not counted."""
+
+    def __init__(self, backend = None, ttl = WINDOW_REGISTRY_TTL, clock = time.time):
+        if backend is None:
+            backend = Win32WindowBackend()
+
+        self.backend = backend
+        self.ttl = ttl
+        self.clock = clock
+        self.patterns = collections.OrderedDict()
+        ## handle -> title, handle -> process ID, and handle -> names of the patterns its title matched.
+        self.titles = {}
+        self.process_ids = {}
+        self.handle_matches = {}
+        ## pattern name -> process ID -> number of matching windows in that process.
+        self.matches = {}
+        self.last_refresh = None
+        self.lock = threading.Lock()
+
+
+    def Register(self, name, regex):
+        """Adds a title pattern to the registry under name. The pattern is searched for
+        anywhere in the window title, like re.search."""
+
+        with self.lock:
+            self.patterns[name] = re.compile(regex)
+            self.matches[name] = {}
+            self.last_refresh = None
+
+
+    def Invalidate(self):
+        """Makes the next query enumerate the desktop again, for example after clicking something
+        that opens or closes a window."""
+
+        with self.lock:
+            self.last_refresh = None
+
+
+    def Refresh(self):
+        """Enumerates the visible top level windows and updates the index. Windows that were
+        already indexed with the same title are not matched again."""
+
+        with self.lock:
+            self._Refresh()
+
+
+    def _Refresh(self):
+        handles = set()
+        for handle in self.backend.enum_windows():
+            try:
+                if not self.backend.is_visible(handle):
+                    continue
+
+                title = self.backend.text(handle)
+                if handle not in self.process_ids:
+                    self.process_ids[handle] = self.backend.process_id(handle)
+
+            ## The window closed while it was being read.
+            except Exception:
+                continue
+
+            handles.add(handle)
+            if self.titles.get(handle) != title:
+                self._Remove_Handle(handle, keep_process_id = True)
+                self.titles[handle] = title
+                self.handle_matches[handle] = [name for name, pattern in self.patterns.items() if pattern.search(title)]
+                for name in self.handle_matches[handle]:
+                    process_counts = self.matches[name]
+                    process_counts[self.process_ids[handle]] = process_counts.get(self.process_ids[handle], 0) + 1
+
+        for handle in set(self.process_ids) - handles:
+            self._Remove_Handle(handle)
+
+        self.last_refresh = self.clock()
+
+
+    def _Remove_Handle(self, handle, keep_process_id = False):
+        process_id = self.process_ids.get(handle)
+        for name in self.handle_matches.pop(handle, []):
+            process_counts = self.matches[name]
+            process_counts[process_id] -= 1
+            if process_counts[process_id] == 0:
+                del process_counts[process_id]
+
+        self.titles.pop(handle, None)
+        if not keep_process_id:
+            self.process_ids.pop(handle, None)
+
+
+    def Is_Present(self, name, process_id = None):
+        """Returns True if a window whose title matches the pattern registered under name is open.
+        If process_id is given only windows belonging to that process are counted."""
+
+        with self.lock:
+            if self.last_refresh is None or self.clock() - self.last_refresh > self.ttl:
+                self._Refresh()
+
+            if process_id is None:
+                return len(self.matches[name]) > 0
+            else:
+                return process_id in self.matches[name]
+
+
+
+
+
+
+## How often the polling watcher checks the save directories for changes, in seconds.
+EXPERIMENT_INDEX_POLL_INTERVAL = 1
+
+## NTA names experiments <base filename>.nano, or <base filename> <date> <time>.nano if the date time option is on.
+NANO_FILE_REGEX = re.compile(r"^(?P<sample_name>.+?)(?: (?P<stamp>\d\d\d\d-\d\d-\d\d \d\d-\d\d-\d\d))?\.nano$")
+
+
+
+
+class ExperimentFileIndex(object):
+    """Index of the .nano experiment files in the save directories, so finding the experiment for a
+    sample is a dictionary lookup instead of listing and regex matching the whole directory.
+    
+    Each directory is scanned once when it is first watched and then kept up to date by a watcher
+    thread, using inotify on Linux and polling the directory modification times elsewhere. A lookup
+    that misses rescans the directory before giving up, so a late watcher never hides a file.
+    Wait_For_File returns as soon as the file for a sample appears."""
+    
+    def __init__(self, clock = None):
+        self.clock = clock if clock is not None else SystemClock()
+        ## directory -> sample name -> set of .nano file names for that sample.
+        self.directories = {}
+        self.condition = threading.Condition()
+        self.watcher = None
+    
+    
+    def Watch(self, directory):
+        """Scans directory into the index and starts watching it for changes."""
+        
+        directory = os.path.normpath(directory)
+        with self.condition:
+            if directory in self.directories:
+                return
+        
+        self.Scan(directory)
+        
+        with self.condition:
+            if self.watcher is None:
+                self.watcher = InotifyWatcher.Create(self) or PollingWatcher(self)
+        self.watcher.Add_Directory(directory)
+    
+    
+    def Scan(self, directory):
+        """Rebuilds the index for directory from a listing of it."""
+        
+        directory = os.path.normpath(directory)
+        samples = collections.defaultdict(set)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    match = NANO_FILE_REGEX.match(entry.name)
+                    if match:
+                        samples[match.group("sample_name")].add(entry.name)
+        except OSError:
+            pass
+        
+        with self.condition:
+            self.directories[directory] = samples
+            self.condition.notify_all()
+    
+    
+    def Add_File(self, directory, filename):
+        match = NANO_FILE_REGEX.match(filename)
+        if match:
+            with self.condition:
+                self.directories.setdefault(directory, collections.defaultdict(set))[match.group("sample_name")].add(filename)
+                self.condition.notify_all()
+    
+    
+    def Remove_File(self, directory, filename):
+        match = NANO_FILE_REGEX.match(filename)
+        if match:
+            with self.condition:
+                self.directories.get(directory, {}).get(match.group("sample_name"), set()).discard(filename)
+    
+    
+    def _Lookup(self, directory, sample_name):
+        filenames = self.directories.get(directory, {}).get(sample_name)
+        if not filenames:
+            return None
+        
+        ## Prefer the newest time stamped file, which also covers there being a non stamped file as well.
+        ## The time stamps sort in time order as strings.
+        stamped = [filename for filename in filenames if NANO_FILE_REGEX.match(filename).group("stamp")]
+        return os.path.join(directory, max(stamped) if stamped else min(filenames))
+    
+    
+    def Lookup(self, directory, sample_name):
+        """Returns the path of the newest .nano file for sample_name in directory, or None if there isn't one."""
+        
+        directory = os.path.normpath(directory)
+        with self.condition:
+            if directory in self.directories:
+                file_path = self._Lookup(directory, sample_name)
+                if file_path is not None:
+                    return file_path
+        
+        self.Scan(directory)
+        with self.condition:
+            return self._Lookup(directory, sample_name)
+    
+    
+    def Wait_For_File(self, directory, sample_name, timeout):
+        """Waits up to timeout seconds for a .nano file for sample_name to appear in directory.
+        Returns its path, or None if none appeared."""
+        
+        directory = os.path.normpath(directory)
+        file_path = self.Lookup(directory, sample_name)
+        deadline = self.clock.time() + timeout
+        with self.condition:
+            while file_path is None:
+                remaining = deadline - self.clock.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(self.clock.real_seconds(remaining))
+                file_path = self._Lookup(directory, sample_name)
+        
+        return file_path if file_path is not None else self.Lookup(directory, sample_name)
+    
+    
+    def Close(self):
+        """Stops the watcher thread."""
+        
+        with self.condition:
+            watcher, self.watcher = self.watcher, None
+        if watcher is not None:
+            watcher.Stop()
+
+
+
+
+class PollingWatcher(threading.Thread):
+    """Rescans a watched directory whenever its modification time changes, which happens
+    when a file is added to it, removed from it, or renamed."""
+    def __init__(self, index, interval = EXPERIMENT_INDEX_POLL_INTERVAL):
+        threading.Thread.__init__(self)
+        self.index = index
+        self.interval = interval
+        self.mtimes = {}
+        self.lock = threading.Lock()
+        self.want_stop = threading.Event()
+        self.daemon = True
+        self.start()
+    
+    
+    def Directory_Mtime(self, directory):
+        try:
+            return os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+    
+    
+    def Add_Directory(self, directory):
+        with self.lock:
+            self.mtimes[directory] = self.Directory_Mtime(directory)
+    
+    
+    def run(self):
+        while not self.want_stop.wait(self.index.clock.real_seconds(self.interval)):
+            with self.lock:
+                directories = list(self.mtimes.items())
+            
+            for directory, last_mtime in directories:
+                mtime = self.Directory_Mtime(directory)
+                if mtime != last_mtime:
+                    with self.lock:
+                        self.mtimes[directory] = mtime
+                    self.index.Scan(directory)
+    
+    
+    def Stop(self):
+        self.want_stop.set()
+
+
+
+
+class InotifyWatcher(threading.Thread):
+    """Updates the index from Linux inotify events, so new files are seen as soon as they are written."""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+    
+    @classmethod
+    def Create(cls, index):
+        """Returns an InotifyWatcher, or None if inotify isn't available."""
+        
+        if not sys.platform.startswith("linux"):
+            return None
+        
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+            fd = libc.inotify_init1(cls.IN_NONBLOCK | cls.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        
+        if fd < 0:
+            return None
+        return cls(index, libc, fd)
+    
+    
+    def __init__(self, index, libc, fd):
+        threading.Thread.__init__(self)
+        self.index = index
+        self.libc = libc
+        self.fd = fd
+        self.directories = {}
+        self.lock = threading.Lock()
+        self.want_stop = False
+        self.daemon = True
+        self.start()
+    
+    
+    def Add_Directory(self, directory):
+        mask = self.IN_CREATE | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_MOVED_FROM | self.IN_DELETE
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if watch_descriptor >= 0:
+            with self.lock:
+                self.directories[watch_descriptor] = directory
+    
+    
+    def run(self):
+        while not self.want_stop:
+            ready, _, _ = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                continue
+            
+            offset = 0
+            while offset + self.EVENT_HEADER.size <= len(data):
+                watch_descriptor, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                filename = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                
+                with self.lock:
+                    directory = self.directories.get(watch_descriptor)
+                    directories = list(self.directories.values())
+                
+                if mask & self.IN_Q_OVERFLOW:
+                    for directory in directories:
+                        self.index.Scan(directory)
+                elif directory is None:
+                    continue
+                elif mask & (self.IN_MOVED_FROM | self.IN_DELETE):
+                    self.index.Remove_File(directory, filename)
+                else:
+                    self.index.Add_File(directory, filename)
+        
+        os.close(self.fd)
+    
+    
+    def Stop(self):
+        self.want_stop = True
+
+
+
+
+
+
+class BatchProfiler(object):
+    """Records how long each batch step takes as spans tagged with the sample index and step name.
+    The spans can be written out as a Chrome/Perfetto trace-event JSON file, which can be opened at
+    ui.perfetto.dev or chrome://tracing, and as a CSV summary of the time spent in each step.
+    Recording a span only takes two perf_counter calls and a list append, so it is left on for every batch."""
+
+    def __init__(self, sample_names = None, clock = time.perf_counter):
+        self.spans = []
+        self.sample_names = list(sample_names) if sample_names is not None else []
+        self.thread_names = {}
+        self.clock = clock
+        self.start_time = self.clock()
+
+
+    @contextlib.contextmanager
+    def Span(self, name, sample_index = None, category = "step"):
+        """Context manager that records the time spent inside it as a span."""
+
+        start = self.clock()
+        try:
+            yield
+        finally:
+            end = self.clock()
+            thread = threading.current_thread()
+            self.thread_names[thread.ident] = thread.name
+            self.spans.append((name, category, sample_index, start - self.start_time, end - start, thread.ident))
+
+
+    def Add_Span(self, name, start, seconds, sample_index = None, category = "step"):
+        """Records a span that was timed elsewhere, start being a time on the profiler's clock."""
+
+        thread = threading.current_thread()
+        self.thread_names[thread.ident] = thread.name
+        self.spans.append((name, category, sample_index, start - self.start_time, seconds, thread.ident))
+
+
+    def Longest(self, name):
+        """Returns the longest duration of the spans named name in seconds, or None if there are none."""
+
+        durations = [duration for span_name, category, sample_index, start, duration, thread_id in self.spans if span_name == name]
+        return max(durations) if durations else None
+
+
+    def Write_Chrome_Trace(self, filepath):
+        """Writes the spans to filepath in the Chrome trace-event JSON format."""
+
+        process_id = os.getpid()
+        trace_events = [{"name":"thread_name", "ph":"M", "pid":process_id, "tid":thread_id, "args":{"name":thread_name}}
+                        for thread_id, thread_name in self.thread_names.items()]
+
+        for name, category, sample_index, start, duration, thread_id in self.spans:
+            args = {}
+            if sample_index is not None:
+                args["sample_index"] = sample_index
+                if sample_index < len(self.sample_names):
+                    args["sample_name"] = str(self.sample_names[sample_index])
+
+            trace_events.append({"name":name, "cat":category, "ph":"X", "ts":start*1e6, "dur":duration*1e6,
+                                 "pid":process_id, "tid":thread_id, "args":args})
+
+        with open(filepath, "w") as trace_file:
+            json.dump({"traceEvents":trace_events, "displayTimeUnit":"ms"}, trace_file)
+
+
+    def Summarize(self):
+        """Returns a list of dictionaries with the number of calls and the total, mean, and max
+        seconds spent in each step, ordered by total time."""
+
+        step_times = collections.OrderedDict()
+        for name, category, sample_index, start, duration, thread_id in self.spans:
+            step_times.setdefault((category, name), []).append(duration)
+
+        summary = [{"Step":name, "Category":category, "Calls":len(durations), "Total Seconds":sum(durations),
+                    "Mean Seconds":sum(durations)/len(durations), "Max Seconds":max(durations)}
+                   for (category, name), durations in step_times.items()]
+
+        return sorted(summary, key = lambda row: row["Total Seconds"], reverse = True)
+
+
+    def Write_Summary_CSV(self, filepath):
+        """Writes the summary of the time spent in each step to filepath as a CSV file."""
+
+        columns = ["Step", "Category", "Calls", "Total Seconds", "Mean Seconds", "Max Seconds"]
+        with open(filepath, "w", newline = "") as summary_file:
+            writer = csv.DictWriter(summary_file, fieldnames = columns)
+            writer.writeheader()
+            for row in self.Summarize():
+                writer.writerow(row)
+
+
+
+
+def Profiled_Step(category = "step", sets_sample = False):
+    """Decorator for BatchThread methods that records every call as a span in the thread's profiler,
+    tagged with the sample currently being worked on. If sets_sample is True the first argument of
+    the method is the sample index and it becomes the current sample for the duration of the call."""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            previous_sample = self.current_sample
+            if sets_sample:
+                self.current_sample = args[0]
+
+            try:
+                with self.profiler.Span(method.__name__, self.current_sample, category):
+                    return method(self, *args, **kwargs)
+            finally:
+                self.current_sample = previous_sample
+
+        return wrapper
+    return decorator
+
+
+
+
+## UI automation clicks and types in whichever window has the focus, so when several stations are run from 
+## one PC only one batch thread at a time may be in a step that does.
+UI_AUTOMATION_LOCK = threading.RLock()
+
+def UI_Automation_Step(method):
+    """Decorator for BatchThread methods that click and type in NTA or CETAC. The whole step holds 
+    UI_AUTOMATION_LOCK, so a batch on another station can't move the focus in the middle of it."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with UI_AUTOMATION_LOCK:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+
+
+
+
+class SystemClock(object):
+    """Clock used with the real instruments. The batch thread gets the time and sleeps through
+    its drivers' clock so that a simulated batch can run faster than real time."""
+
+    def time(self):
+        return time.time()
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def real_seconds(self, seconds):
+        """Converts seconds on this clock to real seconds, for the timeouts of blocking calls."""
+        return seconds
+
+
+
+
+class WindowsDrivers(object):
+    """Drivers for the real instruments. The batch thread reaches the NTA 3.3 program, the CETAC 
+    Workstation program, the Arduino, the desktop windows, the clock, and the GUI only through 
+    a drivers object, so a simulated set (see NanoSight_Simulation.py) can be swapped in to run 
+    batches without the instruments. pywinauto and uiautomation only exist on Windows, so they 
+    are imported when they are first needed. Messages are shown as wx dialogs unless another ui, 
+    such as the ConsoleBatchUI of a headless batch, is given."""
+
+    def __init__(self, batch_data, ui = None):
+        if ui is None:
+            from NanoSight_GUI import WxBatchUI
+            ui = WxBatchUI(batch_data)
+        
+        self.clock = SystemClock()
+        self.ui = ui
+        self.window_backend = Win32WindowBackend()
+
+
+    def Find_Arduino_Ports(self):
+        """Returns the names of the serial ports with an Arduino connected."""
+
+        import serial.tools.list_ports
+        ports = [tuple(p) for p in list(serial.tools.list_ports.comports())]
+        return [name for name, description, hwid in ports if re.search(r"Arduino", description)]
+
+
+    def Open_Serial(self, port_name):
+        """Opens the serial port named port_name with the Arduino's settings and returns it. pyserial's 
+        SerialException is an OSError, so callers catch OSError without importing pyserial."""
+
+        import serial
+        return serial.Serial(port_name, baudrate = 115200, bytesize = 8, parity = serial.PARITY_NONE, stopbits = 1, timeout = 1)
+
+
+    def Serial_Port_Identities(self):
+        """Returns a dictionary of serial port name -> USB vendor ID, product ID, and serial number, 
+        or the hardware ID if the device has no serial number, so a port can be recognized after its 
+        device is unplugged and plugged back in."""
+
+        import serial.tools.list_ports
+        return {port.device:(port.vid, port.pid, port.serial_number) if port.serial_number else port.hwid 
+                for port in serial.tools.list_ports.comports()}
+
+
+    def Connect_NTA(self):
+        """Connects to the NTA 3.3 program with pywinauto and returns the application."""
+
+        from pywinauto.application import Application
+        return Application().connect(title_re = u".*NTA 3.3.*")
+
+
+    def Restart_NTA(self, nta_app):
+        """Kills the NTA 3.3 program connected to as nta_app and starts its executable again."""
+
+        from pywinauto.application import Application, process_module
+        executable = process_module(nta_app.process)
+        nta_app.kill()
+        Application().start(executable, wait_for_idle = False)
+
+
+    def Connect_CETAC(self):
+        """Returns the uiautomation control for the CETAC Workstation program window."""
+
+        return self.Window_Control("CETAC Workstation")
+
+
+    def Window_Control(self, name):
+        """Returns the uiautomation control for the window titled name."""
+
+        import uiautomation
+        return uiautomation.WindowControl(Name = name)
+
+
+
+
+
+
+## The default station settings file, looked for next to the program.
+STATIONS_CONFIG_FILENAME = "NanoSight_Stations.json"
+## Title patterns of the NTA and CETAC windows, the same ones the batch thread's window registry uses.
+NTA_TITLE_REGEX = r"NTA 3\.3"
+CETAC_TITLE_REGEX = r"CETAC Workstation"
+
+
+
+
+class Station(object):
+    """One NanoSight and MVX autosampler rig: the Arduino it is triggered through, found by its USB 
+    serial number, and the NTA 3.3 and CETAC Workstation programs that run it. When several copies 
+    of a program run on the same PC they are told apart by nta_title and cetac_title, patterns searched 
+    for in their window titles, and by nta_executable and cetac_executable, text that has to be in the 
+    path of the program's executable, such as the folder each copy is installed in."""
+    
+    def __init__(self, name, arduino_serial_number, nta_title = NTA_TITLE_REGEX, nta_executable = None, 
+                 cetac_title = CETAC_TITLE_REGEX, cetac_executable = None):
+        self.name = name
+        self.arduino_serial_number = arduino_serial_number
+        self.nta_title = re.compile(nta_title)
+        self.nta_executable = nta_executable
+        self.cetac_title = re.compile(cetac_title)
+        self.cetac_executable = cetac_executable
+    
+    
+    @classmethod
+    def From_Dict(cls, settings):
+        """Makes a station from a dictionary of its settings, as read from the stations file."""
+        
+        settings = dict(settings)
+        for key in ["name", "arduino_serial_number"]:
+            if not settings.get(key):
+                raise ValueError("Every station needs a " + key + ".")
+        
+        unknown_keys = set(settings) - set(["name", "arduino_serial_number", "nta_title", "nta_executable", "cetac_title", "cetac_executable"])
+        if len(unknown_keys) > 0:
+            raise ValueError("Unknown setting(s) for station " + str(settings["name"]) + ": " + ", ".join(sorted(unknown_keys)))
+        
+        return cls(**settings)
+    
+    
+    def Program(self, title, executable):
+        """Returns "NTA" or "CETAC" if a window with title from a process running executable belongs to 
+        this station's NTA or CETAC program, "Other Station" if it is another copy of one of those 
+        programs, and None if it isn't NTA or CETAC at all."""
+        
+        for program, generic_title, title_regex, executable_text in [("NTA", NTA_TITLE_REGEX, self.nta_title, self.nta_executable), 
+                                                                     ("CETAC", CETAC_TITLE_REGEX, self.cetac_title, self.cetac_executable)]:
+            if not re.search(generic_title, title) and not title_regex.search(title):
+                continue
+            
+            ## Windows gives the ghost of a hung window to another process, so only its title can say whose it is.
+            ghost_window = title.endswith("(Not Responding)")
+            if title_regex.search(title) and (executable_text is None or ghost_window or executable_text.lower() in (executable or "").lower()):
+                return program
+            return "Other Station"
+        
+        return None
+
+
+
+
+def Load_Stations(filepath):
+    """Reads the stations from the JSON file at filepath, which holds a list of station settings, 
+    either on its own or under "stations". Raises ValueError if the file doesn't describe a usable 
+    set of stations and IOError or OSError if it can't be read."""
+    
+    with open(filepath, "r") as stations_file:
+        try:
+            settings = json.load(stations_file)
+        except ValueError as e:
+            raise ValueError("The stations file " + filepath + " is not valid JSON. " + str(e))
+    
+    if isinstance(settings, dict):
+        settings = settings.get("stations", [])
+    stations = [Station.From_Dict(station_settings) for station_settings in settings]
+    
+    if len(stations) == 0:
+        raise ValueError("The stations file " + filepath + " has no stations in it.")
+    for attribute, description in [("name", "name"), ("arduino_serial_number", "Arduino serial number")]:
+        values = [str(getattr(station, attribute)) for station in stations]
+        duplicates = sorted(set(value for value in values if values.count(value) > 1))
+        if len(duplicates) > 0:
+            raise ValueError("More than one station has the " + description + " " + ", ".join(duplicates) + ".")
+    
+    return stations
+
+
+
+
+class StationWindowBackend(object):
+    """Window backend that hides the NTA and CETAC windows of the other stations' programs, so the 
+    window registry of a station's batch thread only sees its own NTA and CETAC. Windows of other 
+    programs, such as dialogs that aren't titled like NTA or CETAC, are passed through. process_path 
+    returns the executable of a process ID and defaults to asking Windows through pywinauto."""
+    
+    def __init__(self, backend, station, process_path = None):
+        self.backend = backend
+        self.station = station
+        self.process_path = process_path if process_path is not None else self.Windows_Process_Path
+        ## Process ID -> executable path, since a process keeps its executable while it runs.
+        self.process_paths = {}
+    
+    
+    def Windows_Process_Path(self, process_id):
+        from pywinauto.application import process_module
+        return process_module(process_id)
+    
+    
+    def Program(self, handle):
+        """Returns which program the window with the given handle belongs to, as Station.Program does. 
+        A window of neither program, like the Error dialog CETAC shows from a process of its own, is 
+        \"Other Station\" if the window that owns it is, so another station's dialogs are hidden too."""
+        
+        process_id = self.backend.process_id(handle)
+        if process_id not in self.process_paths:
+            try:
+                self.process_paths[process_id] = self.process_path(process_id)
+            except Exception:
+                self.process_paths[process_id] = None
+        
+        program = self.station.Program(self.backend.text(handle), self.process_paths[process_id])
+        if program is None:
+            owner = self.backend.owner(handle)
+            if owner is not None and owner != handle and self.Program(owner) == "Other Station":
+                return "Other Station"
+        
+        return program
+    
+    
+    def Process_Id(self, program):
+        """Returns the process ID of this station's program, "NTA" or "CETAC", or None if no window of it is open."""
+        
+        for handle in self.enum_windows():
+            try:
+                if self.backend.is_visible(handle) and not self.backend.text(handle).endswith("(Not Responding)") and self.Program(handle) == program:
+                    return self.backend.process_id(handle)
+            ## The window closed while it was being read.
+            except Exception:
+                continue
+        
+        return None
+    
+    
+    def enum_windows(self):
+        handles = []
+        for handle in self.backend.enum_windows():
+            try:
+                if self.Program(handle) != "Other Station":
+                    handles.append(handle)
+            except Exception:
+                continue
+        
+        return handles
+    
+    def is_visible(self, handle):
+        return self.backend.is_visible(handle)
+    
+    def text(self, handle):
+        return self.backend.text(handle)
+    
+    def process_id(self, handle):
+        return self.backend.process_id(handle)
+    
+    def owner(self, handle):
+        return self.backend.owner(handle)
+
+
+
+
+class StationDrivers(WindowsDrivers):
+    """Drivers for the real instruments of one station. The Arduino is the one with the station's USB 
+    serial number, and NTA, CETAC, and their dialogs are looked for only in the station's own processes."""
+    
+    def __init__(self, batch_data, station, ui = None):
+        WindowsDrivers.__init__(self, batch_data, ui)
+        self.station = station
+        self.window_backend = StationWindowBackend(self.window_backend, station)
+    
+    
+    def Find_Arduino_Ports(self):
+        """Returns the names of the serial ports with the station's Arduino connected."""
+        
+        import serial.tools.list_ports
+        return [port.device for port in serial.tools.list_ports.comports() 
+                if port.serial_number is not None and port.serial_number.lower() == str(self.station.arduino_serial_number).lower()]
+    
+    
+    def Connect_NTA(self):
+        """Connects to the station's NTA 3.3 program with pywinauto and returns the application."""
+        
+        from pywinauto.application import Application
+        process_id = self.window_backend.Process_Id("NTA")
+        if process_id is None:
+            raise RuntimeError("The NTA 3.3 program of station " + self.station.name + " is not open.")
+        return Application().connect(process = process_id)
+    
+    
+    def Window_Control(self, name):
+        """Returns the uiautomation control for the window titled name in the station's CETAC program, 
+        if name is "CETAC Workstation", and in the station's NTA program otherwise."""
+        
+        import uiautomation
+        process_id = self.window_backend.Process_Id("CETAC" if name == "CETAC Workstation" else "NTA")
+        if process_id is None:
+            return uiautomation.WindowControl(Name = name)
+        return uiautomation.WindowControl(Name = name, ProcessId = process_id)
+
+
+
+
+
+
+## How often the sample list is redrawn with the batch's progress, in milliseconds.
+SAMPLE_LIST_REFRESH_INTERVAL = 100
+
+
+
+
+class SampleStatusList(object):
+    """The progress of every sample in a batch, kept as one byte per sample per progress column 
+    and one byte per sample for its row colour. The batch thread never touches the GUI, it puts 
+    changes on the updates queue with Set_Status and Set_Colour. The GUI applies them with 
+    Apply_Updates on a timer, so any number of changes are drawn at most once per refresh."""
+    
+    COLUMNS = ["Acquisition Progress", "Processing Progress", "Analysis Progress"]
+    STATUSES = ["Not Started", "In Progress", "Complete", "Cancelled", "Failed"]
+    COLOURS = ["white", "light blue"]
+    
+    def __init__(self, number_of_samples):
+        self.statuses = {column:bytearray(number_of_samples) for column in self.COLUMNS}
+        self.colours = bytearray(number_of_samples)
+        self.updates = queue.Queue()
+    
+    
+    def Set_Status(self, row, column, status):
+        """Queues setting the progress column of row to status. Safe to call from any thread."""
+        
+        self.updates.put((row, column, self.STATUSES.index(status)))
+    
+    
+    def Set_Colour(self, row, colour):
+        """Queues setting the background colour of row. Safe to call from any thread."""
+        
+        self.updates.put((row, None, self.COLOURS.index(colour)))
+    
+    
+    def Apply_Updates(self):
+        """Applies the queued changes and returns the set of rows that changed. Only called by the GUI."""
+        
+        changed_rows = set()
+        while True:
+            try:
+                row, column, code = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            
+            if column is None:
+                self.colours[row] = code
+            else:
+                self.statuses[column][row] = code
+            changed_rows.add(row)
+        
+        return changed_rows
+    
+    
+    def Status(self, row, column):
+        return self.STATUSES[self.statuses[column][row]]
+    
+    
+    def Colour(self, row):
+        return self.COLOURS[self.colours[row]]
+
+
+
+
+
+
+## The steps of a sample that are written to the batch journal, in the order they happen.
+JOURNAL_STEPS = ["Filename Set", "Acquired", "Processed", "Exported"]
+
+
+
+
+def Journal_Filepath(sample_list_filepath):
+    """Returns the path of the batch journal for a sample list, "<sample list> Journal.jsonl" next to it."""
+    
+    return os.path.splitext(sample_list_filepath)[0] + " Journal.jsonl"
+
+
+
+
+class BatchJournal(object):
+    """Append only record of the steps completed for each sample, one JSON object per line, so a 
+    batch that stops part way through can be resumed without redoing the samples that were finished.
+    
+    Every record is flushed and fsync'd before Record returns, so a step is only in the journal once
+    it is on disk. Starting a new batch appends a "Batch Started" record, and only the records after
+    the last one that wasn't a resume count towards what is complete. A line cut short by a crash 
+    is ignored, and records are matched to rows by sample name as well as row number so an edited 
+    sample list doesn't skip the wrong samples."""
+    
+    def __init__(self, filepath, sample_names):
+        self.filepath = filepath
+        self.sample_names = [str(sample_name) for sample_name in sample_names]
+        self.journal_file = None
+        self.lock = threading.Lock()
+    
+    
+    def Read_Records(self):
+        """Returns the records in the journal file, skipping any that can't be read."""
+        
+        records = []
+        try:
+            with open(self.filepath, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except (IOError, OSError):
+            pass
+        
+        return records
+    
+    
+    def Completed_Steps(self):
+        """Returns a dictionary of row -> set of the steps in JOURNAL_STEPS completed for the sample in that row 
+        since the last batch that wasn't a resume was started."""
+        
+        completed_steps = collections.defaultdict(set)
+        for record in self.Read_Records():
+            if record.get("event") == "Batch Started":
+                if not record.get("resume"):
+                    completed_steps.clear()
+                continue
+            
+            row = record.get("row")
+            if isinstance(row, int) and 0 <= row < len(self.sample_names) and record.get("sample_name") == self.sample_names[row]:
+                completed_steps[row].add(record.get("step"))
+        
+        return completed_steps
+    
+    
+    def Start(self, resume):
+        """Opens the journal for appending and records the start of a batch. A last line cut short by a 
+        crash is ended first, so the "Batch Started" record isn't run into it and lost."""
+        
+        try:
+            with open(self.filepath, "rb") as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                cut_short = journal_file.read(1) != b"\n"
+        except (IOError, OSError):
+            ## The journal doesn't exist yet or is empty.
+            cut_short = False
+        
+        self.journal_file = open(self.filepath, "a")
+        if cut_short:
+            self.journal_file.write("\n")
+        self.Write({"event":"Batch Started", "resume":resume, "samples":len(self.sample_names)})
+    
+    
+    def Record(self, row, step):
+        """Records that step has been completed for the sample in row."""
+        
+        self.Write({"row":row, "sample_name":self.sample_names[row], "step":step})
+    
+    
+    def Write(self, record):
+        if self.journal_file is None:
+            return
+        
+        record["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.journal_file.write(json.dumps(record) + "\n")
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+    
+    
+    def Close(self):
+        with self.lock:
+            if self.journal_file is not None:
+                self.journal_file.close()
+                self.journal_file = None
+
+
+
+
+
+
+def Script_Key(script_filepath):
+    """Returns the (path, content hash) of an NTA script file, which only matches the key of an 
+    earlier load if it is the same file with the same contents. Returns None if the file can't be read."""
+    
+    try:
+        with open(script_filepath, "rb") as script_file:
+            content_hash = hashlib.sha1(script_file.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+    
+    return (os.path.normcase(os.path.abspath(script_filepath)), content_hash)
+
+
+
+
+
+
+## Roughly how long loading a script in NTA takes, in seconds, for estimating what a batch plan saves.
+SCRIPT_LOAD_SECONDS = 15
+
+## Values of the optional Pinned column that keep a sample where it is in the sample list.
+PINNED_VALUES = ["1", "true", "yes", "y", "x"]
+
+
+
+
+class BatchPlanner(object):
+    """Plans the order to run a sample list in so fewer scripts have to be loaded in NTA.
+    
+    Samples are grouped by Acquire Script and then Process Script, with the groups in the order they 
+    first appear in the sample list and the samples in each group kept in sample list order. An optional 
+    Priority column runs samples with lower numbers first, such as blanks, and a blank Priority counts 
+    as 0. Samples with a Pinned value of yes, true, y, x, or 1 stay at their row. The cost of an order is 
+    the number of script loads the batch would do in the program mode, since loading the script that is 
+    already loaded is skipped."""
+    
+    def __init__(self, sample_df, program_mode, pipelined_processing):
+        self.sample_df = sample_df
+        self.program_mode = program_mode
+        self.pipelined_processing = pipelined_processing
+    
+    
+    def Plan_Order(self):
+        """Returns the planned order as a list of sample list row numbers."""
+        
+        sample_df = self.sample_df
+        number_of_samples = len(sample_df)
+        
+        if "Priority" in sample_df.columns:
+            import pandas
+            priorities = pandas.to_numeric(sample_df.loc[:, "Priority"], errors = "coerce").fillna(0).tolist()
+        else:
+            priorities = [0]*number_of_samples
+        
+        if "Pinned" in sample_df.columns:
+            pinned = sample_df.loc[:, "Pinned"].astype(str).str.strip().str.lower().isin(PINNED_VALUES).tolist()
+        else:
+            pinned = [False]*number_of_samples
+        
+        ## Number the script groups in the order they first appear.
+        script_columns = [column for column in ["Acquire Script", "Process Script"] if column in sample_df.columns]
+        group_keys = list(zip(*[sample_df.loc[:, column].astype(str).tolist() for column in script_columns]))
+        group_numbers = {}
+        for group_key in group_keys:
+            group_numbers.setdefault(group_key, len(group_numbers))
+        
+        movable_rows = sorted([row for row in range(number_of_samples) if not pinned[row]], 
+                              key = lambda row: (priorities[row], group_numbers[group_keys[row]], row))
+        
+        ## Pinned rows keep their place and the rest fill the other places in planned order.
+        movable_rows = iter(movable_rows)
+        return [row if pinned[row] else next(movable_rows) for row in range(number_of_samples)]
+    
+    
+    def Script_Sequence(self, order):
+        """Returns the scripts the batch would load, in the order it would ask for them, when running the samples in order."""
+        
+        acquire_scripts = self.sample_df.loc[:, "Acquire Script"].tolist() if self.program_mode != "Process Only" else []
+        process_scripts = self.sample_df.loc[:, "Process Script"].tolist() if self.program_mode != "Acquire Only" else []
+        
+        if self.program_mode == "Process Only":
+            return [process_scripts[row] for row in order]
+        elif self.program_mode == "Acquire Only":
+            return [acquire_scripts[row] for row in order]
+        
+        elif not self.pipelined_processing:
+            return [acquire_scripts[row] for row in order] + [process_scripts[row] for row in order]
+        
+        ## In pipelined batches the previous sample is processed between setting up an acquisition and 
+        ## starting it, after which the Acquire Script is loaded again.
+        sequence = []
+        for position, row in enumerate(order):
+            sequence.append(acquire_scripts[row])
+            if position > 0:
+                sequence.extend([process_scripts[order[position - 1]], acquire_scripts[row]])
+        if len(order) > 0:
+            sequence.append(process_scripts[order[-1]])
+        return sequence
+    
+    
+    def Count_Script_Loads(self, order):
+        """Returns the number of times a script would be loaded in NTA when running the samples in order."""
+        
+        loads = 0
+        loaded_script = None
+        for script in self.Script_Sequence(order):
+            if script != loaded_script:
+                loads += 1
+                loaded_script = script
+        
+        return loads
+    
+    
+    def Estimate(self, order):
+        """Returns (script loads in sample list order, script loads in order, seconds saved by running in order)."""
+        
+        original_loads = self.Count_Script_Loads(list(range(len(self.sample_df))))
+        planned_loads = self.Count_Script_Loads(order)
+        return original_loads, planned_loads, (original_loads - planned_loads)*SCRIPT_LOAD_SECONDS
+    
+    
+    def Write_Plan(self, filepath, order):
+        """Writes the planned order to filepath as a CSV file, with the tube each sample is in 
+        assuming the tubes were loaded in sample list order, so CETAC can be set up to match."""
+        
+        columns = [column for column in ["Sample Name", "Save Directory", "Acquire Script", "Process Script"] if column in self.sample_df.columns]
+        plan_df = self.sample_df.loc[order, columns].copy()
+        plan_df.insert(0, "Tube", [row + 1 for row in order])
+        plan_df.insert(0, "Run Order", range(1, len(order) + 1))
+        plan_df.to_csv(filepath, index = False)
+
+
+
+
+
+
+class NTARecoveryPolicy(object):
+    """When to restart NTA while processing. After every export NTA is probed, and it is restarted if 
+    it isn't responding or once restart_every samples have been processed since it was last started. 
+    A sample whose processing fails while NTA is unresponsive is processed again after the restart, 
+    up to max_retries times. NTA isn't restarted after the last sample, since nothing is left for it to 
+    process. While processing during autosampler moves, where a restart would hold up the autosampler, 
+    only the health probe is made, and NTA is restarted when it is next idle if the probe fails."""
+    
+    def __init__(self, restart_every = NTA_RESTART_EVERY, health_timeout = NTA_HEALTH_TIMEOUT, restart_timeout = NTA_RESTART_TIMEOUT, max_retries = 1):
+        self.restart_every = restart_every
+        self.health_timeout = health_timeout
+        self.restart_timeout = restart_timeout
+        self.max_retries = max_retries
+    
+    
+    def Restart_Due(self, processed_since_restart):
+        """Returns True if NTA should be restarted after processed_since_restart samples."""
+        
+        return self.restart_every > 0 and processed_since_restart >= self.restart_every
+
+
+
+
+class RetryPolicy(object):
+    """How a batch step that timed out or failed is retried. The step is tried up to max_attempts times in all, 
+    waiting backoff seconds before the first retry and multiplier times longer before each one after 
+    that, up to max_backoff. Each wait is made up to jitter of itself longer or shorter at random, so 
+    stations sharing a USB hub don't retry in step. When the attempts run out the policy escalates: 
+    "Ask" asks the operator whether to try again, starting the attempts over if they click Yes, and 
+    "Abort" aborts the batch without waiting for anyone. An unattended batch always escalates to "Abort"."""
+    
+    ESCALATIONS = ["Ask", "Abort"]
+    
+    def __init__(self, max_attempts = RETRY_MAX_ATTEMPTS, backoff = RETRY_BACKOFF, multiplier = 2, max_backoff = RETRY_MAX_BACKOFF, jitter = 0.5, escalation = "Ask"):
+        if escalation not in self.ESCALATIONS:
+            raise ValueError("escalation must be one of " + ", ".join(self.ESCALATIONS))
+        
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.escalation = escalation
+    
+    
+    def Delay(self, retry, rng = random):
+        """Returns how long to wait before retry, counting the first retry as 0, in seconds."""
+        
+        delay = min(self.max_backoff, self.backoff * self.multiplier**retry)
+        return delay * rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+
+
+def Default_Retry_Policies():
+    """Returns the retry policy of each batch step that can time out or fail and be tried again. The wait for 
+    the autosampler is only waited through once more before escalating, since it is long, and the wait for 
+    the end of an NTA script only if the operator asks, since a script that didn't end in time usually never started."""
+    
+    return {"Reset AS Output Latch":RetryPolicy(),
+            "Send Signal To AS":RetryPolicy(),
+            "Wait For Autosampler Signal":RetryPolicy(max_attempts = 2),
+            "Wait For NTA Script":RetryPolicy(max_attempts = 1),
+            "NTA Set Filename":RetryPolicy(),
+            "NTA Load Script":RetryPolicy(),
+            "NTA Open Experiment":RetryPolicy(),
+            "NTA Export Results":RetryPolicy()}
+
+
+
+
+
+
+## How long to wait for NTA to finish writing a sample's ExperimentSummary.csv after the export, in seconds.
+RESULTS_FILE_TIMEOUT = 60
+
+## The columns and dtypes of the results tables, fixed so every batch appends the same schema.
+## Summary values are kept as text with a numeric copy, since NTA puts text and numbers in the same rows.
+RESULTS_SUMMARY_SCHEMA = collections.OrderedDict([("batch", "object"), ("sample_name", "object"), ("row", "int64"),
+                                                  ("key", "object"), ("value", "object"), ("numeric_value", "float64")])
+RESULTS_DISTRIBUTION_SCHEMA = collections.OrderedDict([("batch", "object"), ("sample_name", "object"), ("row", "int64"),
+                                                       ("bin_centre_nm", "float64"), ("concentration", "float64"), ("standard_error", "float64")])
+
+
+
+
+def Parse_Float(text):
+    """Returns text as a float, or NaN if it isn't a number."""
+    
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+
+
+def Wait_For_Stable_File(filepath, timeout, poll_interval = 0.5, clock = time):
+    """Waits up to timeout seconds for filepath to exist and stop growing, since NTA creates an export file 
+    before it has finished writing it. clock is anything with time and sleep, such as the time module or 
+    a batch's clock. Returns True if the file exists."""
+    
+    deadline = clock.time() + timeout
+    last_size = None
+    while clock.time() < deadline:
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            size = None
+        
+        if size and size == last_size:
+            return True
+        last_size = size
+        clock.sleep(poll_interval)
+    
+    return os.path.exists(filepath)
+
+
+
+
+def Parse_Experiment_Summary(filepath):
+    """Parses an NTA ExperimentSummary.csv export into (summary rows, size distribution rows).
+    
+    Summary rows are (key, value) pairs from the "name, value" lines of the file. Values under a 
+    header line that starts with an empty cell, such as ",Mean,Mode,SD", are keyed "<name> <column>". 
+    Size distribution rows are (bin centre, concentration, standard error) from the table whose 
+    header starts with "Bin centre"."""
+    
+    summary_rows = []
+    distribution_rows = []
+    column_names = None
+    distribution_columns = None
+    
+    with open(filepath, "r", newline = "", errors = "replace") as summary_file:
+        for fields in csv.reader(summary_file):
+            fields = [field.strip() for field in fields]
+            while len(fields) > 0 and fields[-1] == "":
+                fields.pop()
+            
+            if len(fields) == 0:
+                column_names = None
+                distribution_columns = None
+                continue
+            
+            if fields[0].lower().startswith("bin centre"):
+                headers = [field.lower() for field in fields]
+                standard_error_column = headers.index("standard error") if "standard error" in headers else None
+                distribution_columns = (1, standard_error_column)
+                continue
+            
+            if distribution_columns is not None:
+                bin_centre = Parse_Float(fields[0])
+                if bin_centre == bin_centre:
+                    concentration_column, standard_error_column = distribution_columns
+                    concentration = Parse_Float(fields[concentration_column]) if len(fields) > concentration_column else float("nan")
+                    standard_error = Parse_Float(fields[standard_error_column]) if standard_error_column is not None and len(fields) > standard_error_column else float("nan")
+                    distribution_rows.append((bin_centre, concentration, standard_error))
+                    continue
+                distribution_columns = None
+            
+            if fields[0] == "":
+                column_names = fields
+            elif column_names is not None and len(fields) > 2:
+                summary_rows.extend((fields[0] + " " + column_names[j], fields[j]) for j in range(1, min(len(fields), len(column_names))) if column_names[j] != "")
+            elif len(fields) > 1:
+                summary_rows.append((fields[0].rstrip(":"), next(field for field in fields[1:] if field != "") if any(fields[1:]) else ""))
+    
+    return summary_rows, distribution_rows
+
+
+
+
+class ParquetResultsStore(object):
+    """Results store written as Parquet datasets in directory, one per table, partitioned by batch and 
+    sample name. Every append adds new files, so nothing already written is rewritten. Read a table with
+    pandas.read_parquet(os.path.join(directory, table_name)), filtering on batch or sample_name if needed."""
+    
+    def __init__(self, directory):
+        self.path = directory
+    
+    
+    def Append(self, table_name, results_df):
+        results_df.to_parquet(os.path.join(self.path, table_name), engine = "pyarrow", partition_cols = ["batch", "sample_name"], index = False)
+
+
+
+
+class HDF5ResultsStore(object):
+    """Results store written as appendable tables in an HDF5 file, with batch and sample name indexed 
+    so they can be selected on. Read a table with pandas.read_hdf(filepath, table_name)."""
+    
+    ## Longest text that can be stored in each text column.
+    MIN_ITEMSIZE = {"batch":200, "sample_name":200, "key":200, "value":200}
+    
+    def __init__(self, filepath):
+        self.path = filepath
+    
+    
+    def Append(self, table_name, results_df):
+        import pandas
+        with pandas.HDFStore(self.path, mode = "a") as store:
+            store.append(table_name, results_df, format = "table", data_columns = ["batch", "sample_name"], 
+                         min_itemsize = {column:size for column, size in self.MIN_ITEMSIZE.items() if column in results_df.columns})
+
+
+
+
+def Open_Results_Store(sample_list_filepath):
+    """Returns the results store for a sample list: Parquet in "<sample list> Results" if pyarrow is 
+    installed, otherwise HDF5 in "<sample list> Results.h5" if PyTables is installed, otherwise None."""
+    
+    file_stem = os.path.splitext(sample_list_filepath)[0]
+    if importlib.util.find_spec("pyarrow") is not None:
+        return ParquetResultsStore(file_stem + " Results")
+    elif importlib.util.find_spec("tables") is not None:
+        return HDF5ResultsStore(file_stem + " Results.h5")
+    return None
+
+
+
+
+class ResultsIngester(object):
+    """Parses each sample's exported ExperimentSummary.csv as soon as it is exported and appends its 
+    summary and size distribution to the results store, keyed by batch and sample. The parsing and 
+    writing happen on one background thread, so the batch doesn't wait on them and the appends are 
+    made in order. A file that can't be read is recorded in errors without stopping the batch, and the 
+    batch shows the errors once the ingester is closed."""
+    
+    def __init__(self, store, batch_id, clock):
+        self.store = store
+        self.batch_id = batch_id
+        self.clock = clock
+        self.errors = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "Results Ingester")
+    
+    
+    def Submit(self, row, sample_name, summary_filepath):
+        """Queues the export for the sample in row to be ingested."""
+        
+        self.executor.submit(self.Ingest, row, sample_name, summary_filepath)
+    
+    
+    def Ingest(self, row, sample_name, summary_filepath):
+        import pandas
+        try:
+            ## The Export Settings dialog can close before NTA has finished writing the file.
+            Wait_For_Stable_File(summary_filepath, RESULTS_FILE_TIMEOUT, clock = self.clock)
+            
+            summary_rows, distribution_rows = Parse_Experiment_Summary(summary_filepath)
+            
+            summary_df = pandas.DataFrame([(self.batch_id, sample_name, row, key, value, Parse_Float(value)) for key, value in summary_rows], 
+                                          columns = list(RESULTS_SUMMARY_SCHEMA)).astype(RESULTS_SUMMARY_SCHEMA)
+            distribution_df = pandas.DataFrame([(self.batch_id, sample_name, row) + distribution_row for distribution_row in distribution_rows], 
+                                               columns = list(RESULTS_DISTRIBUTION_SCHEMA)).astype(RESULTS_DISTRIBUTION_SCHEMA)
+            
+            self.store.Append("summary", summary_df)
+            if len(distribution_df) > 0:
+                self.store.Append("size_distribution", distribution_df)
+        
+        except Exception as e:
+            self.errors.append((sample_name, str(e)))
+    
+    
+    def Close(self):
+        """Waits for the queued exports to be ingested."""
+        
+        self.executor.shutdown(wait = True)
+
+
+
+
+
+
+## How many exported samples can be waiting for or in analysis at once before the batch waits for one to finish.
+ANALYSIS_QUEUE_DEPTH = 8
+
+## The columns of the batch report, one row per analysed sample.
+ANALYSIS_REPORT_COLUMNS = ["Sample Name", "Captures", "Mean Size (nm)", "Mode Size (nm)", "D10 (nm)", "D50 (nm)", "D90 (nm)",
+                           "Concentration (particles/ml)", "Concentration SD Between Captures", "Mode Size SD Between Captures", "Plot"]
+
+
+
+
+def Read_Capture_Distributions(filepath):
+    """Reads the size distribution table of an NTA ExperimentSummary.csv export. Returns the bin centres 
+    and a list of the concentrations of each capture, using the columns whose header mentions a capture. 
+    If there are no per capture columns the average concentration is the only capture."""
+    
+    bin_centres = []
+    captures = None
+    capture_columns = None
+    with open(filepath, "r", newline = "", errors = "replace") as summary_file:
+        for fields in csv.reader(summary_file):
+            if capture_columns is None:
+                if len(fields) > 1 and fields[0].strip().lower().startswith("bin centre"):
+                    capture_columns = [j for j, field in enumerate(fields) if "capture" in field.lower()] or [1]
+                    captures = [[] for j in capture_columns]
+                continue
+            
+            bin_centre = Parse_Float(fields[0]) if len(fields) > 0 else float("nan")
+            if bin_centre != bin_centre:
+                break
+            bin_centres.append(bin_centre)
+            for capture, j in zip(captures, capture_columns):
+                concentration = Parse_Float(fields[j]) if len(fields) > j else float("nan")
+                capture.append(concentration if concentration == concentration else 0.0)
+    
+    return bin_centres, captures or []
+
+
+
+
+def Distribution_Statistics(bin_centres, concentrations):
+    """Returns the mean, mode, D10, D50, and D90 sizes and the total concentration of a size distribution."""
+    
+    bin_widths = [bin_centres[j+1] - bin_centres[j] for j in range(len(bin_centres) - 1)]
+    bin_widths.append(bin_widths[-1] if len(bin_widths) > 0 else 1.0)
+    amounts = [concentration * width for concentration, width in zip(concentrations, bin_widths)]
+    total = sum(amounts)
+    if total <= 0:
+        return {"mean":float("nan"), "mode":float("nan"), "D10":float("nan"), "D50":float("nan"), "D90":float("nan"), "total":0.0}
+    
+    statistics = {"mean":sum(size * amount for size, amount in zip(bin_centres, amounts)) / total,
+                  "mode":bin_centres[max(range(len(concentrations)), key = lambda j: concentrations[j])],
+                  "total":total}
+    cumulative = 0.0
+    percentiles = [(0.1, "D10"), (0.5, "D50"), (0.9, "D90")]
+    for size, amount in zip(bin_centres, amounts):
+        cumulative += amount
+        while len(percentiles) > 0 and cumulative >= percentiles[0][0] * total:
+            statistics[percentiles.pop(0)[1]] = size
+    
+    return statistics
+
+
+
+
+def Standard_Deviation(values):
+    if len(values) < 2:
+        return float("nan")
+    mean = sum(values) / len(values)
+    return (sum((value - mean)**2 for value in values) / (len(values) - 1))**0.5
+
+
+
+
+def Analyse_Sample(sample_name, summary_filepath, file_timeout):
+    """Analysis job run in a worker process for one exported sample. Merges the captures of the sample 
+    into one size distribution, works out its statistics and how much the captures vary, and plots the 
+    merged distribution next to the export if matplotlib is installed. Waits up to file_timeout seconds 
+    for the export to be written. Returns a row of the batch report."""
+    
+    Wait_For_Stable_File(summary_filepath, file_timeout, poll_interval = min(0.5, file_timeout / 10))
+    
+    bin_centres, captures = Read_Capture_Distributions(summary_filepath)
+    if len(captures) == 0 or len(bin_centres) == 0:
+        raise ValueError("No size distribution in " + summary_filepath)
+    
+    merged = [sum(values) / len(values) for values in zip(*captures)]
+    statistics = Distribution_Statistics(bin_centres, merged)
+    capture_statistics = [Distribution_Statistics(bin_centres, capture) for capture in captures]
+    
+    plot_filepath = ""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as pyplot
+    except ImportError:
+        pyplot = None
+    
+    if pyplot is not None:
+        plot_filepath = summary_filepath.replace("-ExperimentSummary.csv", "") + "-SizeDistribution.png"
+        figure = pyplot.figure(figsize = (6, 4))
+        axes = figure.add_subplot(1, 1, 1)
+        for j, capture in enumerate(captures):
+            axes.plot(bin_centres, capture, linewidth = 0.5, alpha = 0.5, label = "Capture " + str(j + 1))
+        axes.plot(bin_centres, merged, color = "black", label = "Merged")
+        axes.set_xlabel("Size (nm)")
+        axes.set_ylabel("Concentration (particles/ml)")
+        axes.set_title(str(sample_name))
+        axes.legend(fontsize = "small")
+        figure.savefig(plot_filepath, dpi = 100, bbox_inches = "tight")
+        pyplot.close(figure)
+    
+    return {"Sample Name":sample_name,
+            "Captures":len(captures),
+            "Mean Size (nm)":statistics["mean"],
+            "Mode Size (nm)":statistics["mode"],
+            "D10 (nm)":statistics["D10"],
+            "D50 (nm)":statistics["D50"],
+            "D90 (nm)":statistics["D90"],
+            "Concentration (particles/ml)":statistics["total"],
+            "Concentration SD Between Captures":Standard_Deviation([capture["total"] for capture in capture_statistics]),
+            "Mode Size SD Between Captures":Standard_Deviation([capture["mode"] for capture in capture_statistics]),
+            "Plot":plot_filepath}
+
+
+
+
+class AnalysisPool(object):
+    """Runs Analyse_Sample on exported samples in a pool of worker processes while the batch carries on, 
+    and writes the batch report once they are done. At most queue_depth samples are waiting or being 
+    analysed at once, after which Submit waits, so a slow analysis can't pile up work without limit. 
+    Each sample's progress is shown in the Analysis Progress column of the sample statuses. The pool 
+    is started on the first Submit so batches that export nothing don't start processes."""
+    
+    def __init__(self, sample_statuses, report_filepath, clock, workers = None, queue_depth = ANALYSIS_QUEUE_DEPTH):
+        self.sample_statuses = sample_statuses
+        self.report_filepath = report_filepath
+        self.clock = clock
+        self.workers = workers if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.slots = threading.BoundedSemaphore(queue_depth)
+        self.executor = None
+        self.futures = []
+        self.results = {}
+        self.errors = []
+        self.lock = threading.Lock()
+    
+    
+    def Submit(self, row, sample_name, summary_filepath):
+        """Queues the export of the sample in row to be analysed."""
+        
+        self.slots.acquire()
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers = self.workers)
+        
+        self.sample_statuses.Set_Status(row, "Analysis Progress", "In Progress")
+        try:
+            future = self.executor.submit(Analyse_Sample, sample_name, summary_filepath, self.clock.real_seconds(RESULTS_FILE_TIMEOUT))
+        except Exception as e:
+            self.slots.release()
+            self.Record_Failure(row, sample_name, e)
+            return
+        
+        future.add_done_callback(lambda future: self.Done(row, sample_name, future))
+        self.futures.append(future)
+    
+    
+    def Done(self, row, sample_name, future):
+        self.slots.release()
+        try:
+            result = future.result()
+        except Exception as e:
+            self.Record_Failure(row, sample_name, e)
+            return
+        
+        with self.lock:
+            self.results[row] = result
+        self.sample_statuses.Set_Status(row, "Analysis Progress", "Complete")
+    
+    
+    def Record_Failure(self, row, sample_name, error):
+        with self.lock:
+            self.errors.append((sample_name, str(error)))
+        self.sample_statuses.Set_Status(row, "Analysis Progress", "Failed")
+    
+    
+    def Close(self):
+        """Waits for the queued analyses to finish, shuts the worker processes down, and writes the 
+        batch report with a row per analysed sample in sample list order. Returns the report path, 
+        or None if nothing was analysed."""
+        
+        if self.executor is None:
+            return None
+        
+        concurrent.futures.wait(self.futures)
+        self.executor.shutdown(wait = True)
+        
+        with self.lock:
+            rows = [self.results[row] for row in sorted(self.results)]
+        if len(rows) == 0:
+            return None
+        
+        try:
+            with open(self.report_filepath, "w", newline = "") as report_file:
+                writer = csv.DictWriter(report_file, fieldnames = ANALYSIS_REPORT_COLUMNS)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+        except (IOError, OSError) as e:
+            self.errors.append(("Report", str(e)))
+            return None
+        
+        return self.report_filepath
+
+
+
+
+
+
+class StationBatchData(object):
+    """The settings of a sample list queued to run on a station or run headless, with the attributes 
+    of Automation_GUI that BatchThread reads."""
+    
+    def __init__(self, sample_df, sample_list_filepath, program_mode = "Acquire Then Process", pipelined_processing = False, 
+                 samples_have_individual_directories = True, nta_recovery_policy = None, retry_policies = None, unattended = False):
+        self.sample_df = sample_df
+        self.sample_list_filepath = sample_list_filepath
+        self.program_mode = program_mode
+        self.pipelined_processing = pipelined_processing
+        self.samples_have_individual_directories = samples_have_individual_directories
+        self.resume_batch = False
+        self.nta_recovery_policy = nta_recovery_policy if nta_recovery_policy is not None else NTARecoveryPolicy()
+        self.retry_policies = retry_policies if retry_policies is not None else Default_Retry_Policies()
+        self.unattended = unattended
+        self.sample_statuses = SampleStatusList(len(sample_df))
+
+
+
+
+class StationBatchUI(object):
+    """Wraps the UI of a station's drivers. Messages are shown with the station's name in the caption, 
+    except for "Batch Complete", which is only recorded so the station can go on to its next sample 
+    list without waiting for someone to click OK. Events are recorded instead of posted to the GUI, 
+    whose own batch they would otherwise end."""
+    
+    def __init__(self, station, ui):
+        self.station = station
+        self.ui = ui
+        self.completed = False
+        self.pulled_plug = False
+    
+    def Show_Message(self, message, caption, style):
+        if caption == "Batch Complete":
+            self.completed = True
+            return ID_OK
+        return self.ui.Show_Message(message, self.station.name + ": " + caption, style)
+    
+    def Question_Resolved(self, message, caption):
+        self.ui.Question_Resolved(message, self.station.name + ": " + caption)
+    
+    def Post_Event(self, event):
+        if event.GetEventType() == EVT_PULLED_PLUG:
+            self.pulled_plug = True
+    
+    def Outcome(self):
+        """Returns how the batch ended, "Complete", "Arduino Disconnected", or "Stopped"."""
+        
+        if self.completed:
+            return "Complete"
+        elif self.pulled_plug:
+            return "Arduino Disconnected"
+        else:
+            return "Stopped"
+
+
+
+
+class StationJob(object):
+    """A sample list waiting to run, running, or run on a station."""
+    
+    def __init__(self, batch_data):
+        self.batch_data = batch_data
+        self.state = "Queued"
+        self.station_name = None
+    
+    
+    def Name(self):
+        return os.path.basename(self.batch_data.sample_list_filepath)
+
+
+
+
+class StationWorker(threading.Thread):
+    """Runs the sample lists a StationScheduler gives it on one station, one BatchThread after another, 
+    until there are none left. A batch that doesn't complete leaves the station needing attention, so 
+    it stops taking sample lists and the rest go to the other stations."""
+    
+    def __init__(self, station, scheduler, make_drivers):
+        threading.Thread.__init__(self)
+        self.name = "Station " + station.name
+        self.station = station
+        self.scheduler = scheduler
+        self.make_drivers = make_drivers
+        self.state = "Idle"
+        self.current_job = None
+        self.batch_thread = None
+        self.want_abort = False
+        self.daemon = True
+    
+    
+    def run(self):
+        while not self.want_abort:
+            job = self.scheduler.Next_Job(self.station)
+            if job is None:
+                break
+            
+            self.current_job = job
+            self.state = "Running"
+            drivers = self.make_drivers(job.batch_data, self.station)
+            drivers.ui = StationBatchUI(self.station, drivers.ui)
+            self.batch_thread = BatchThread(job.batch_data, drivers)
+            if self.want_abort:
+                self.batch_thread.abort()
+            self.batch_thread.join()
+            
+            job.state = drivers.ui.Outcome()
+            self.current_job = None
+            if job.state != "Complete" and self.want_abort:
+                job.state = "Aborted"
+                self.state = "Aborted"
+                return
+            elif job.state != "Complete":
+                self.state = "Needs Attention: " + job.state
+                return
+        
+        self.state = "Idle"
+    
+    
+    def abort(self):
+        """Aborts the running batch and stops taking sample lists."""
+        
+        self.want_abort = True
+        batch_thread = self.batch_thread
+        if batch_thread is not None:
+            batch_thread.abort()
+
+
+
+
+class StationScheduler(object):
+    """Spreads sample lists across stations. Sample lists are queued in the order they are added and 
+    each station takes the next one as soon as it is free, so a faster station or a shorter sample 
+    list doesn't leave the other stations waiting. make_drivers(batch_data, station) makes the drivers 
+    for a batch and defaults to StationDrivers."""
+    
+    def __init__(self, stations, make_drivers = None):
+        self.stations = list(stations)
+        self.make_drivers = make_drivers if make_drivers is not None else StationDrivers
+        self.jobs = []
+        self.workers = {}
+        self.lock = threading.Lock()
+    
+    
+    def Add_Sample_List(self, batch_data):
+        """Queues the sample list in batch_data to run on the next free station and returns its job."""
+        
+        job = StationJob(batch_data)
+        with self.lock:
+            self.jobs.append(job)
+        return job
+    
+    
+    def Next_Job(self, station):
+        """Returns the next queued job and marks it as running on station, or None if there are none left."""
+        
+        with self.lock:
+            for job in self.jobs:
+                if job.state == "Queued":
+                    job.state = "Running"
+                    job.station_name = station.name
+                    return job
+        return None
+    
+    
+    def Start(self):
+        """Starts a worker on every station that isn't already running one, including stations 
+        that stopped needing attention."""
+        
+        for station in self.stations:
+            worker = self.workers.get(station.name)
+            if worker is None or not worker.is_alive():
+                worker = StationWorker(station, self, self.make_drivers)
+                self.workers[station.name] = worker
+                worker.start()
+    
+    
+    def Abort(self):
+        """Cancels the queued sample lists and aborts the running batches."""
+        
+        with self.lock:
+            for job in self.jobs:
+                if job.state == "Queued":
+                    job.state = "Cancelled"
+        
+        for worker in self.workers.values():
+            worker.abort()
+    
+    
+    def Is_Running(self):
+        return any(worker.is_alive() for worker in self.workers.values())
+    
+    
+    def Join(self):
+        """Waits for every station to finish."""
+        
+        for worker in list(self.workers.values()):
+            worker.join()
+    
+    
+    def Station_Statuses(self):
+        """Returns (station name, state, sample list it is running, number of sample lists completed) for each station."""
+        
+        with self.lock:
+            completed = collections.Counter(job.station_name for job in self.jobs if job.state == "Complete")
+        
+        statuses = []
+        for station in self.stations:
+            worker = self.workers.get(station.name)
+            job = worker.current_job if worker is not None else None
+            statuses.append((station.name, worker.state if worker is not None else "Idle", 
+                             job.Name() if job is not None else "", completed[station.name]))
+        return statuses
+
+
+
+
+
+
+## A transition a BatchStateMachine made: the state it left, what that state's action returned, 
+## the state it went to, and when the state was entered and how long it took on the machine's clock.
+StateTransition = collections.namedtuple("StateTransition", ["state", "outcome", "next_state", "start", "seconds"])
+
+
+
+
+class BatchState(object):
+    """A state of a BatchStateMachine. action is called when the state is entered, with timeout as its 
+    argument if the state has one, and what it returns is the state's outcome. transitions maps outcomes 
+    to the name of the next state, with "*" matching any outcome not listed, and a state without 
+    transitions ends the machine. compensation, if given, is called when the state's outcome leads to 
+    one of the machine's failure states, to undo what the state left half done."""
+    
+    def __init__(self, name, action, transitions = None, timeout = None, compensation = None):
+        self.name = name
+        self.action = action
+        self.transitions = transitions if transitions is not None else {}
+        self.timeout = timeout
+        self.compensation = compensation
+
+
+
+
+class BatchStateMachine(object):
+    """Runs a workflow given as a table of BatchStates. Run can start at any state, so a workflow can 
+    be entered again part way through, and every transition is passed to the listeners as a 
+    StateTransition, which is how the time spent in each state is measured."""
+    
+    def __init__(self, states, failure_states = (), clock = time.perf_counter):
+        self.states = collections.OrderedDict((state.name, state) for state in states)
+        self.failure_states = set(failure_states)
+        self.clock = clock
+        self.listeners = []
+        ## The state being run, or the last one run once the machine has stopped.
+        self.state = None
+        ## The state whose outcome led to a failure state, once one has been entered.
+        self.failed_state = None
+        
+        for state in self.states.values():
+            for next_state in state.transitions.values():
+                if next_state not in self.states:
+                    raise ValueError("State " + state.name + " has a transition to " + next_state + ", which is not a state.")
+        for failure_state in self.failure_states:
+            if failure_state not in self.states:
+                raise ValueError("Failure state " + failure_state + " is not a state.")
+    
+    
+    def Add_Listener(self, listener):
+        """Adds a function to call with every StateTransition."""
+        
+        self.listeners.append(listener)
+    
+    
+    def Run(self, start):
+        """Runs the machine from the state named start until it has run a state without transitions, 
+        and returns that state's name."""
+        
+        name = start
+        self.failed_state = None
+        while True:
+            self.state = name
+            state = self.states[name]
+            start_time = self.clock()
+            outcome = state.action() if state.timeout is None else state.action(state.timeout)
+            
+            if len(state.transitions) == 0:
+                next_name = None
+            elif outcome in state.transitions:
+                next_name = state.transitions[outcome]
+            elif "*" in state.transitions:
+                next_name = state.transitions["*"]
+            else:
+                raise ValueError("State " + name + " has no transition for the outcome " + repr(outcome) + ".")
+            
+            if next_name in self.failure_states:
+                self.failed_state = name
+                if state.compensation is not None:
+                    state.compensation()
+            
+            transition = StateTransition(name, outcome, next_name, start_time, self.clock() - start_time)
+            for listener in self.listeners:
+                listener(transition)
+            
+            if next_name is None:
+                return name
+            name = next_name
+
+
+
+
+## How many blocking UI automation and serial calls the orchestrator runs at once. A poll that would have 
+## to queue behind them is skipped instead, so a call that hangs can't pile more work up behind it.
+ORCHESTRATOR_WORKERS = 2
+## How often the orchestrator's tasks check the Arduino connection, and the CETAC and NTA windows, in seconds.
+MONITOR_POLL_INTERVAL = 0.1
+MONITOR_UI_POLL_INTERVAL = 0.5
+
+
+
+
+class BatchOrchestrator(object):
+    """Runs the long waits of a batch as asyncio tasks on an event loop in its own thread. While a wait 
+    runs, other tasks watch for the user aborting, the Arduino being disconnected, and CETAC showing an 
+    error or closing, and whichever task finishes first ends the wait. That way a fault is noticed within 
+    about a second instead of when the wait times out. Blocking UI automation and serial calls are run 
+    in a thread pool with a fixed number of workers, and polls are skipped rather than queued while it is busy."""
+    
+    def __init__(self, batch_thread, workers = ORCHESTRATOR_WORKERS, poll_interval = MONITOR_POLL_INTERVAL, ui_poll_interval = MONITOR_UI_POLL_INTERVAL):
+        self.batch_thread = batch_thread
+        self.clock = batch_thread.clock
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.ui_poll_interval = ui_poll_interval
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+        self.pending_calls = 0
+        self.pending_lock = threading.Lock()
+        ## Created on the event loop the first time a wait watches for an abort.
+        self.abort_event = None
+        self.thread = None
+    
+    
+    def Start(self):
+        """Starts the event loop in its own thread."""
+        
+        self.thread = threading.Thread(target = self.loop.run_forever, name = "Batch Orchestrator")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    
+    def Close(self):
+        """Stops the event loop and the thread pool. Calls still running in the pool are left to finish on their own."""
+        
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait = False)
+    
+    
+    def Abort(self):
+        """Ends the wait that is running straight away. Can be called from any thread."""
+        
+        try:
+            if self.thread is not None and self.loop.is_running():
+                self.loop.call_soon_threadsafe(self.Set_Abort)
+        ## The loop was closed in between, so there is no wait left to end.
+        except RuntimeError:
+            pass
+    
+    
+    def Set_Abort(self):
+        if self.abort_event is not None:
+            self.abort_event.set()
+    
+    
+    def Wait(self, primary, timeout, watch_instruments = True):
+        """Runs the coroutine primary until it returns or timeout seconds have passed, while watching for 
+        an abort and, if watch_instruments is True, for the Arduino being disconnected and CETAC errors. 
+        Blocks the calling thread until then. Returns what primary returned, \"Abort\", \"Pulled Plug\", 
+        \"CETAC Error\", or \"CETAC Closed\" if a watching task finished first, or \"Time Out\"."""
+        
+        if self.thread is None:
+            self.Start()
+        
+        return asyncio.run_coroutine_threadsafe(self.Race(primary, timeout, watch_instruments), self.loop).result()
+    
+    
+    async def Race(self, primary, timeout, watch_instruments):
+        tasks = [asyncio.ensure_future(primary), asyncio.ensure_future(self.Watch_Abort())]
+        if watch_instruments:
+            if self.batch_thread.serial_io is not None:
+                tasks.append(asyncio.ensure_future(self.Watch_Arduino()))
+            if self.batch_thread.CETAC_app is not None:
+                tasks.append(asyncio.ensure_future(self.Watch_CETAC()))
+        
+        done, pending = await asyncio.wait(tasks, timeout = self.clock.real_seconds(timeout), return_when = asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions = True)
+        
+        ## If several tasks finished together what the primary returned counts first, then the watching tasks in the order they were started.
+        for task in tasks:
+            if task in done:
+                return task.result()
+        return TIME_OUT
+    
+    
+    async def Sleep(self, seconds):
+        """Sleeps for seconds on the batch's clock."""
+        
+        await asyncio.sleep(self.clock.real_seconds(seconds))
+    
+    
+    async def Call(self, function, *args):
+        """Runs a blocking call in the thread pool and returns what it returned. Returns None if it raised 
+        an exception, or without calling it if every worker is still busy with an earlier call."""
+        
+        with self.pending_lock:
+            if self.pending_calls >= self.workers:
+                return None
+            self.pending_calls += 1
+        
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self.Call_Done)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return None
+    
+    
+    def Call_Done(self, future):
+        with self.pending_lock:
+            self.pending_calls -= 1
+    
+    
+    async def Watch_Abort(self):
+        """Returns \"Abort\" once the user aborts the batch."""
+        
+        if self.abort_event is None:
+            self.abort_event = asyncio.Event()
+        if not self.batch_thread.want_abort:
+            await self.abort_event.wait()
+        return "Abort"
+    
+    
+    async def Watch_Arduino(self):
+        """Returns \"Pulled Plug\" once the Arduino is disconnected and couldn't be reconnected."""
+        
+        serial_io = self.batch_thread.serial_io
+        while not serial_io.disconnected:
+            await self.Sleep(self.poll_interval)
+        return "Pulled Plug"
+    
+    
+    async def Watch_CETAC(self):
+        """Returns \"CETAC Error\" or \"CETAC Closed\" once the CETAC health check fails."""
+        
+        while True:
+            fault = await self.Call(self.batch_thread.CETAC_Fault)
+            if fault is not None:
+                return fault
+            await self.Sleep(self.ui_poll_interval)
+    
+    
+    async def Watch_Autosampler(self):
+        """Waits for a signal from the autosampler. In push mode the pulses the Arduino pushes are counted 
+        as they arrive and the first one that hasn't been handled yet is taken, so a pulse that arrived while 
+        the batch was busy is never lost. Otherwise the Arduino is asked every poll for its latch, which 
+        remembers a signal since it was last reset. Returns \"Signal Received\", or \"Pulled Plug\" if 
+        the Arduino was disconnected."""
+        
+        batch_thread = self.batch_thread
+        serial_io = batch_thread.serial_io
+        bad_frames = serial_io.bad_frames
+        ## Throw away any responses left over from previous commands.
+        if not batch_thread.push_mode:
+            serial_io.Clear_Events()
+        
+        while True:
+            if serial_io.disconnected:
+                return "Pulled Plug"
+            
+            if batch_thread.push_mode:
+                if serial_io.pulse_count > batch_thread.pulses_handled:
+                    batch_thread.pulses_handled += 1
+                    return "Signal Received"
+                ## A corrupted frame may have been a pushed pulse, so ask the Arduino for its latch instead.
+                ask_arduino = serial_io.bad_frames != bad_frames
+                bad_frames = serial_io.bad_frames
+            else:
+                ask_arduino = True
+            
+            if ask_arduino:
+                event = await self.Call(serial_io.Request, b"S", ["Latched", "Not Latched"], SERIAL_RESPONSE_TIMEOUT)
+                if event is not None and event.kind == "Disconnected":
+                    return "Pulled Plug"
+                elif event is not None and event.kind == "Latched":
+                    ## The pulse count catches up when the Arduino pushes its next pulse.
+                    if batch_thread.push_mode:
+                        batch_thread.pulses_handled += 1
+                    return "Signal Received"
+            
+            await self.Sleep(SERIAL_POLL_INTERVAL)
+    
+    
+    async def Watch_NTA_Window(self, regex):
+        """Returns \"Success\" once NTA has a window whose title matches regex. Checks are made quickly at 
+        first and then back off like NTA_Window_Check's, but only up to the UI poll interval."""
+        
+        batch_thread = self.batch_thread
+        if regex not in batch_thread.window_matchers:
+            batch_thread.window_matchers[regex] = re.compile(regex).search
+        matcher = batch_thread.window_matchers[regex]
+        
+        interval = WINDOW_CHECK_FIRST_INTERVAL
+        while True:
+            if await self.Call(lambda: any(matcher(str(window)) for window in batch_thread.NTA_app.windows())):
+                return "Success"
+            
+            await self.Sleep(interval)
+            interval = min(interval * WINDOW_CHECK_BACKOFF, self.ui_poll_interval)
+
+
+
+
+## Class taken from https://wiki.wxpython.org/LongRunningTasks and modified.
+# Thread class that executes processing
+class BatchThread(threading.Thread):
+    """Batch Thread Class."""
+    def __init__(self, batch_data, drivers = None):
+        """Init Serial Thread Class."""
+        threading.Thread.__init__(self)
+        self.batch_data = batch_data
+        
+        ## The instruments are reached through drivers, which are the real ones unless simulated ones are given.
+        if drivers is None:
+            drivers = WindowsDrivers(batch_data)
+        self.drivers = drivers
+        self.clock = drivers.clock
+        self.sample_df = batch_data.sample_df
+        ## Progress is reported through the status list so the GUI is never touched from this thread.
+        self.sample_statuses = batch_data.sample_statuses
+        self.want_abort = False
+        ## The event that tells the GUI the batch is over, posted by run after it has cleaned up.
+        self.final_event = None
+        ## Set once run has cleaned up. Waiting on it, unlike join, can be interrupted by Ctrl+C without 
+        ## the thread being taken as finished while it is still running.
+        self.finished = threading.Event()
+        self.push_mode = False
+        ## In push mode a pulse is handled by counting it, so a pulse that arrives while the batch is busy isn't lost.
+        self.pulses_handled = 0
+        ## How long the autosampler took to load each sample, for deciding how much processing fits in a move.
+        self.move_started = None
+        self.move_times = []
+        self.processed_during_move = False
+        self.wait_times = []
+        
+        ## Time every step of the batch so it can be seen where the time goes.
+        self.profiler = BatchProfiler(self.sample_df.loc[:, "Sample Name"], self.clock.perf_counter)
+        self.current_sample = None
+        self.window_matchers = {}
+        self.window_check_stats = []
+        
+        ## Index of the open windows so the existence and error checks don't search the whole desktop every time.
+        self.window_registry = WindowRegistry(drivers.window_backend, clock = self.clock.time)
+        self.window_registry.Register("NTA 3.3", r"NTA 3\.3")
+        self.window_registry.Register("CETAC Workstation", r"CETAC Workstation")
+        self.window_registry.Register("Error", r"Error")
+        ## Windows replaces a hung window with a ghost window from another process that has this title.
+        self.window_registry.Register("NTA Not Responding", r"NTA 3\.3.*\(Not Responding\)")
+        self.NTA_process_id = None
+        self.CETAC_process_id = None
+        ## Script_Key of the script loaded in NTA, or None if it isn't known, so the same script isn't loaded twice in a row.
+        self.loaded_script = None
+        self.nta_recovery = batch_data.nta_recovery_policy
+        ## Steps that time out or fail are retried by these policies before anyone is asked what to do.
+        self.retry_policies = batch_data.retry_policies
+        self.retry_counts = collections.Counter()
+        ## The messages of the step Retry_Step is trying, or None when it isn't trying one.
+        self.held_messages = None
+        self.processed_since_restart = 0
+        ## Set when NTA stopped responding while processing during an autosampler move, where restarting it would hold up the autosampler.
+        self.nta_restart_pending = False
+        ## The Arduino and CETAC aren't connected to in Process Only batches.
+        self.serial_io = None
+        self.arduino_reconnector = None
+        self.CETAC_app = None
+        
+        ## Index of the .nano files in the save directories so experiments can be found without listing the directory.
+        self.experiment_index = ExperimentFileIndex(self.clock)
+        
+        ## Journal of the completed steps so a batch that stops can be resumed where it left off.
+        self.journal = BatchJournal(Journal_Filepath(batch_data.sample_list_filepath), self.sample_df.loc[:, "Sample Name"])
+        
+        ## Exported results are added to a results store as they are exported, if pyarrow or PyTables is installed.
+        results_store = Open_Results_Store(batch_data.sample_list_filepath)
+        batch_id = os.path.splitext(os.path.basename(batch_data.sample_list_filepath))[0] + " " + time.strftime("%Y-%m-%d %H-%M-%S")
+        self.results_ingester = ResultsIngester(results_store, batch_id, self.clock) if results_store is not None else None
+        
+        ## Exported samples are analysed in worker processes while the batch runs, and the report written when it ends.
+        report_filepath = os.path.splitext(batch_data.sample_list_filepath)[0] + " Report " + time.strftime("%Y-%m-%d %H-%M-%S") + ".csv"
+        self.analysis_pool = AnalysisPool(self.sample_statuses, report_filepath, self.clock)
+        
+        ## The batch is run by a state machine so the order of its steps is a table, and the time spent in each state is profiled.
+        self.acquiring = None
+        self.processing = None
+        self.state_machine = BatchStateMachine(self.Batch_States(), BATCH_FAILURE_STATES, self.clock.perf_counter)
+        self.state_machine.Add_Listener(self.Record_Transition)
+        
+        ## The long waits run on an event loop alongside tasks that watch for aborts and faults, so those end the wait straight away.
+        self.orchestrator = BatchOrchestrator(self)
+        self.daemon = True
+        # This starts the thread running on creation, but you could
+        # also make the GUI thread responsible for calling this
+        self.start() 
+    
+    
+    def run(self):
+        """Run Batch Thread."""
+        
+        try:
+            self.Run_Batch()
+        finally:
+            try:
+                self.orchestrator.Close()
+                self.analysis_pool.Close()
+                if self.results_ingester is not None:
+                    self.results_ingester.Close()
+                    self.Report_Ingest_Errors()
+                self.journal.Close()
+                self.experiment_index.Close()
+                self.Write_Profile()
+            ## The GUI takes the final event to mean the batch is over, so it is only posted once everything is closed and written.
+            finally:
+                try:
+                    if self.final_event is not None:
+                        self.Post_Event(self.final_event)
+                finally:
+                    self.finished.set()
+    
+    
+    
+    
+    def Report_Ingest_Errors(self):
+        """Tells the user which samples' results couldn't be added to the results store, if any. This is done 
+        once the results ingester is closed, since it works through the exports in the background."""
+        
+        errors = self.results_ingester.errors
+        if len(errors) == 0:
+            return
+        
+        message = "The results of these samples could not be added to the results store " + self.results_ingester.store.path + \
+                  ". Their exports are still in their save directories.\n\n" + "\n".join(str(sample_name) + ": " + error for sample_name, error in errors)
+        self.Show_Message(message, "Warning", MESSAGE_OK | ICON_EXCLAMATION)
+    
+    
+    
+    
+    def Run_Batch(self, start = "Create Save Directories"):
+        """Runs the batch by running its state machine from the state named start, which is the first 
+        state unless a batch is being entered again part way through, and returns the state it ended in. 
+        The states are listed in Batch_States."""
+        
+        return self.state_machine.Run(start)
+    
+    
+    
+    
+    def Batch_States(self):
+        """Returns the table of states the batch runs through, from creating the save directories to 
+        sending the autosampler its last trigger. Each state's transitions say which state comes next 
+        for each outcome of its action, so the order of the batch can be read and changed here without 
+        following every branch. Timeouts are in seconds. The states of an acquisition cancel it when 
+        they fail, and the Aborted, Pulled Plug, and Stopped states do the clean up."""
+        
+        ## Outcomes of the steps that talk to the Arduino or wait for the autosampler when they don't succeed.
+        serial_failures = {"Abort":"Aborted", TIME_OUT:"Aborted", "Pulled Plug":"Pulled Plug"}
+        cancel = self.Cancel_Acquisition
+        
+        return [
+            ## Set up.
+            BatchState("Create Save Directories", self.Create_Save_Directories, {True:"Open Journal", False:"Stopped"}),
+            BatchState("Open Journal", self.Open_Journal, {True:"Connect To NTA", False:"Stopped"}),
+            BatchState("Connect To NTA", self.Connect_To_NTA, {True:"Check Acquisitions", False:"Stopped"}),
+            ## The Arduino and CETAC are only needed if there are samples to acquire.
+            BatchState("Check Acquisitions", lambda: "Acquire" if self.first_acquisition is not None else "Nothing To Acquire",
+                       {"Acquire":"Connect To Arduino", "Nothing To Acquire":"Next Process Step"}),
+            BatchState("Connect To Arduino", self.Connect_To_Arduino, {True:"Connect To CETAC", False:"Stopped"}),
+            BatchState("Connect To CETAC", self.Connect_To_CETAC, {True:"Enable Arduino Modes", False:"Stopped"}),
+            BatchState("Enable Arduino Modes", self.Enable_Arduino_Modes, {"*":"Reset Latch"}),
+            ## This reset of the latch is to make sure the latch starts from a known state before the batch begins.
+            BatchState("Reset Latch", self.Reset_Latch, dict(serial_failures, **{"Latch Cleared":"Check CETAC COM"})),
+            BatchState("Check CETAC COM", self.CETAC_Check_For_COM, {True:"Check CETAC Script", False:"Stopped"}),
+            BatchState("Check CETAC Script", self.CETAC_Check_For_Active_Script, {True:"Next Acquisition", False:"Stopped"}),
+            
+            ## Acquire the samples.
+            BatchState("Next Acquisition", self.Next_Acquisition, {"Acquire":"Start Acquisition", "Done":"Finish Acquisitions"}),
+            BatchState("Start Acquisition", self.Start_Acquisition, {"Started":"Prepare NTA", "Abort":"Aborted"}),
+            BatchState("Prepare NTA", self.Prepare_Acquisition, {"Prepared":"Start Autosampler", "Failed":"Aborted", "Abort":"Aborted"}, 
+                       compensation = cancel),
+            BatchState("Start Autosampler", self.Start_Autosampler, {"First Sample":"Run CETAC Script", "Next Sample":"Check CETAC Errors"}, 
+                       compensation = cancel),
+            BatchState("Run CETAC Script", self.Run_CETAC_Script, {"Running":"Wait For Sample", "Failed":"Stopped"}, compensation = cancel),
+            BatchState("Check CETAC Errors", self.CETAC_Check_For_Errors, {False:"Wait For Autosampler", True:"Aborted"}, compensation = cancel),
+            BatchState("Wait For Autosampler", self.Wait_For_Autosampler, 
+                       dict(serial_failures, **{"Signal Received":"Wait For Autosampler Output Off"}), 900, cancel),
+            ## Wait for the autosampler to turn off its output so we do not relatch the same output signal twice, 
+            ## and then give it a moment to move on to the trigger command before sending the signal.
+            BatchState("Wait For Autosampler Output Off", self.Settle_Autosampler, {"*":"Reset Latch Before Trigger"}, AS_TRIGGER_SETTLE_TIME, cancel),
+            BatchState("Reset Latch Before Trigger", self.Reset_Latch, dict(serial_failures, **{"Latch Cleared":"Trigger Autosampler"}), 
+                       compensation = cancel),
+            BatchState("Trigger Autosampler", self.Signal_Autosampler, dict(serial_failures, **{"Signal Sent":"Check CETAC Running"}), 
+                       compensation = cancel),
+            BatchState("Check CETAC Running", self.Check_CETAC_Running, {"Running":"Process During Move", "Stopped Running":"Aborted"}, 
+                       compensation = cancel),
+            ## In pipelined mode use the time the autosampler spends moving to and flushing this sample to process the previous one.
+            BatchState("Process During Move", self.Process_While_Autosampler_Moves, 
+                       {"Skipped":"Wait For Sample", "Processed":"Prepare NTA Again", "Abort":"Aborted", "Pulled Plug":"Pulled Plug", "Failed":"Aborted"}, 
+                       compensation = cancel),
+            ## Processing loads the Process Script in NTA, so the acquisition has to be set up again.
+            BatchState("Prepare NTA Again", self.Prepare_Acquisition_Again, {True:"Wait For Sample", False:"Aborted"}, 
+                       compensation = cancel),
+            BatchState("Wait For Sample", self.Wait_For_Sample, 
+                       dict(serial_failures, **{"Signal Received":"Run Acquire Script"}), 900, cancel),
+            BatchState("Run Acquire Script", self.NTA_Run_Script, {True:"Wait For Output Off", False:"Pulled Plug"}, compensation = cancel),
+            BatchState("Wait For Output Off", self.Settle_Autosampler, {"*":"Reset Latch After Start"}, AS_ACQUIRE_SETTLE_TIME, cancel),
+            BatchState("Reset Latch After Start", self.Reset_Latch, dict(serial_failures, **{"Latch Cleared":"Wait For NTA Script"}), 
+                       compensation = cancel),
+            BatchState("Wait For NTA Script", self.Wait_For_NTA_Script, 
+                       {"Aborted":"Aborted", "Pulled Plug":"Pulled Plug", "*":"Finish Acquisition"}, 600, cancel),
+            BatchState("Finish Acquisition", self.Finish_Acquisition, {"*":"Next Acquisition"}),
+            ## Give time for NTA to finish completing the script.
+            BatchState("Finish Acquisitions", lambda timeout: self.clock.sleep(timeout), {"*":"Next Process Step"}, 5),
+            
+            ## Process the samples. If samples were processed while the autosampler was moving then only the remaining ones are processed here.
+            BatchState("Next Process Step", self.Next_Process_Step, {"Process":"Process Sample", "Done":"Finish Batch"}),
+            BatchState("Process Sample", lambda: self.Process_With_Recovery(self.processing), {True:"Next Process Step", False:"Aborted"}),
+            
+            ## Give the autosampler the last trigger command so it can end its program. Nothing was acquired 
+            ## if the autosampler script wasn't started, so then there is no program to end.
+            BatchState("Finish Batch", self.Finish_Batch, {"Acquired":"Wait For Last Signal", "Nothing Acquired":"Complete"}),
+            BatchState("Wait For Last Signal", self.Wait_For_Autosampler, 
+                       dict(serial_failures, **{"Signal Received":"Wait For Last Output Off"}), 900, cancel),
+            BatchState("Wait For Last Output Off", self.Settle_Autosampler, {"*":"Send Last Trigger"}, AS_TRIGGER_SETTLE_TIME),
+            BatchState("Send Last Trigger", self.Signal_Autosampler, dict(serial_failures, **{"Signal Sent":"Check CETAC Finished"})),
+            BatchState("Check CETAC Finished", self.Check_CETAC_Finished, {"Finished":"Complete", "Still Running":"Aborted"}, compensation = cancel),
+            
+            ## The batch ends in one of these.
+            BatchState("Complete", self.Complete_Batch),
+            BatchState("Stopped", self.Stop_Batch),
+            BatchState("Aborted", self.Abort_Clean_Up),
+            BatchState("Pulled Plug", self.PP_Clean_Up)]
+    
+    
+    
+    
+    def Record_Transition(self, transition):
+        """Records the time spent in a state of the batch as a span in the profiler."""
+        
+        self.profiler.Add_Span(transition.state, transition.start, transition.seconds, self.current_sample, "state")
+    
+    
+    
+    
+    def Open_Journal(self):
+        """Builds the dependency graph of the batch steps, marks the steps already done, and opens the 
+        journal. Returns True if the journal was opened and False if not, in which case a message has been shown."""
+        
+        ## Build the dependency graph of the batch steps and keep track of which steps have been completed.
+        ## When resuming, the steps the journal says were completed are skipped.
+        self.batch_graph = self.Build_Batch_Graph()
+        self.completed_steps = set()
+        if self.batch_data.resume_batch:
+            self.Load_Journal()
+        
+        ## In Process Only mode the samples were acquired by an earlier batch, and in Acquire Only mode they aren't processed.
+        if self.batch_data.program_mode == "Process Only":
+            self.completed_steps.update((i, "Acquire") for i in range(len(self.sample_df)))
+        self.process_samples = self.batch_data.program_mode != "Acquire Only"
+        
+        try:
+            self.journal.Start(self.batch_data.resume_batch)
+        except (IOError, OSError) as e:
+            message = "Could not open the batch journal " + self.journal.filepath + ". Batch aborted.\n\n" + str(e)
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+            return False
+        
+        ## The autosampler script is started for the first sample that still needs acquiring. If all of 
+        ## them were acquired before, or the batch is Process Only, the autosampler isn't needed.
+        self.remaining_acquisitions = collections.deque(i for i in range(len(self.sample_df)) if (i, "Acquire") not in self.completed_steps)
+        self.first_acquisition = self.remaining_acquisitions[0] if len(self.remaining_acquisitions) > 0 else None
+        return True
+    
+    
+    
+    
+    def Enable_Arduino_Modes(self):
+        """Uses the binary protocol and has the Arduino push autosampler signals if its firmware supports them."""
+        
+        if ARDUINO_BINARY_PROTOCOL:
+            self.Enable_Binary_Mode()
+        self.Enable_Push_Mode()
+    
+    
+    
+    
+    def Reset_Latch(self):
+        """Resets the output latch in the Arduino. If something goes wrong with the Arduino at this point then it can
+        be fixed or replaced and the batch can continue, so it is retried by the retry policy and the user is asked once it runs out."""
+        
+        message = "Time out reached while trying to communicate with the Arduino. \nCheck that the Arduino is functioning properly."
+        return self.Retry_Step("Reset AS Output Latch", self.Reset_AS_Output_Latch, message)
+    
+    
+    
+    
+    def Signal_Autosampler(self):
+        """Sends the trigger signal to the autosampler, retrying it the same way as Reset_Latch."""
+        
+        message = "Time out reached while trying to signal the autosampler. \nCheck that the Arduino is functioning properly."
+        response = self.Retry_Step("Send Signal To AS", self.Send_Signal_To_AS, message)
+        if response == "Signal Sent":
+            self.move_started = self.clock.perf_counter()
+        
+        return response
+    
+    
+    
+    
+    def Next_Acquisition(self):
+        """Moves on to the next sample that still needs acquiring. Returns \"Acquire\" if there is one and \"Done\" if not."""
+        
+        if len(self.remaining_acquisitions) == 0:
+            self.acquiring = None
+            self.current_sample = None
+            return "Done"
+        
+        self.acquiring = self.remaining_acquisitions.popleft()
+        self.current_sample = self.acquiring
+        return "Acquire"
+    
+    
+    
+    
+    def Start_Acquisition(self):
+        """Shows the sample being acquired as in progress, unless the user has already asked to abort."""
+        
+        ## Before starting make sure the user hasn't already wanted to abort.
+        if self.want_abort:
+            return "Abort"
+        
+        ## Set the label in acquistion progress to in progress and change color to blue.
+        self.sample_statuses.Set_Status(self.acquiring, "Acquisition Progress", "In Progress")
+        self.sample_statuses.Set_Colour(self.acquiring, "light blue")
+        return "Started"
+    
+    
+    
+    
+    def Prepare_Acquisition(self):
+        """Sets up NTA for the sample being acquired and checks for an abort again afterwards."""
+        
+        if not self.Prepare_NTA_For_Acquisition(self.acquiring):
+            return "Failed"
+        
+        if self.want_abort:
+            return "Abort"
+        
+        return "Prepared"
+    
+    
+    
+    
+    def Prepare_Acquisition_Again(self):
+        """Sets up NTA for the sample being acquired again after samples were processed during the autosampler move. 
+        If NTA stopped responding while processing it is restarted first, since the acquisition can't go ahead without it. 
+        Returns True if NTA was set up and False if not."""
+        
+        if self.nta_restart_pending and not self.Restart_NTA():
+            return False
+        
+        return self.Prepare_NTA_For_Acquisition(self.acquiring)
+    
+    
+    
+    
+    def Start_Autosampler(self):
+        """Flushes the Arduino's input before the autosampler is started or triggered for the sample being acquired,
+        to make sure signals from a previous run or false signals aren't misinterpreted. Returns \"First Sample\" 
+        if the autosampler script has to be started for it and \"Next Sample\" if the autosampler has to be triggered."""
+        
+        self.serial_io.Clear_Events()
+        self.processed_during_move = False
+        
+        if self.acquiring == self.first_acquisition:
+            ## Pulses from before the autosampler script is started aren't from this batch.
+            self.pulses_handled = self.serial_io.pulse_count
+            return "First Sample"
+        else:
+            return "Next Sample"
+    
+    
+    
+    
+    def Run_CETAC_Script(self):
+        """Closes any windows left open in CETAC by the user, starts the autosampler script, and checks 
+        for errors after starting it. Returns \"Running\" if it started and \"Failed\" if not."""
+        
+        self.CETAC_Close_All_Windows()
+        
+        run_response = self.CETAC_Run_Script()
+        if run_response == "Run Script Button Disabled" or run_response == "Abort Script Button Disabled" or run_response == "No Samples Selected":
+            return "Failed"
+        
+        self.move_started = self.clock.perf_counter()
+        if self.CETAC_Check_For_Errors():
+            return "Failed"
+        
+        return "Running"
+    
+    
+    
+    
+    def Settle_Autosampler(self, timeout):
+        """Gives the autosampler timeout seconds to turn off its output and move on to its next command. If 
+        AS_SETTLE_ON_OUTPUT_OFF is True the wait instead ends AS_SETTLE_TIME seconds after the Arduino 
+        reports the output off, waiting for it for up to timeout seconds."""
+        
+        if AS_SETTLE_ON_OUTPUT_OFF:
+            self.Wait_For(self.AS_Output_Is_Off, timeout, "Autosampler Output Off")
+            self.clock.sleep(AS_SETTLE_TIME)
+        else:
+            self.clock.sleep(timeout)
+    
+    
+    
+    
+    def Check_CETAC_Running(self):
+        """Checks that the script is still running in CETAC after the autosampler was triggered. If it is not 
+        then the most likely cause is that less samples were selected in Select Sample Set than were in the sample list file."""
+        
+        self.clock.sleep(5)
+        if not self.CETAC_Is_Script_Running():
+            message = "The CETAC script is no longer running. The most likely cause is that there were more samples in the Sample List File than were selected in Select Sample Set."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+            return "Stopped Running"
+        
+        return "Running"
+    
+    
+    
+    
+    def Process_While_Autosampler_Moves(self):
+        """Processes the samples that are ready while the autosampler moves if the batch is pipelined, 
+        and returns what Process_During_Autosampler_Move returned, or \"Skipped\" if the batch isn't pipelined."""
+        
+        if self.batch_data.pipelined_processing and self.process_samples:
+            response = self.Process_During_Autosampler_Move()
+            self.processed_during_move = response == "Processed"
+            return response
+        
+        return "Skipped"
+    
+    
+    
+    
+    def Wait_For_Autosampler(self, timeout):
+        """Waits up to timeout seconds for the autosampler to signal, waiting again by the retry policy if it 
+        doesn't, and returns what Check_AS_Output_Latch returned."""
+        
+        return self.Retry_Step("Wait For Autosampler Signal", lambda: self.Check_AS_Output_Latch(timeout // 60))
+    
+    
+    
+    
+    def Wait_For_NTA_Script(self, timeout):
+        """Waits up to timeout seconds for the end of script message from NTA, waiting again by the retry 
+        policy if it doesn't come, and returns what Listen_For_End_Of_Script_NTA_Signal returned. The batch 
+        goes on if the message never comes, as the sample may have been acquired anyway."""
+        
+        return self.Retry_Step("Wait For NTA Script", lambda: self.Listen_For_End_Of_Script_NTA_Signal(timeout // 60), 
+                               aborted = "Aborted", gave_up = NTA_SCRIPT_GAVE_UP)
+    
+    
+    
+    
+    def Wait_For_Sample(self, timeout):
+        """Waits up to timeout seconds for the autosampler to signal that the sample is loaded, and returns 
+        what Wait_For_Autosampler returned. How long the autosampler took to load it is remembered unless 
+        samples were processed meanwhile, in which case the signal may have been waiting for a while."""
+        
+        response = self.Wait_For_Autosampler(timeout)
+        if response == "Signal Received" and not self.processed_during_move and self.move_started is not None:
+            self.move_times.append(self.clock.perf_counter() - self.move_started)
+        
+        return response
+    
+    
+    
+    
+    def Move_Time_Left(self):
+        """Returns how many seconds are left until the autosampler is expected to have loaded the sample, going by the 
+        quickest it has loaded a sample so far in the batch, or 0 if it hasn't loaded one without processing yet."""
+        
+        if len(self.move_times) == 0:
+            return 0
+        
+        return min(self.move_times) - (self.clock.perf_counter() - self.move_started)
+    
+    
+    
+    
+    def Processing_Estimate(self):
+        """Returns how many seconds processing a sample and then preparing NTA for the acquisition again is expected 
+        to take, going by the longest they have taken so far in the batch, or PIPELINE_PROCESSING_ESTIMATE for 
+        processing if no sample has been processed yet."""
+        
+        process_seconds = self.profiler.Longest("Process_Sample")
+        if process_seconds is None:
+            process_seconds = PIPELINE_PROCESSING_ESTIMATE
+        
+        return process_seconds + (self.profiler.Longest("Prepare_NTA_For_Acquisition") or 0)
+    
+    
+    
+    
+    def Finish_Acquisition(self):
+        """Shows the sample being acquired as complete and records it in the journal."""
+        
+        ## Set the label in acquistion progress to Complete and change color back to normal.
+        self.sample_statuses.Set_Status(self.acquiring, "Acquisition Progress", "Complete")
+        self.sample_statuses.Set_Colour(self.acquiring, "white")
+        
+        self.completed_steps.add((self.acquiring, "Acquire"))
+        self.journal.Record(self.acquiring, "Acquired")
+    
+    
+    
+    
+    def Cancel_Acquisition(self):
+        """Shows the sample being acquired as cancelled. This is the compensation of the acquisition states."""
+        
+        if self.acquiring is not None:
+            self.sample_statuses.Set_Status(self.acquiring, "Acquisition Progress", "Cancelled")
+    
+    
+    
+    
+    def Next_Process_Step(self):
+        """Moves on to the next sample that is ready to be processed. Returns \"Process\" if there is one and \"Done\" if not."""
+        
+        step = self.Next_Ready_Step("Process") if self.process_samples else None
+        if step is None:
+            self.processing = None
+            return "Done"
+        
+        self.processing = step[0]
+        self.current_sample = self.processing
+        return "Process"
+    
+    
+    
+    
+    def Finish_Batch(self):
+        """Returns \"Acquired\" if the autosampler script was started, so the autosampler has to be given
+        the last trigger to end its program, and \"Nothing Acquired\" if not."""
+        
+        self.current_sample = None
+        ## The last trigger belongs to the last sample, so that is the one cancelled if it fails.
+        self.acquiring = len(self.sample_df) - 1
+        
+        if self.first_acquisition is None:
+            return "Nothing Acquired"
+        
+        return "Acquired"
+    
+    
+    
+    
+    def Check_CETAC_Finished(self):
+        """Checks that the script in CETAC ended after the last trigger. If it is still running then the most likely 
+        cause is that more samples were selected in Select Sample Set than were in the sample list file."""
+        
+        self.clock.sleep(5)
+        if self.CETAC_Is_Script_Running():
+            self.CETAC_Abort_Script()
+            message = "The CETAC script was still running after completing all samples in the Sample List File. The most likely cause is that there were less samples in the Sample List File than were selected in Select Sample Set."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+            return "Still Running"
+        
+        return "Finished"
+    
+    
+    
+    
+    def Complete_Batch(self):
+        """Closes the connection to the Arduino and tells the user the batch is complete."""
+        
+        self.Close_Arduino()
+        
+        message = "Batch Complete!"
+        
+        ## In push mode the Arduino timestamps the autosampler signals, so report how long its cycles took.
+        if self.serial_io is not None:
+            cycle_times = self.serial_io.Cycle_Times()
+            if self.push_mode and len(cycle_times) > 0:
+                message = message + "\n\nAutosampler signals: " + str(self.serial_io.pulse_count) + \
+                          "\nMissed autosampler signals: " + str(self.serial_io.missed_pulses) + \
+                          "\nAverage time between autosampler signals: " + str(round(sum(cycle_times)/len(cycle_times), 1)) + " seconds"
+        if self.arduino_reconnector is not None and self.arduino_reconnector.reconnects > 0:
+            message = message + "\n\nThe Arduino was disconnected and reconnected " + str(self.arduino_reconnector.reconnects) + " time(s)."
+        if sum(self.retry_counts.values()) > 0:
+            message = message + "\n\nSteps retried after timing out: " + ", ".join(step + " " + str(count) + " time(s)" for step, count in sorted(self.retry_counts.items())) + "."
+        self.Show_Message(message, "Batch Complete", MESSAGE_OK)
+        
+        self.final_event = ThreadAbortedEvent()
+    
+    
+    
+    
+    def Stop_Batch(self):
+        """Closes the connection to the Arduino and stops the batch without aborting the NTA and CETAC 
+        scripts, for when the batch couldn't be started or set up."""
+        
+        self.Close_Arduino()
+        self.final_event = ThreadAbortedEvent()
+
+
+
+
+    @Profiled_Step(sets_sample = True)
+    def Prepare_NTA_For_Acquisition(self, i):
+        """Sets the base filename and loads the Acquire Script in NTA for the sample in row i of the
+        sample list. Returns True if successful and False if not."""
+
+        ## Set base filename for sample.
+        if not self.Retry_NTA_Step("NTA Set Filename", self.NTA_Set_Filename, self.sample_df.loc[:, "Save Directory"][i], self.sample_df.loc[:, "Sample Name"][i]):
+            return False
+        self.journal.Record(i, "Filename Set")
+
+        ## Set up correct script in autosampler and NanoSight.
+        if not self.Retry_NTA_Step("NTA Load Script", self.NTA_Load_Script, self.sample_df.loc[:, "Acquire Script"][i]):
+            return False
+
+        return True
+
+
+
+
+    @Profiled_Step("sample", sets_sample = True)
+    def Process_Sample(self, i):
+        """Processes the sample in row i of the sample list. Loads the Process Script in NTA, opens the
+        experiment for the sample, runs the script, and exports the results. Returns True if the sample
+        was processed and False if it wasn't or an abort was detected."""
+
+
+        if self.want_abort:
+            return False
+
+        ## Set the label in processing progress to in progress and change color to blue.
+        self.sample_statuses.Set_Status(i, "Processing Progress", "In Progress")
+        self.sample_statuses.Set_Colour(i, "light blue")
+
+        ## Once when running 10 standards in a row after the 4th standard was processed the NTA_Check_Existence
+        ## returned False. I am pretty sure it was the check existence call in NTA_Load_Script because the
+        ## program was still in the analysis tab. It should be noted that after the existence check failed 
+        ## the NTA program was pretty much locked up.
+        ## Turns out it might be that the NTA program can't process more than 4 samples in a row.
+        ## When I ran 4 processings in a row manually the same bug happened.
+        ## So instead of waiting 10 seconds before every sample, Process_With_Recovery probes NTA after 
+        ## each export and restarts it when it stops responding or the NTARecoveryPolicy says it is due.
+
+        ## Load Process Script
+        if not self.Retry_NTA_Step("NTA Load Script", self.NTA_Load_Script, self.sample_df.loc[:, "Process Script"][i]):
+            self.sample_statuses.Set_Status(i, "Processing Progress", "Cancelled")
+            return False
+
+        ## Open experiment to process.
+        if not self.Retry_NTA_Step("NTA Open Experiment", self.NTA_Open_Experiment, self.sample_df.loc[:, "Save Directory"][i], self.sample_df.loc[:, "Sample Name"][i]):
+            self.sample_statuses.Set_Status(i, "Processing Progress", "Cancelled")
+            return False
+
+
+
+        if self.want_abort:
+            self.sample_statuses.Set_Status(i, "Processing Progress", "Cancelled")
+            return False
+
+
+
+        ## Start NanoSight script. It isn't retried, since the Run click may have started the script before it failed.
+        if not self.NTA_Run_Script():
+            self.sample_statuses.Set_Status(i, "Processing Progress", "Cancelled")
+            return False
+
+        ## The assumption is that the process script will use the PROCESSBASIC command
+
+        ## Wait for end of script signal from NanoSight. Processing only uses NTA, so only an abort 
+        ## ends the wait early. Faults of the autosampler are noticed by the waits of the acquisitions.
+        listen_response = self.Retry_Step("Wait For NTA Script", lambda: self.Listen_For_End_Of_Script_NTA_Signal(watch_instruments = False), 
+                                          aborted = "Aborted", gave_up = NTA_SCRIPT_GAVE_UP)
+        ## Check to see if the batch was aborted while listening.
+        if listen_response == "Aborted":
+            self.sample_statuses.Set_Status(i, "Processing Progress", "Cancelled")
+            return False
+        self.journal.Record(i, "Processed")
+
+
+        ## Export results.
+        if not self.Retry_NTA_Step("NTA Export Results", self.NTA_Export_Results):
+            self.sample_statuses.Set_Status(i, "Processing Progress", "Cancelled")
+            return False
+
+        ## NTA exports next to the experiment, so add the export to the results store and analyse it from there.
+        self.Ingest_Results(i)
+
+
+        ## Set the label in acquistion progress to Complete and change color back to normal.
+        self.sample_statuses.Set_Status(i, "Processing Progress", "Complete")
+        self.sample_statuses.Set_Colour(i, "white")
+
+        self.completed_steps.add((i, "Process"))
+        self.journal.Record(i, "Exported")
+        self.processed_since_restart += 1
+        return True
+
+
+
+
+    def Ingest_Results(self, i):
+        """Queues the ExperimentSummary.csv exported for the sample in row i to be added to the results store and analysed."""
+
+        save_directory = self.sample_df.loc[:, "Save Directory"][i]
+        sample_name = self.sample_df.loc[:, "Sample Name"][i]
+        if self.batch_data.samples_have_individual_directories:
+            save_directory = os.path.join(save_directory, sample_name)
+
+        experiment_filepath = self.experiment_index.Lookup(save_directory, sample_name)
+        if experiment_filepath is None:
+            return
+
+        summary_filepath = os.path.splitext(experiment_filepath)[0] + "-ExperimentSummary.csv"
+        if self.results_ingester is not None:
+            self.results_ingester.Submit(i, sample_name, summary_filepath)
+        self.analysis_pool.Submit(i, sample_name, summary_filepath)
+
+
+
+
+    def Process_With_Recovery(self, i):
+        """Processes the sample in row i of the sample list and then probes NTA, restarting it if it isn't 
+        responding or the recovery policy says a restart is due. If processing fails while NTA is unresponsive 
+        NTA is restarted and the sample is processed again. A restart put off while processing during an 
+        autosampler move is done first, and NTA isn't restarted after the last sample. Returns True if the 
+        sample was processed and False if the batch has to be aborted."""
+
+        if self.nta_restart_pending and not self.Restart_NTA():
+            return False
+
+        for attempt in range(self.nta_recovery.max_retries + 1):
+            if self.Process_Sample(i):
+                if self.Next_Ready_Step("Process") is None:
+                    return True
+                if self.nta_recovery.Restart_Due(self.processed_since_restart) or not self.NTA_Is_Responsive():
+                    return self.Restart_NTA()
+                return True
+
+            ## Only failures caused by NTA hanging are retried, anything else aborts the batch as before.
+            if self.want_abort or attempt == self.nta_recovery.max_retries or self.NTA_Is_Responsive():
+                break
+
+            if not self.Restart_NTA():
+                break
+
+        return False
+
+
+
+
+    @Profiled_Step()
+    def NTA_Is_Responsive(self):
+        """Health probe for NTA. Returns True if the NTA 3.3 window is open, Windows isn't showing it 
+        as Not Responding, and it becomes enabled within the recovery policy's health timeout."""
+
+        self.window_registry.Invalidate()
+        if self.window_registry.Is_Present("NTA Not Responding") or not self.window_registry.Is_Present("NTA 3.3", self.NTA_process_id):
+            return False
+
+        nta = self.NTA_app["NTA 3.3"]
+        return self.Wait_For(lambda: nta.is_enabled(), self.nta_recovery.health_timeout, "NTA Responsive")
+
+
+
+
+    @Profiled_Step()
+    def Restart_NTA(self):
+        """Closes the NTA 3.3 program, starts it again, and reconnects to it. Returns True if NTA 
+        was ready again within the recovery policy's restart timeout and False if not, in which 
+        case a message has been shown."""
+
+        self.drivers.Restart_NTA(self.NTA_app)
+        self.window_registry.Invalidate()
+        self.NTA_process_id = None
+        self.loaded_script = None
+
+        if not self.Wait_For(lambda: self.window_registry.Is_Present("NTA 3.3") and not self.window_registry.Is_Present("NTA Not Responding"),
+                             self.nta_recovery.restart_timeout, "NTA Restarted", poll_interval = 1, abortable = True):
+            if not self.want_abort:
+                message = "The NTA 3.3 program did not start again within " + str(self.nta_recovery.restart_timeout) + " seconds of restarting it. Batch aborted."
+                self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+            return False
+
+        if not self.Connect_To_NTA():
+            return False
+
+        nta = self.NTA_app["NTA 3.3"]
+        self.Wait_For(lambda: nta.is_enabled(), self.nta_recovery.restart_timeout, "NTA Ready After Restart", poll_interval = 1)
+        self.processed_since_restart = 0
+        self.nta_restart_pending = False
+        return True
 
-        
-        ## Give time for NTA to finish completing the script.
-        time.sleep(5)
-            
-            
-            
-            
-            
-        
-        
-        
-        ######################
-        ## Process the samples.
-        ######################
+
+
+
+    def Load_Journal(self):
+        """Marks the steps the journal says were completed as done and shows them as Complete in the sample list.
+        A sample counts as acquired once its acquisition finished and as processed once its results were exported. 
+        A step that was cut off part way is done again from the start, since NTA's state after a stop isn't known."""
+
+        for i, steps in self.journal.Completed_Steps().items():
+            if "Acquired" in steps:
+                self.completed_steps.add((i, "Acquire"))
+                self.sample_statuses.Set_Status(i, "Acquisition Progress", "Complete")
+
+            if "Exported" in steps:
+                self.completed_steps.add((i, "Process"))
+                self.sample_statuses.Set_Status(i, "Processing Progress", "Complete")
+
+
+
+
+    def Build_Batch_Graph(self):
+        """Builds the dependency graph of the batch. Each sample has an \"Acquire\" step and a \"Process\"
+        step keyed as (sample index, step name), and each key maps to the list of steps it depends on.
+        Samples have to be acquired in sample list order because that is the order the autosampler delivers
+        them in. A sample can be processed once it has been acquired and the sample before it has been processed."""
+
+        batch_graph = collections.OrderedDict()
         for i in range(len(self.sample_df)):
-            
-            if self.want_abort:
-                wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-                return
-            
-            ## Set the label in processing progress to in progress and change color to blue.
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "In Progress")
-            self.batch_data.sample_list_ctrl.SetItemBackgroundColour(i, "light blue")
-            
-            ## Once when running 10 standards in a row after the 4th standard was processed the NTA_Check_Existence
-            ## returned False. I am pretty sure it was the check existence call in NTA_Load_Script because the 
-            ## program was still in the analysis tab. I think that maybe after exporting there needs to be some 
-            ## time before checking existence, so adding the below timer. It should be noted that after the 
-            ## existence check failed the NTA program was pretty much locked up, so it might have just been a fluke.
-            time.sleep(10)
-            ## Turns out it might be that the NTA program can't process more than 4 samples in a row.
-            ## When I ran 4 processings in a row manually the same bug happened.
-            
-            ## Load Process Script
-            if not self.NTA_Load_Script(self.sample_df.loc[:, "Process Script"][i]):
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            ## Open experiment to process.
-            if not self.NTA_Open_Experiment(self.sample_df.loc[:, "Save Directory"][i], self.sample_df.loc[:, "Sample Name"][i]):
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-                        
-            
+            batch_graph[(i, "Acquire")] = [(i-1, "Acquire")] if i > 0 else []
+            batch_graph[(i, "Process")] = [(i, "Acquire")] + ([(i-1, "Process")] if i > 0 else [])
+
+        return batch_graph
+
+
+
+
+    def Next_Ready_Step(self, step_name):
+        """Returns the first step in the batch graph named step_name that has not been completed and
+        whose dependencies have all been completed. Returns None if there is no such step."""
+
+        for step, dependencies in self.batch_graph.items():
+            if step[1] == step_name and step not in self.completed_steps and all([dependency in self.completed_steps for dependency in dependencies]):
+                return step
+
+        return None
+
+
+
+
+    def Process_During_Autosampler_Move(self):
+        """Processes the samples that are ready to be processed while the autosampler moves to and
+        flushes the next sample. A sample is only started while the autosampler hasn't signaled yet and 
+        processing it is expected to finish before the autosampler is expected to have loaded the sample, 
+        so the acquisition is never held up by processing.
+        Returns \"Processed\" if any samples were processed, \"Skipped\" if none were, \"Abort\" if
+        an abort was detected, \"Pulled Plug\" if a serial exception occured, or \"Failed\" if processing
+        failed."""
+
+        processed = False
+        step = self.Next_Ready_Step("Process")
+        while step:
+
             if self.want_abort:
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            
-            
-            ## Start NanoSight script.
-            if not self.NTA_Run_Script():
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            ## The assumption is that the process script will use the PROCESSBASIC command
+                return "Abort"
 
-            ## Wait for end of script signal from NanoSight.
-            listen_response = self.Listen_For_End_Of_Script_NTA_Signal()
-            ## Check to see if the batch was aborted while listening.
-            if listen_response == "Aborted":
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            
-            ## Export results.
-            if not self.NTA_Export_Results():
-                self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Cancelled")
-                self.Abort_Clean_Up()
-                return
-            
-            
-            ## Set the label in acquistion progress to Complete and change color back to normal.
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Processing Progress"), "Complete")
-            self.batch_data.sample_list_ctrl.SetItemBackgroundColour(i, "white")
-            
-            
-            
-            
-            
-            
-            
-            
-            
-        ## Give the autosampler the last trigger command so it can end its program.    
-        ## Wait for signal from autosampler.
-        timeout = 15
-        listen_response = self.Check_AS_Output_Latch(timeout)
-        ## Check to see if the batch was aborted while listening or the Arduino was disconnected.
-        if listen_response == "Abort" or listen_response == "Time Out":
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-            self.Abort_Clean_Up()
-            return
-        
-        elif listen_response == "Pulled Plug":
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-            self.PP_Clean_Up()
-            return
-        
-        
-        
-        ## Wait some time before sending signal to autosampler to make sure 
-        ## it has had time to move on to the trigger command.
-        time.sleep(6)
-        
-    
-        ## Send signal to autosampler.
-        ## If something goes wrong with the Arduino at this point then it can
-        ## be fixed or replaced and the batch can continue so allow the user to retry sending the signal to the AS.
-        while True:
-            send_response = self.Send_Signal_To_AS()
-            
-            if send_response == "Signal Sent":
+            latch_state = self.Read_AS_Output_Latch()
+            if latch_state == "Pulled Plug":
+                return "Pulled Plug"
+            elif latch_state != "Not Latched":
                 break
             
-            elif send_response == "Abort":
-                self.Abort_Clean_Up()
-                return
-            
-            elif send_response == "Pulled Plug":
-                self.PP_Clean_Up()
-                return
-            
-            elif send_response == "Time Out":
-                message = "Time out reached while trying to signal the autosampler. \nCheck that the Arduino is functioning properly. \nClick Yes to try sending the signal again."
-                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.YES_NO | wx.ICON_QUESTION)
-                answer = msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-                if not answer == wx.ID_YES:
-                    self.Abort_Clean_Up()
-                    return
-                
-        
-        
-        ## Check that script is still running in CETAC.
-        ## If it is then the most likely cause is that more samples 
-        ## were selected in Select Sample Set than were in the sample list file.
-        time.sleep(5)
-        if self.CETAC_Is_Script_Running():
-            self.CETAC_Abort_Script()
-            message = "The CETAC script was still running after completing all samples in the Sample List File. The most likely cause is that there were less samples in the Sample List File than were selected in Select Sample Set."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            answer = msg_dlg.ShowModal()
-            msg_dlg.Destroy()
-            self.batch_data.sample_list_ctrl.SetItem(i, self.batch_data.list_ctrl_col_names.index("Acquisition Progress"), "Cancelled")
-            self.Abort_Clean_Up()
-            return
+            if self.Processing_Estimate() > self.Move_Time_Left():
+                break
 
-        
-        self.ComPort.close()
-        
-        
-        message = "Batch Complete!"
-        msg_dlg = wx.MessageDialog(None, message, "Batch Complete", wx.OK)
-        answer = msg_dlg.ShowModal()
-        msg_dlg.Destroy()
-        
-        wx.PostEvent(self.batch_data, ThreadAbortedEvent())
-        
+            if not self.Process_Sample(step[0]):
+                return "Failed"
+
+            processed = True
+            ## Only the health probe is made here, and a restart it calls for waits until NTA is next idle.
+            if not self.NTA_Is_Responsive():
+                self.nta_restart_pending = True
+                break
+            
+            step = self.Next_Ready_Step("Process")
 
+        if processed:
+            return "Processed"
+        else:
+            return "Skipped"
     
     
     def abort(self):
         """Abort Batch Thread."""
         # Method for use by main thread to signal an abort.
         self.want_abort = True 
+        self.orchestrator.Abort()
+
+
+
+
+    def Show_Message(self, message, caption, style):
+        """Shows message to the user through the drivers and returns the button that was clicked. 
+        Notices the batch thread shows while Retry_Step is trying a step are held back for it instead."""
+        
+        if self.held_messages is not None and not style & MESSAGE_YES_NO and threading.current_thread() is self:
+            self.held_messages.append((message, caption, style))
+            return ID_OK
+        
+        return self.drivers.ui.Show_Message(message, caption, style)
+
+
+
+
+    def Question_Resolved(self, message, caption):
+        """Tells the UI through the drivers that the step the question message asked about succeeded after it was answered Yes."""
+        
+        self.drivers.ui.Question_Resolved(message, caption)
+
+
+
+
+    def Post_Event(self, event):
+        """Posts event to the GUI through the drivers."""
+        
+        self.drivers.ui.Post_Event(event)
 
 
 
 
     def Abort_Clean_Up(self):
-        """Calls the functions to abort the NTA and CETAC scripts, closes the 
-        serial connection to the Arduino, and posts the abort event to the main thread."""
+        """Calls the functions to abort the NTA and CETAC scripts, closes the serial connection 
+        to the Arduino, and sets the abort event to be posted to the main thread once run has cleaned up."""
         
         self.NTA_Abort_Script()
         self.CETAC_Abort_Script()
-        self.ComPort.close()
-        wx.PostEvent(self.batch_data, ThreadAbortedEvent())
+        self.Close_Arduino()
+        self.final_event = ThreadAbortedEvent()
     
     
     
     
     def PP_Clean_Up(self):
-        """Calls the functions to abort the NTA and CETAC scripts, closes the 
-        serial connection to the Arduino, and posts the pulled plug event to the main thread."""
+        """Calls the functions to abort the NTA and CETAC scripts, closes the serial connection 
+        to the Arduino, and sets the pulled plug event to be posted to the main thread once run has cleaned up."""
         
         self.NTA_Abort_Script()
         self.CETAC_Abort_Script()
-        self.ComPort.close()
-        wx.PostEvent(self.batch_data, PulledPlugEvent())
+        self.Close_Arduino()
+        self.final_event = PulledPlugEvent()
     
     
     
+    @Profiled_Step()
     def Create_Save_Directories(self):
         """Create the directories to save the acquisitons and analyses in."""
         
@@ -570,13 +3877,14 @@ class BatchThread(threading.Thread):
             except OSError as e:
                 if e.errno != errno.EEXIST:
                     problem_samples.append(sample_name)
+                    continue
+            
+            self.experiment_index.Watch(directory)
             
             
         if len(problem_samples) > 0:
             message = "An error occurred while creating the directories for the following sample(s): \n\n" + "\n".join(problem_samples) 
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         else:
@@ -586,92 +3894,88 @@ class BatchThread(threading.Thread):
     
     
     
+    @Profiled_Step()
     def Connect_To_Arduino(self):
         """Finds an Arduino in the list of serial ports and connects to it. If there are 
         multiple Arduino's a message is created and no connection is made. If there are no 
-        Arduino's a message is created and no connection is made. The serial settings are:
+        Arduino's a message is created and no connection is made. The drivers open the port with 
+        the serial settings:
             
             baudrate = 115200
             bytesize = 8
             parity = serial.PARITY_NONE
             stopbits = 1
-            timeout = 1"""
+            timeout = 1
+            
+        Once connected a SerialIOThread is started that owns the connection. If the connection drops 
+        the thread looks for the same Arduino to come back for ARDUINO_RECONNECT_GRACE seconds, and 
+        only if it doesn't is the batch aborted as a pulled plug."""
         
-        ports = [tuple(p) for p in list(serial.tools.list_ports_windows.comports())]
-        ports = {name:description for name, description, value2 in ports}
-        arduino_port = [name for name, description in ports.items() if re.search(r"Arduino", description)]
+        arduino_port = self.drivers.Find_Arduino_Ports()
         
         if len(arduino_port) == 0:
             message = "Could not find Arduino. Please connect the Arduino to run the batch."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         elif len(arduino_port) > 1:
             message = "There are too many Arduino's connected. The correct one can not be determined."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
             
         else:
             try:
-                ComPort = serial.Serial(arduino_port[0])
-                ComPort.baudrate = 115200
-                ComPort.bytesize = 8
-                ComPort.parity = serial.PARITY_NONE
-                ComPort.stopbits = 1
-                ComPort.timeout = 1
+                ComPort = self.drivers.Open_Serial(arduino_port[0])
                 
                 self.ComPort = ComPort
+                self.arduino_reconnector = ArduinoReconnector(self.drivers.Serial_Port_Identities, self.drivers.Open_Serial, arduino_port[0], self.clock)
+                self.serial_io = SerialIOThread(ComPort, self.profiler, self.clock, self.arduino_reconnector)
                 return True
 
-            except serial.serialutil.SerialException:
+            ## pyserial's SerialException is an OSError.
+            except OSError:
                 message = "Could not establish connection to Arduino. Check it and try again."
-                msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
+                self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
                 return False
     
     
     
     
     
+    @Profiled_Step()
     def Connect_To_NTA(self):
-        """Looks for a program with \"NTA 3.3\" in the title and connects to it using 
-        the pywinauto library. If no program is found a message is created."""
+        """Looks for a program with \"NTA 3.3\" in the title and connects to it through 
+        the drivers, which use the pywinauto library. If no program is found a message is created."""
     
-        windows = pywinauto.findwindows.find_elements()
-        if not any([re.search(r"NTA 3.3", str(window)) for window in windows]):
+        if not self.window_registry.Is_Present("NTA 3.3"):
             message = "The NTA 3.3 program is not started. Please start the program and try again."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
             
         else:
-            self.NTA_app = Application().connect(title_re = u".*NTA 3.3.*")
+            self.NTA_app = self.drivers.Connect_NTA()
+            self.NTA_process_id = self.NTA_app.process
+            ## NTA may have been restarted, so whatever script it has loaded isn't known.
+            self.loaded_script = None
             return True
     
     
     
     
     
+    @Profiled_Step()
     def Connect_To_CETAC(self):
-        """Looks for a program with \"CETAC Workstation\" in the title and connects to it using 
-        the automation library. If no program is found a message is created."""
+        """Looks for a program with \"CETAC Workstation\" in the title and connects to it through 
+        the drivers, which use the automation library. If no program is found a message is created."""
         
-        windows = pywinauto.findwindows.find_elements()
-        if not any([re.search(r"CETAC Workstation", str(window)) for window in windows]):
+        if not self.window_registry.Is_Present("CETAC Workstation"):
             message = "The CETAC Workstation program is not started. Please start the program and try again."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
             
         else:    
-            self.CETAC_app = automation.WindowControl(Name = "CETAC Workstation")
+            self.CETAC_app = self.drivers.Connect_CETAC()
+            self.CETAC_process_id = self.CETAC_app.ProcessId
             return True
     
     
@@ -681,12 +3985,9 @@ class BatchThread(threading.Thread):
     def NTA_Check_Existence(self):
         """Checks to make sure the NTA 3.3 program is still open. Returns True if it is, False if not."""
         
-        windows = [str(window) for window in pywinauto.findwindows.find_elements()]
-        if not any([re.search(r"NTA 3.3", str(window)) for window in windows]):
+        if not self.window_registry.Is_Present("NTA 3.3", self.NTA_process_id):
             message = "The NTA 3.3 program is not open."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
         else:
             return True
@@ -697,6 +3998,8 @@ class BatchThread(threading.Thread):
     
     
     
+    @Profiled_Step()
+    @UI_Automation_Step
     def NTA_Set_Filename(self, save_directory, sample_name):
         """Sets the base filename in the NTA 3.3 program according to save_directory and sample_name.
         If the samples have individual directories the path is save_directory\\sample_name\\sample_name.
@@ -712,47 +4015,40 @@ class BatchThread(threading.Thread):
         
         nta = self.NTA_app["NTA 3.3"]
         ## Wait for the window to be ready.
-        time.sleep(2)
+        self.Wait_For(lambda: nta.is_enabled(), NTA_READY_TIMEOUT, "NTA Window Ready")
         ## Select the tab with the load script button.
         nta.TabControl2.Select(u'SOP')
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TabContol2.get_selected_tab() == 0, NTA_WAIT_TIMEOUT, "SOP Tab Selected")
         
         ## Check that tab was selected.
         if nta.TabContol2.get_selected_tab() != 0:
-            message = "Could not select the SOP tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not select the SOP tab in NTA."
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         ## Select "Recent Measurements" from the combo box.
         nta.TabControl3.Select(u"Recent Measurements")
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TableControl3.get_selected_tab() == 0, NTA_WAIT_TIMEOUT, "Recent Measurements Tab Selected")
         
         ## Check that the combo box option was selected.
         if nta.TableControl3.get_selected_tab() != 0:
-            message = "Could not select the Recent Measurements tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not select the Recent Measurements tab in NTA."
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         ## Click the load script button.
         nta["..."].click()
-        time.sleep(2)
         
         ## Make sure the click was successful and a save dialog was created.
         window_check_result = self.NTA_Window_Check("\'Save As\'", True, 0.2)
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            message = "Could not click the \"...\" button to select a base filename in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "Could not click the \"...\" button to select a base filename in NTA."
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
@@ -760,23 +4056,20 @@ class BatchThread(threading.Thread):
         
         ## File dialog interaction.
         window = self.NTA_app["Save As"]
-        time.sleep(2)
+        self.Wait_For(lambda: window["Edit"].is_enabled(), NTA_WAIT_TIMEOUT, "Save As Dialog Ready")
         window["Edit"].set_text(file_path)
-        time.sleep(2)
+        self.Wait_For(lambda: window["Edit"].texts()[0] == file_path, NTA_WAIT_TIMEOUT, "Save As File Path Entered")
         
         ## Check that the text was edited.
         if window["Edit"].texts()[0] != file_path:
-            message = "Could not enter the file path into the Save As dialog in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not enter the file path into the Save As dialog in NTA."
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
-        window = automation.WindowControl(Name = "Save As")
+        window = self.drivers.Window_Control("Save As")
         window.SetActive(waitTime=1)
         window.ButtonControl(Name = "Save").Click()
-        time.sleep(3)
         
         ## Make sure the window closed after clicking open.
         ## If it did not then something went wrong.
@@ -784,11 +4077,9 @@ class BatchThread(threading.Thread):
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            message = "Could not click the Save button in the Save As dialog in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "Could not click the Save button in the Save As dialog in NTA."
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
@@ -797,55 +4088,58 @@ class BatchThread(threading.Thread):
     
     
     
+    @Profiled_Step()
+    @UI_Automation_Step
     def NTA_Load_Script(self, script_filepath):
-        """Loads the script indicated by script_filepath in the NTA 3.3 program."""
+        """Loads the script indicated by script_filepath in the NTA 3.3 program. If the same 
+        script file with the same contents is already loaded then nothing is done."""
+        
+        script_key = Script_Key(script_filepath)
+        if script_key is not None and script_key == self.loaded_script:
+            return True
+        
+        ## If the load fails part way it isn't known what script NTA is left with.
+        self.loaded_script = None
         
         if not self.NTA_Check_Existence():
             return False
         
         nta = self.NTA_app["NTA 3.3"]
         ## Wait for the window to be ready.
-        time.sleep(2)
+        self.Wait_For(lambda: nta.is_enabled(), NTA_READY_TIMEOUT, "NTA Window Ready")
         ## Select the tab with the load script button.
         nta.TabControl2.Select(u'SOP')
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TabContol2.get_selected_tab() == 0, NTA_WAIT_TIMEOUT, "SOP Tab Selected")
         
         ## Check that tab was selected.
         if nta.TabContol2.get_selected_tab() != 0:
-            message = "Could not select the SOP tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Load Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not select the SOP tab in NTA."
+            self.Show_Message(message, "NTA Load Script Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         ## Select "Recent Measurements" from the combo box.
         nta.TabControl3.Select(u"Recent Measurements")
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TableControl3.get_selected_tab() == 0, NTA_WAIT_TIMEOUT, "Recent Measurements Tab Selected")
         
         ## Check that the combo box option was selected.
         if nta.TableControl3.get_selected_tab() != 0:
-            message = "Could not select the Recent Measurements tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not select the Recent Measurements tab in NTA."
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         ## Click the load script button.
         nta["Load Script"].click()
-        time.sleep(2)
         
         ## Make sure the click was successful and an Open dialog was created.
         window_check_result = self.NTA_Window_Check("\'Open\'", True, 0.2)
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            message = "Could not load a script in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Load Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "Could not load a script in NTA."
+            self.Show_Message(message, "NTA Load Script Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
@@ -853,23 +4147,20 @@ class BatchThread(threading.Thread):
         
         ## File dialog interaction.
         window = self.NTA_app["Open"]
-        time.sleep(2)
+        self.Wait_For(lambda: window["Edit"].is_enabled(), NTA_WAIT_TIMEOUT, "Open Dialog Ready")
         window["Edit"].set_text(script_filepath)
-        time.sleep(2)
+        self.Wait_For(lambda: window["Edit"].texts()[0] == script_filepath, NTA_WAIT_TIMEOUT, "Open File Path Entered")
         
         ## Check that the text was edited.
         if window["Edit"].texts()[0] != script_filepath:
-            message = "Could not enter the file path into the Open dialog in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Load Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not enter the file path into the Open dialog in NTA."
+            self.Show_Message(message, "NTA Load Script Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
-        window = automation.WindowControl(Name = "Open")
+        window = self.drivers.Window_Control("Open")
         window.SetActive(waitTime=1)
         window.SplitButtonControl(Name = "Open").Click()
-        time.sleep(3)
         
         ## Make sure the window closed after clicking open.
         ## If it did not then something went wrong.
@@ -877,19 +4168,20 @@ class BatchThread(threading.Thread):
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            message = "Could not load a script in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Load Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "Could not load a script in NTA."
+            self.Show_Message(message, "NTA Load Script Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
+        self.loaded_script = script_key
         return True
     
     
 
 
+    @Profiled_Step()
+    @UI_Automation_Step
     def NTA_Run_Script(self):
         """Clicks the Run button to run a script in the NTA 3.3 program. This is 
         the button located in the SOP tab under Recent Measurements, not to be 
@@ -902,56 +4194,51 @@ class BatchThread(threading.Thread):
         
         nta = self.NTA_app["NTA 3.3"]
         ## Wait for the window to be ready.
-        time.sleep(2)
+        self.Wait_For(lambda: nta.is_enabled(), NTA_READY_TIMEOUT, "NTA Window Ready")
         ## Select the tab with the load script button.
         nta.TabControl2.Select(u'SOP')
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TabContol2.get_selected_tab() == 0, NTA_WAIT_TIMEOUT, "SOP Tab Selected")
         
         ## Check that tab was selected.
         if nta.TabContol2.get_selected_tab() != 0:
             message = "Could not select the SOP tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Run Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "NTA Run Script Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         ## Select "Recent Measurements" from the combo box.
         nta.TabControl3.Select(u"Recent Measurements")
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TableControl3.get_selected_tab() == 0, NTA_WAIT_TIMEOUT, "Recent Measurements Tab Selected")
         
         ## Check that the combo box option was selected.
         if nta.TableControl3.get_selected_tab() != 0:
             message = "Could not select the Recent Measurements tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Set File Name Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "NTA Set File Name Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         ## Click the run button.
         nta["Run"].click()
-        time.sleep(2)
         ## At time of writing there is no way to confirm that the script is running.
+        ## There is also nothing to wait on for a warning dialog that may or may not appear, so 
+        ## this wait can't be replaced by a condition.
+        self.clock.sleep(2)
         
         ## Close any warning message that may appear such as from the camerasettingmessage command.
         window_check_result = self.NTA_Window_Check("\'Warning\'", False, 0.2)
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            window = automation.WindowControl(Name = "Warning")
+        elif window_check_result == TIME_OUT:
+            window = self.drivers.Window_Control("Warning")
             window.SetActive(waitTime=1)
             window.ButtonControl(Name = "Yes").Click()
-            time.sleep(2)
             
             window_check_result = self.NTA_Window_Check("\'Warning\'", False, 0.2)
         
             if window_check_result == "Abort":
                 return False
-            elif window_check_result == "Timed Out":
+            elif window_check_result == TIME_OUT:
                 message = "Could not close the warning dialog in NTA. Batch aborted."
-                msg_dlg = wx.MessageDialog(None, message, "NTA Run Script Error", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
+                self.Show_Message(message, "NTA Run Script Error", MESSAGE_OK | ICON_ERROR)
                 return False
             
                 
@@ -962,6 +4249,8 @@ class BatchThread(threading.Thread):
 
 
 
+    @Profiled_Step()
+    @UI_Automation_Step
     def NTA_Open_Experiment(self, save_directory, sample_name, timeout=2):
         """Opens the experiment given by save_directory and sample_name in the NTA 3.3 program.
         If samples have individual directories the file path is save_directory\\sample_name\\sample_name.nano.
@@ -975,30 +4264,26 @@ class BatchThread(threading.Thread):
         
         nta = self.NTA_app["NTA 3.3"]
         ## Wait for the window to be ready.
-        time.sleep(2)
+        self.Wait_For(lambda: nta.is_enabled(), NTA_READY_TIMEOUT, "NTA Window Ready")
         ## Select the analysis tab.
         nta.TabControl2.Select(u'Analysis')
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TabContol2.get_selected_tab() == 2, NTA_WAIT_TIMEOUT, "Analysis Tab Selected")
         
         ## Check that tab was selected.
         if nta.TabContol2.get_selected_tab() != 2:
-            message = "Could not select the Analysis tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Open Experiment Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not select the Analysis tab in NTA."
+            self.Show_Message(message, "NTA Open Experiment Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         ## Select current experiment tab.
         nta.TabControl4.Select(u"Current Experiment")
-        time.sleep(2)
+        self.Wait_For(lambda: nta.TabContol4.get_selected_tab() == 1, NTA_WAIT_TIMEOUT, "Current Experiment Tab Selected")
         
         ## Check that tab was selected.
         if nta.TabContol4.get_selected_tab() != 1:
-            message = "Could not select the Current Experiment tab in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Open Experiment Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not select the Current Experiment tab in NTA."
+            self.Show_Message(message, "NTA Open Experiment Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
@@ -1006,31 +4291,17 @@ class BatchThread(threading.Thread):
         ## Before opening the experiment look to see what the experiment name is.
         ## It should be save_directory\sample_name\sample_name.nano or save_directory\sample_name.nano 
         ## but if the date time option is turned on then it will have a time stamp appended to it.
-        ## Look in the directory for the file name and see if it has the time stamp or not.
+        ## Look the file name up in the experiment index, which picks the newest time stamped file if
+        ## there are several. NTA can still be writing the file out, so wait a little for it to show up.
         if self.batch_data.samples_have_individual_directories:
             sample_directory = os.path.join(save_directory, sample_name)
         else:
             sample_directory = save_directory
-        files_in_sample_directory = os.listdir(sample_directory)
-        sample_file_list = [name for name in files_in_sample_directory if re.match(sample_name+".nano", name)]
-        date_stamp_regex = sample_name+" \d\d\d\d-\d\d-\d\d \d\d-\d\d-\d\d.nano"
-        date_stamp_list = [name for name in files_in_sample_directory if re.match(date_stamp_regex, name)]
+        file_path = self.experiment_index.Wait_For_File(sample_directory, sample_name, NTA_WAIT_TIMEOUT)
         
-        ## If there are multiple nano files in the sample directory with the same name 
-        ## choose the one with the greatest timestamp. This also covers the case where 
-        ## there are time stamp files and a non stamped file. Choose the highest time stamp 
-        ## file in both situations.
-        if len(date_stamp_list) > 0:
-            file_path = os.path.join(sample_directory, max(date_stamp_list))
-            
-        elif len(sample_file_list) == 1:
-            file_path = os.path.join(sample_directory, sample_file_list[0])
-        
-        else:
-            message = "Could not locate the .nano file for sample " + sample_name + ". Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        if file_path is None:
+            message = "Could not locate the .nano file for sample " + sample_name + "."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
             
         
@@ -1038,41 +4309,35 @@ class BatchThread(threading.Thread):
         
         ## Click the open experiment button.
         nta["Open Experiment"].Click()
-        time.sleep(2)
         
         ## Make sure the click worked and created an Open dialog.
         window_check_result = self.NTA_Window_Check("\'Open\'", True, 0.5)
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            message = "Could not open an experiment in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "Could not open an experiment in NTA."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         
         ## File dialog interaction.
         window = self.NTA_app["Open"]
-        time.sleep(2)
+        self.Wait_For(lambda: window["Edit"].is_enabled(), NTA_WAIT_TIMEOUT, "Open Dialog Ready")
         window["Edit"].set_text(file_path)
-        time.sleep(2)
+        self.Wait_For(lambda: window["Edit"].texts()[0] == file_path, NTA_WAIT_TIMEOUT, "Open File Path Entered")
         
         ## Check that the text was edited.
         if window["Edit"].texts()[0] != file_path:
-            message = "Could not enter the file path into the Open dialog in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Open Experiment Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            message = "Could not enter the file path into the Open dialog in NTA."
+            self.Show_Message(message, "NTA Open Experiment Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
-        window = automation.WindowControl(Name = "Open")
+        window = self.drivers.Window_Control("Open")
         window.SetActive(waitTime=1)
         window.SplitButtonControl(Name = "Open").Click()
-        time.sleep(3)
         
         ## Make sure the window closed after clicking open.
         ## If it did not then something went wrong.
@@ -1080,36 +4345,24 @@ class BatchThread(threading.Thread):
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Timed Out":
-            message = "Could not open an experiment in NTA. Batch aborted."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "Could not open an experiment in NTA."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         
         
-        reg_exp = sample_name + ".*"
-        start_time = time.time()
-        
         ## Wait for experiment to load in NTA.
-        while not self.want_abort:
-            
-            loaded_samples = nta.ListBox.item_texts()
-            if not any([re.match(reg_exp,loaded_sample) for loaded_sample in loaded_samples]):
-                time.sleep(1)
-                
-                if (time.time() - start_time)/60 > timeout:
-                    message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for an experiment to load in the NTA 3.3 program. \nCheck the program and try again."
-                    msg_dlg = wx.MessageDialog(None, message, "Error. Batch Aborted.", wx.OK | wx.ICON_ERROR)
-                    msg_dlg.ShowModal()
-                    msg_dlg.Destroy()
-                    return False
-                
-            else:
-                return True
-            
-        return False
+        if self.Wait_For(lambda: any(loaded_sample.startswith(sample_name) for loaded_sample in nta.ListBox.item_texts()), timeout*60, "Experiment Loaded", poll_interval = 0.5, abortable = True):
+            return True
+        
+        elif self.want_abort:
+            return False
+        
+        else:
+            message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for an experiment to load in the NTA 3.3 program. \nCheck the program and try again."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+            return False
         
         
         
@@ -1118,6 +4371,8 @@ class BatchThread(threading.Thread):
 
 
 
+    @Profiled_Step()
+    @UI_Automation_Step
     def NTA_Export_Results(self, timeout = 10):
         """Looks for an Export Settings dialog and clicks Export if it exists 
         otherwise clicks Export Results and then clicks Export on the created dialog.
@@ -1131,7 +4386,7 @@ class BatchThread(threading.Thread):
         
         nta = self.NTA_app["NTA 3.3"]
         ## Wait for the window to be ready.
-        time.sleep(2)
+        self.Wait_For(lambda: nta.is_enabled(), NTA_READY_TIMEOUT, "NTA Window Ready")
         
         ## Look to see if the script called export or not.
         window_check_result = self.NTA_Window_Check("\'Export Settings\'", True, 0.5)
@@ -1139,55 +4394,47 @@ class BatchThread(threading.Thread):
         if window_check_result == "Abort":
             return False
         elif window_check_result == "Success":
-            window = automation.WindowControl(Name = "Export Settings")
+            window = self.drivers.Window_Control("Export Settings")
             window.SetActive(waitTime=1)
             window.ButtonControl(Name = "Export").Click()
-            time.sleep(2)
             
         else:
             nta.TabControl2.Select(u'Analysis')
-            time.sleep(2)
+            self.Wait_For(lambda: nta.TabContol2.get_selected_tab() == 2, NTA_WAIT_TIMEOUT, "Analysis Tab Selected")
             
             ## Check that tab was selected.
             if nta.TabContol2.get_selected_tab() != 2:
-                message = "Could not select the Analysis tab in NTA. Batch aborted."
-                msg_dlg = wx.MessageDialog(None, message, "NTA Export Results Error", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
+                message = "Could not select the Analysis tab in NTA."
+                self.Show_Message(message, "NTA Export Results Error", MESSAGE_OK | ICON_ERROR)
                 return False
         
         
             ## Select current experiment tab.
             nta.TabControl4.Select(u"Current Experiment")
-            time.sleep(2)
+            self.Wait_For(lambda: nta.TabContol4.get_selected_tab() == 1, NTA_WAIT_TIMEOUT, "Current Experiment Tab Selected")
             
             ## Check that tab was selected.
             if nta.TabContol4.get_selected_tab() != 1:
-                message = "Could not select the Current Experiment tab in NTA. Batch aborted."
-                msg_dlg = wx.MessageDialog(None, message, "NTA Export Results Error", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
+                message = "Could not select the Current Experiment tab in NTA."
+                self.Show_Message(message, "NTA Export Results Error", MESSAGE_OK | ICON_ERROR)
                 return False
         
         
             ## Click the export results button.
             nta["Export Results"].Click()
-            time.sleep(2)
             
             ## Make sure export window appears.
             window_check_result = self.NTA_Window_Check("\'Export Settings\'", True, 0.5)
         
             if window_check_result == "Abort":
                 return False
-            elif window_check_result == "Time Out":
-                message = "Could not export results in NTA. Batch aborted."
-                msg_dlg = wx.MessageDialog(None, message, "NTA Export Results Error", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
+            elif window_check_result == TIME_OUT:
+                message = "Could not export results in NTA."
+                self.Show_Message(message, "NTA Export Results Error", MESSAGE_OK | ICON_ERROR)
                 return False
             
             
-            window = automation.WindowControl(Name = "Export Settings")
+            window = self.drivers.Window_Control("Export Settings")
             window.SetActive(waitTime=1)
             window.ButtonControl(Name = "Export").Click()
 
@@ -1199,11 +4446,9 @@ class BatchThread(threading.Thread):
         
         if window_check_result == "Abort":
             return False
-        elif window_check_result == "Time Out":
-            message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for NTA to export results. \nCheck the program and try again. \nBatch Aborted."
-            msg_dlg = wx.MessageDialog(None, message, "NTA Export Results Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+        elif window_check_result == TIME_OUT:
+            message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for NTA to export results. \nCheck the program and try again."
+            self.Show_Message(message, "NTA Export Results Error", MESSAGE_OK | ICON_ERROR)
             return False
         elif window_check_result == "Success":
             return True
@@ -1220,12 +4465,9 @@ class BatchThread(threading.Thread):
     def CETAC_Check_Existence(self):
         """Checks to make sure the CETAC Workstation program is still open. Returns True if it is, False if not."""
         
-        windows = pywinauto.findwindows.find_elements()
-        if not any([re.search(r"CETAC Workstation", str(window)) for window in windows]):
+        if not self.window_registry.Is_Present("CETAC Workstation", self.CETAC_process_id):
             message = "The CETAC Workstation program is not open."
-            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
             return False
         else:
             return True
@@ -1238,6 +4480,8 @@ class BatchThread(threading.Thread):
 
 
 
+    @Profiled_Step()
+    @UI_Automation_Step
     def CETAC_Close_All_Windows(self):
         """Looks for any windows open under the CETAC Workstation app and closes them."""
         
@@ -1256,6 +4500,8 @@ class BatchThread(threading.Thread):
  
     
     
+    @Profiled_Step()
+    @UI_Automation_Step
     def CETAC_Run_Script(self):
         """Clicks the Run Script button in the CETAC Workstation program."""
         
@@ -1269,30 +4515,24 @@ class BatchThread(threading.Thread):
             self.CETAC_app.ButtonControl(Name="Run Script").Click()
         else:
             message = "An error occured loading the script. \nThe Run Script button in the CETAC program cannot be clicked. \nBatch Aborted."
-            msg_dlg = wx.MessageDialog(None, message, "CETAC Workstation Run Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "CETAC Workstation Run Script Error", MESSAGE_OK | ICON_ERROR)
             return "Run Script Button Disabled"
         
         ## Wait a couple of seconds and see if the abort script button becomes enabled.
         ## This is confirmation that the script is running.
-        time.sleep(3)
+        self.clock.sleep(3)
         
         warning_dialogs = [control for control in self.CETAC_app.GetChildren() if control.ControlTypeName == "WindowControl" and control.Name == "Warning"]
         if any([dialog.TextControl().Name == "No tube locations have been selected in \"Select Sample Set\"" for dialog in warning_dialogs]):
             message = "Tube locations have not been selected in the CETAC program. Set tube locations and try again."
-            msg_dlg = wx.MessageDialog(None, message, "CETAC Workstation Run Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "CETAC Workstation Run Script Error", MESSAGE_OK | ICON_ERROR)
             return "No Samples Selected"
         
         elif self.CETAC_app.ButtonControl(Name="Abort Script").IsEnabled:
             return "Running Script"
         else:
             message = "An unknown error has occured. \nThe Run Script button in the CETAC program has been clicked, but the script is not running."
-            msg_dlg = wx.MessageDialog(None, message, "CETAC Workstation Run Script Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "CETAC Workstation Run Script Error", MESSAGE_OK | ICON_ERROR)
             return "Abort Script Button Disabled"
     
     
@@ -1308,6 +4548,7 @@ class BatchThread(threading.Thread):
     
     
     
+    @Profiled_Step()
     def CETAC_Check_For_Errors(self):
         """This is intended to look for errors generated by the CETAC program, but the error dialogs
          created by the CETAC program are not associated with it, so this function really just looks 
@@ -1316,21 +4557,48 @@ class BatchThread(threading.Thread):
         if not self.CETAC_Check_Existence():
             return False
         
-        windows = pywinauto.findwindows.find_elements()
-        if any([re.search(r"Error", str(window)) for window in windows]):
+        ## Error dialogs are looked for in every process since they aren't associated with the CETAC program.
+        if self.window_registry.Is_Present("Error"):
             message = "The CETAC Workstation program appears to have errored. The batch has been aborted."
-            msg_dlg = wx.MessageDialog(None, message, "CETAC Workstation Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "CETAC Workstation Error", MESSAGE_OK | ICON_ERROR)
             return True
         else:
             return False
     
+    
+    
+    
+    def CETAC_Fault(self):
+        """Health check of CETAC that the orchestrator runs while the batch waits. Returns \"CETAC Closed\" 
+        if the CETAC Workstation program is no longer open, \"CETAC Error\" if an error dialog is open, 
+        or None if neither. Unlike the checks above it shows no message, so it can run in any thread."""
+        
+        if not self.window_registry.Is_Present("CETAC Workstation", self.CETAC_process_id):
+            return "CETAC Closed"
+        elif self.window_registry.Is_Present("Error"):
+            return "CETAC Error"
+        else:
+            return None
+    
+    
+    
+    
+    def Show_CETAC_Fault(self, fault):
+        """Tells the user about a fault found by CETAC_Fault."""
+        
+        if fault == "CETAC Closed":
+            message = "The CETAC Workstation program closed while the batch was running. The batch has been aborted."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+        else:
+            message = "The CETAC Workstation program appears to have errored. The batch has been aborted."
+            self.Show_Message(message, "CETAC Workstation Error", MESSAGE_OK | ICON_ERROR)
+    
 
     
  
     
     
+    @Profiled_Step()
     def CETAC_Check_For_COM(self):
         """Checks that communications are extablished with the CETAC Workstation and autosampler by 
         checking to see if the Disconnect button is enabled. Returns True if it is and False otherwise."""
@@ -1348,15 +4616,14 @@ class BatchThread(threading.Thread):
             return True
         else:
             message = "Communications have not been established with the autosampler in the CETAC program. Initialize communication and try again."
-            msg_dlg = wx.MessageDialog(None, message, "CETAC Workstation Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "CETAC Workstation Error", MESSAGE_OK | ICON_ERROR)
             return False
     
     
     
     
     
+    @Profiled_Step()
     def CETAC_Check_For_Active_Script(self):
         """Checks that a script is opened in the CETAC Workstation program by checking 
         if the Run Script button is enabled. Returns True if it is and False otherwise."""
@@ -1366,9 +4633,7 @@ class BatchThread(threading.Thread):
         
         if not self.CETAC_app.ButtonControl(Name="Run Script").IsEnabled:
             message = "There is no script loaded in the CETAC program. \nLoad a script and try again."
-            msg_dlg = wx.MessageDialog(None, message, "CETAC Workstation Error", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
+            self.Show_Message(message, "CETAC Workstation Error", MESSAGE_OK | ICON_ERROR)
             return False
         
         else:
@@ -1380,141 +4645,308 @@ class BatchThread(threading.Thread):
     
     
     
+    @Profiled_Step("autosampler")
     def Listen_For_AS_Signal(self, timeout):
         """Reads the current state of the autosampler output by reading the response from the Arduino.
-        Continually sends an \"R\" to the Arduino until a response is received, an abort is 
-        detected, a serial exception occurs, or timeout minutes have passed. Returns \"Signal Received\" 
-        if the Arduino responds with \"Signal From Autosampler Detected\", \"Abort\" 
-        if an abort was detected, \"Pulled Plug\" if a serial exception occured, or \"Time Out\" 
+        Sends an \"R\" to the Arduino every poll interval until a response is received, an abort is
+        detected, the Arduino is disconnected, or timeout minutes have passed. Returns \"Signal Received\"
+        if the Arduino responds with \"Signal From Autosampler Detected\", \"Abort\"
+        if an abort was detected, \"Pulled Plug\" if the Arduino was disconnected, or \"Time Out\"
         if timeout minutes have passed without receiving a signal."""
+
+        ## Throw away any responses left over from previous commands.
+        self.serial_io.Clear_Events()
+
+
+        ## Listen for a signal from the autosampler until "timeout" minutes have passed.
+        start_time = self.clock.time()
+        while not self.want_abort:
+
+            event = self.serial_io.Request(b"R", ["Signal Detected", "No Signal"], SERIAL_RESPONSE_TIMEOUT)
+
+            if event is not None:
+                if event.kind == "Disconnected":
+                    return "Pulled Plug"
+                elif event.kind == "Signal Detected":
+                    return "Signal Received"
+
+                self.clock.sleep(SERIAL_POLL_INTERVAL)
+
+            if (self.clock.time() - start_time)/60 > timeout:
+                message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for a signal from the autosampler. \nCheck the Arduino and autosampler script and try again."
+                self.Show_Message(message, "Error. Batch Aborted.", MESSAGE_OK | ICON_ERROR)
+                return TIME_OUT
+
+        return "Abort"
+
+
+
+
+
+
+
+    @Profiled_Step("autosampler")
+    def Check_AS_Output_Latch(self, timeout):
+        """Waits for the autosampler to signal through the Arduino, for timeout minutes at most. The wait
+        runs on the orchestrator, so it also ends as soon as an abort is detected, the Arduino is 
+        disconnected, or CETAC shows an error or closes. Returns \"Signal Received\" if the autosampler 
+        signaled, \"Abort\" if an abort was detected or CETAC failed, \"Pulled Plug\" if the Arduino was 
+        disconnected, or \"Time Out\" if timeout minutes have passed without receiving a signal."""
+
+        wait_response = self.orchestrator.Wait(self.orchestrator.Watch_Autosampler(), timeout * 60)
         
-        ## Flush input and output buffers.
-        try:
-            self.ComPort.reset_input_buffer()
-        except serial.serialutil.SerialException:
-            return "Pulled Plug"
+        if wait_response == TIME_OUT:
+            message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for a signal from the autosampler. \nCheck the Arduino and autosampler script and try again."
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
         
+        elif wait_response == "CETAC Error" or wait_response == "CETAC Closed":
+            self.Show_CETAC_Fault(wait_response)
+            return "Abort"
         
-        ## Listen for a signal from the autosampler until "timeout" minutes have passed.
-        start_time = time.time()
-        while not self.want_abort:
+        return wait_response
+
+
+
+
+
+
+
+
+    @Profiled_Step("autosampler")
+    def Read_AS_Output_Latch(self):
+        """Reads the latched state of the autosampler output once without waiting for it to change.
+        Sends an \"S\" to the Arduino and returns \"Latched\" if the Arduino responds with
+        \"Autosampler Signal Latched As True\", \"Not Latched\" if it responds with
+        \"Autosampler Signal Latched As False\", \"Pulled Plug\" if the Arduino was disconnected,
+        or \"No Response\" if no response was received. In push mode the latch is read from 
+        the pulses already received without asking the Arduino."""
+        
+        if self.push_mode:
+            if self.serial_io.disconnected:
+                return "Pulled Plug"
+            elif self.serial_io.pulse_count > self.pulses_handled:
+                return "Latched"
+            else:
+                return "Not Latched"
+
+        self.serial_io.Clear_Events()
+        event = self.serial_io.Request(b"S", ["Latched", "Not Latched"], SERIAL_RESPONSE_TIMEOUT)
+
+        if event is None:
+            return "No Response"
+        elif event.kind == "Disconnected":
+            return "Pulled Plug"
+        else:
+            return event.kind
+
+
+
+
+
+
+
+
+    def Retry_Step(self, step, attempt, message = None, failed = TIME_OUT, aborted = "Abort", gave_up = "Batch aborted."):
+        """Calls attempt, the method of the batch step named step, until it returns something other than 
+        failed, retrying by the step's RetryPolicy. The messages the step shows while it is retried are 
+        held back, so nobody has to click OK on a failure that the next attempt gets past. When the policy 
+        runs out of attempts and escalates to "Ask" the operator is shown message, or the last message the 
+        step held back if message is None, and asked whether to try again. If it escalates to "Abort", or 
+        the batch is unattended, the message is shown as an error instead, followed by gave_up. Returns what attempt last 
+        returned, which is failed if the step gave up, or aborted if an abort was detected while waiting 
+        to retry. If the step fails some other way the messages it held back are shown and that is returned."""
+        
+        policy = self.retry_policies[step]
+        escalation = policy.escalation if not self.batch_data.unattended else "Abort"
+        retry = 0
+        questions = set()
+        while True:
+            self.held_messages = []
             try:
-                
-                self.ComPort.reset_output_buffer()
-                self.ComPort.write(b"R")
-                
-                data = self.ComPort.readline()
-                
-                
-                if len(data) > 0:
-                    data = str(data)
-                    if re.match(r"b'Signal From Autosampler Detected\\r\\n'", data):
-                        return "Signal Received"
-        
+                response = attempt()
+            finally:
+                held_messages, self.held_messages = self.held_messages, None
             
-            except serial.serialutil.SerialException:
-                return "Pulled Plug"
+            if response != failed or self.want_abort:
+                for held_message in held_messages:
+                    self.Show_Message(*held_message)
+                if response != failed:
+                    for question in questions:
+                        self.Question_Resolved(question, "Warning")
+                return response
+            
+            if retry + 1 < policy.max_attempts:
+                self.retry_counts[step] += 1
+                self.Wait_For(lambda: self.want_abort, policy.Delay(retry), "Retry " + step, abortable = True)
+                if self.want_abort:
+                    return aborted
+                retry += 1
+                continue
+            
+            if message is not None:
+                failure = message
+            elif len(held_messages) > 0:
+                failure = held_messages[-1][0]
+            else:
+                failure = step + " failed."
+            
+            if escalation == "Ask":
+                question = failure + "\nClick Yes to try again."
+                answer = self.Show_Message(question, "Warning", MESSAGE_YES_NO | ICON_QUESTION)
+                if answer == ID_YES:
+                    questions.add(question)
+                    retry = 0
+                    continue
+            else:
+                self.Show_Message(failure + "\n" + gave_up, "Error", MESSAGE_OK | ICON_ERROR)
+            
+            return response
+    
+    
+    
+    
+    def Retry_NTA_Step(self, step, method, *args):
+        """Calls method, a step in NTA that returns True if it succeeded, with args, retrying it by the 
+        RetryPolicy of step. Returns True if the step succeeded and False if not."""
+        
+        return self.Retry_Step(step, lambda: method(*args), failed = False, aborted = False)
+    
+    
+    
+    
+    @Profiled_Step("autosampler")
+    def Reset_AS_Output_Latch(self):
+        """Resets the state of the autosampler output latch in the Arduino.
+        Sends a \"C\" to the Arduino until a response is received, an abort is detected, the Arduino
+        is disconnected, or after 10 attempts there is no response from the Arduino.
+        Returns \"Latch Cleared\" if the Arduino responds with \"Autosampler Signal Latch Cleared\",
+        \"Abort\" if an abort was detected, \"Pulled Plug\" if the Arduino was disconnected, or \"Time Out\"
+        if there was no response after 10 attempts. In push mode pulses that were already counted are 
+        still waited for, since they are handled one at a time by Check_AS_Output_Latch."""
+
+        ## Throw away any responses left over from previous commands.
+        self.serial_io.Clear_Events()
+
+
+        for i in range(10):
+            event = self.serial_io.Request(b"C", ["Latch Cleared"], SERIAL_RESPONSE_TIMEOUT)
+
+            if event is not None:
+                if event.kind == "Disconnected":
+                    return "Pulled Plug"
+                else:
+                    return "Latch Cleared"
+
+            if self.want_abort:
+                return "Abort"
+
+        return TIME_OUT
+
+
+
+
+
+
+
+
+    @Profiled_Step("autosampler")
+    def Send_Signal_To_AS(self):
+        """Sends a trigger signal to the autosampler through the Arduino.
+        Sends a \"T\" to the Arduino until a response is received, an abort is detected, the Arduino
+        is disconnected, or after 10 attempts there is no response from the Arduino.
+        Returns \"Signal Sent\" if the Arduino responds with \"Signal Sent to Autosampler\",
+        \"Abort\" if an abort was detected, \"Pulled Plug\" if the Arduino was disconnected, or \"Time Out\"
+        if there was no response after 10 attempts."""
+
+        ## Throw away any responses left over from previous commands.
+        self.serial_io.Clear_Events()
+
+        ## Look for confirmation signal from Arduino.
+        ## The Arduino holds the trigger output for 2 seconds before it responds, so
+        ## wait long enough for that on each attempt to avoid triggering the autosampler twice.
+        for i in range(10):
+            event = self.serial_io.Request(b"T", ["Signal Sent"], SERIAL_TRIGGER_RESPONSE_TIMEOUT)
+
+            if event is not None:
+                if event.kind == "Disconnected":
+                    return "Pulled Plug"
+                else:
+                    return "Signal Sent"
+
+            if self.want_abort:
+                return "Abort"
+
+        return TIME_OUT
+
+
+
+
+
+
+
+    @Profiled_Step("autosampler")
+    def Enable_Push_Mode(self):
+        """Asks the Arduino to push autosampler signals to the host as they happen by sending a \"P\". 
+        Sets push_mode to True if the Arduino responds with \"Push Mode Enabled\". Older firmware does 
+        not respond, in which case push_mode is False and the latch is polled instead."""
+        
+        self.serial_io.Clear_Events()
+        event = self.serial_io.Request(b"P", ["Push Mode Enabled"], SERIAL_RESPONSE_TIMEOUT)
+        self.push_mode = event is not None and event.kind == "Push Mode Enabled"
+        
+        return self.push_mode
     
-            if (time.time() - start_time)/60 > timeout:
-                message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for a signal from the autosampler. \nCheck the Arduino and autosampler script and try again."
-                msg_dlg = wx.MessageDialog(None, message, "Error. Batch Aborted.", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-                return "Time Out"
     
-        return "Abort"
     
     
     
     
     
+    @Profiled_Step("autosampler")
+    def Enable_Binary_Mode(self):
+        """Asks the Arduino to switch to the binary protocol by sending a \"B\". The serial I/O thread 
+        switches too when the Arduino responds with \"Binary Mode Enabled\", after which commands are 
+        sent as frames. Older firmware does not respond and the text protocol is used. Returns True if 
+        the binary protocol is in use."""
+        
+        self.serial_io.Clear_Events()
+        event = self.serial_io.Request(b"B", ["Binary Mode Enabled"], SERIAL_RESPONSE_TIMEOUT)
+        if event is not None and event.kind == "Binary Mode Enabled":
+            return True
+        
+        ## The Arduino may have switched with its response lost, so switch it back. Older firmware ignores the frame.
+        self.serial_io.Write(Encode_Frame(ord("X"), 0))
+        return False
     
     
-    def Check_AS_Output_Latch(self, timeout):
-        """Reads the latched state of the autosampler output by reading the response from the Arduino.
-        Continually sends an \"S\" to the Arduino until a response is received, an abort is 
-        detected, a serial exception occurs, or timeout minutes have passed. Returns \"Signal Received\" 
-        if the Arduino responds with \"Autosampler Signal Latched As True\", \"Abort\" 
-        if an abort was detected, \"Pulled Plug\" if a serial exception occured, or \"Time Out\" 
-        if timeout minutes have passed without receiving a signal."""
-        
-        ## Flush input and output buffers.
-        self.ComPort.reset_input_buffer()
-        
-        
-        ## Listen for a signal from the autosampler until "timeout" minutes have passed.
-        start_time = time.time()
-        while not self.want_abort:
-            try:
-                
-                self.ComPort.reset_output_buffer()
-                self.ComPort.write(b"S")
-                
-                data = self.ComPort.readline()
-                
-                
-                if len(data) > 0:
-                    data = str(data)
-                    if re.match(r"b'Autosampler Signal Latched As True\\r\\n'", data):
-                        return "Signal Received"
-        
-            
-            except serial.serialutil.SerialException:
-                return "Pulled Plug"
     
-            if (time.time() - start_time)/60 > timeout:
-                message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for a signal from the autosampler. \nCheck the Arduino and autosampler script and try again."
-                msg_dlg = wx.MessageDialog(None, message, "Error. Batch Aborted.", wx.OK | wx.ICON_ERROR)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-                return "Time Out"
     
-        return "Abort"
     
     
     
+    def AS_Output_Is_Off(self):
+        """Sends an \"R\" to the Arduino and returns True if it responds with \"No Signal From Autosampler\", 
+        False otherwise."""
+        
+        self.serial_io.Clear_Events()
+        event = self.serial_io.Request(b"R", ["Signal Detected", "No Signal"], SERIAL_RESPONSE_TIMEOUT)
+        
+        return event is not None and event.kind == "No Signal"
     
     
     
     
     
-    def Reset_AS_Output_Latch(self):
-        """Resets the state of the autosampler output latch in the Arduino.
-        Continually sends a \"C\" to the Arduino until a response is received, an abort is 
-        detected, a serial exception occurs, or after 10 attempts there is no response from the Arduino. 
-        Returns \"Latch Cleared\" if the Arduino responds with \"Autosampler Signal Latch Cleared\", 
-        \"Abort\" if an abort was detected, \"Pulled Plug\" if a serial exception occured, or \"Time Out\" 
-        if timeout minutes have passed without receiving a signal."""
-        
-        ## Flush input and output buffers.
-        self.ComPort.reset_input_buffer()
-        
-        
-        try:
-            
-            for i in range(10):
-                self.ComPort.reset_output_buffer()
-                self.ComPort.write(b"C")
-                
-                data = self.ComPort.readline()
-                
-                if len(data) > 0:
-                    data = str(data)
-                    if re.match(r"b'Autosampler Signal Latch Cleared\\r\\n'", data):
-                        return "Latch Cleared"
     
-                
-                time.sleep(1)
-                if i == 9:
-                    return "Time Out"
-                
-                if self.want_abort:
-                    return "Abort"
     
-        
-        except serial.serialutil.SerialException:
-            return "Pulled Plug"
+    def Close_Arduino(self):
+        """Stops the serial I/O thread and closes the serial connection to the Arduino."""
 
+        if self.serial_io is not None:
+            ## Boards that don't restart when the port is opened would otherwise still be in binary mode next time.
+            if self.serial_io.is_alive() and self.serial_io.binary_mode and not self.serial_io.disconnected:
+                self.serial_io.Request(b"X", ["Text Mode Enabled"], SERIAL_RESPONSE_TIMEOUT)
+            self.serial_io.Close()
 
     
     
@@ -1522,48 +4954,25 @@ class BatchThread(threading.Thread):
     
     
     
-    def Send_Signal_To_AS(self):
-        """Sends a trigger signal to the autosampler through the Arduino.
-        Continually sends a \"T\" to the Arduino until a response is received, an abort is 
-        detected, a serial exception occurs, or after 10 attempts there is no response from the Arduino. 
-        Returns \"Signal Sent\" if the Arduino responds with \"Signal Sent to Autosampler\", 
-        \"Abort\" if an abort was detected, \"Pulled Plug\" if a serial exception occured, or \"Time Out\" 
-        if timeout minutes have passed without receiving a signal."""
+    def Write_Profile(self):
+        """Writes the step timings recorded by the profiler next to the sample list file as a Chrome 
+        trace ("<sample list> Trace <time stamp>.json") and a per step summary 
+        ("<sample list> Timing <time stamp>.csv"). The batch is already over when this runs, so 
+        failing to write the files is not reported as an error."""
         
-        ## Flush input and output buffers.
-        self.ComPort.reset_input_buffer()
+        file_stem = os.path.splitext(self.batch_data.sample_list_filepath)[0]
+        time_stamp = time.strftime("%Y-%m-%d %H-%M-%S")
         
-        ## Look for confirmation signal from Arduino.
-        ## Try for 10 seconds to get signal from Arduino before assuming an error.
         try:
-            
-            for i in range(10):
-                self.ComPort.reset_output_buffer()
-                self.ComPort.write(b"T")
-                
-                data = self.ComPort.readline()
-                
-                if len(data) > 0:
-                    data = str(data)
-                    if re.match(r"b'Signal Sent To Autosampler\\r\\n'", data):
-                        return "Signal Sent"
-    
-                
-                time.sleep(1)
-                if i == 9:
-                    return "Time Out"
-                
-                if self.want_abort:
-                    return "Abort"
-                
-        
-        except serial.serialutil.SerialException:
-            return "Pulled Plug"
-    
-    
-    
-    
-    
+            self.profiler.Write_Chrome_Trace(file_stem + " Trace " + time_stamp + ".json")
+            self.profiler.Write_Summary_CSV(file_stem + " Timing " + time_stamp + ".csv")
+        except OSError:
+            pass
+
+
+
+
+
 ## Commenting out for now. This is not used anywhere and needs to be slightly modified if it ever needs to be used.
 ## 11-08-2018
 #    def Listen_For_Generic_NTA_Signal(self, timeout = 10):
@@ -1596,24 +5005,30 @@ class BatchThread(threading.Thread):
         
         
         
-    def Listen_For_End_Of_Script_NTA_Signal(self, timeout = 10):
+    @Profiled_Step()
+    def Listen_For_End_Of_Script_NTA_Signal(self, timeout = 10, watch_instruments = True):
         """Looks for a dialog created by the NTA 3.3 program with the title \"NTA\" and 
         clicks the OK button on it if found. The function keeps looking until timeout minutes 
-        have passed or an abort was detected. Returns \"Signal Received\" if a message was found,
-        \"Aborted" if an abort was detected, or \"Time Out\" if timeout minutes have passed."""
+        have passed or an abort was detected. The wait runs on the orchestrator, and if watch_instruments 
+        is True it also ends as soon as the Arduino is disconnected or CETAC shows an error or closes.
+        Returns \"Signal Received\" if a message was found, \"Aborted\" if an abort was detected or CETAC 
+        failed, \"Pulled Plug\" if the Arduino was disconnected, or \"Time Out\" if timeout minutes have passed."""
         
         
-        window_check_result = self.NTA_Window_Check("\'NTA\'", True, timeout)
+        wait_response = self.orchestrator.Wait(self.orchestrator.Watch_NTA_Window("\'NTA\'"), timeout * 60, watch_instruments)
         
-        if window_check_result == "Abort":
+        if wait_response == "Abort":
             return "Aborted"
-        elif window_check_result == "Time Out":
+        elif wait_response == TIME_OUT:
             message = "The max wait time of " + str(timeout) + " minutes was reached while waiting for a signal from the NTA 3.3 program. \nCheck the program and try again."
-            msg_dlg = wx.MessageDialog(None, message, "Error. Batch Aborted.", wx.OK | wx.ICON_ERROR)
-            msg_dlg.ShowModal()
-            msg_dlg.Destroy()
-            return "Time Out"
-        elif window_check_result == "Success":
+            self.Show_Message(message, "Error", MESSAGE_OK | ICON_ERROR)
+            return TIME_OUT
+        elif wait_response == "CETAC Error" or wait_response == "CETAC Closed":
+            self.Show_CETAC_Fault(wait_response)
+            return "Aborted"
+        elif wait_response == "Pulled Plug":
+            return "Pulled Plug"
+        elif wait_response == "Success":
             ## Click the ok button on the end of script message.
             self.NTA_app["NTA"].OK.click()
             return "Signal Received"
@@ -1624,15 +5039,20 @@ class BatchThread(threading.Thread):
 
 
 
+    @Profiled_Step()
+    @UI_Automation_Step
     def NTA_Abort_Script(self):
         """Clicks the Abort button on the script panel in the NTA 3.3 program."""
         
+        ## After an abort the script has to be loaded again.
+        self.loaded_script = None
+        
         if not self.NTA_Check_Existence():
             return
         
         nta = self.NTA_app["NTA 3.3"]
         ## Wait for the window to be ready.
-        time.sleep(2)
+        self.Wait_For(lambda: nta.is_enabled(), NTA_READY_TIMEOUT, "NTA Window Ready")
         ## Look to see if the script panel is pulled out or not.
         try:
             if any([re.match(r"PanelClass", str(window.class_name())) for window in self.NTA_app.windows()]):
@@ -1649,10 +5069,12 @@ class BatchThread(threading.Thread):
 
 
 
+    @Profiled_Step()
+    @UI_Automation_Step
     def CETAC_Abort_Script(self):
         """Clicks the Abort Script button in the CETAC Workstation program."""
         
-        if not self.CETAC_Check_Existence():
+        if self.CETAC_app is None or not self.CETAC_Check_Existence():
             return
         
         self.CETAC_app.SetActive(waitTime=1)
@@ -1664,460 +5086,467 @@ class BatchThread(threading.Thread):
 
 
 
+    def Wait_For(self, condition, timeout, description, poll_interval = WAIT_POLL_INTERVAL, abortable = False):
+        """Checks condition every poll_interval seconds until it returns True or timeout seconds 
+        have passed. If abortable is True the wait also ends when an abort is detected. Short waits 
+        are not abortable so that an abort doesn't cut a UI step off halfway through. Exceptions 
+        raised by condition count as the condition not being met yet, since NTA controls can't be 
+        found while the window is busy. Returns True if the condition was met and False otherwise. 
+        How long the wait took is added to wait_times as (description, seconds, condition met)."""
+        
+        with self.profiler.Span("Wait For " + description, self.current_sample, "wait"):
+            condition_met = self.Wait_For_Condition(condition, timeout, description, poll_interval, abortable)
+        
+        return condition_met
+    
+    
+    
+    
+    def Wait_For_Condition(self, condition, timeout, description, poll_interval, abortable):
+        """Does the waiting for Wait_For and returns whether the condition was met."""
+        
+        start_time = self.clock.time()
+        while True:
+            try:
+                condition_met = bool(condition())
+            except Exception:
+                condition_met = False
+            
+            if condition_met or (abortable and self.want_abort) or self.clock.time() - start_time > timeout:
+                break
+            
+            self.clock.sleep(poll_interval)
+        
+        self.wait_times.append((description, self.clock.time() - start_time, condition_met))
+        return condition_met
+    
+    
+    
+    
+    
+    
+    
+    @Profiled_Step("wait")
     def NTA_Window_Check(self, regex, find_window, timeout):
         """Searches for an NTA window that matches the regex for timeout minutes if
         find_window is True. If find_window is False then waits for up to timeout minutes
         for the window to disappear.
-        Returns Time Out if timedout, Abort if want_abort was set during the search time,
-        or Success if a window was found or the window closed depending on find_window."""
+        Returns TIME_OUT if timedout, "Abort" if want_abort was set during the search time,
+        or "Success" if a window was found or the window closed depending on find_window.
+        
+        Checks are made quickly right after a UI action and then back off, up to once every 
+        WINDOW_CHECK_LONG_MAX_INTERVAL seconds for long waits such as the end of script and export 
+        waits. The regex, find_window, number of checks, seconds waited, and result of each call 
+        are added to window_check_stats."""
+        
+        if regex not in self.window_matchers:
+            self.window_matchers[regex] = re.compile(regex).search
+        matcher = self.window_matchers[regex]
+        
+        if timeout > 1:
+            max_interval = WINDOW_CHECK_LONG_MAX_INTERVAL
+        else:
+            max_interval = WINDOW_CHECK_SHORT_MAX_INTERVAL
+        interval = WINDOW_CHECK_FIRST_INTERVAL
         
-        start_time = time.time()
+        polls = 0
+        result = "Abort"
+        start_time = self.clock.time()
         while not self.want_abort:
+            polls += 1
             try:
-                window_found = any([re.search(regex, str(window)) for window in self.NTA_app.windows()])
+                window_found = any(matcher(str(window)) for window in self.NTA_app.windows())
                 
             except Exception:
-                time.sleep(1)
+                window_found = None
                 
-            else:
-                if find_window and not window_found:
-                    time.sleep(1)
-                elif not find_window and window_found:
-                    time.sleep(1)
-                else:
-                    return "Success"
+            if window_found is not None and window_found == find_window:
+                result = "Success"
+                break
                 
-            if (time.time() - start_time)/60 > timeout:
-                return "Time Out"
+            if (self.clock.time() - start_time)/60 > timeout:
+                result = TIME_OUT
+                break
+            
+            self.clock.sleep(interval)
+            interval = min(interval * WINDOW_CHECK_BACKOFF, max_interval)
+        
+        
+        self.window_check_stats.append((regex, find_window, polls, self.clock.time() - start_time, result))
+        return result
+
 
 
-        return "Abort"
 
 
 
 
 
 
+## How many script folders are checked at the same time when validating a sample list.
+VALIDATION_WORKERS = 16
 
 
 
-class Automation_GUI(wx.Frame):
+
+class PathExistenceCache(object):
+    """Checks whether files exist by listing the folders they are in instead of checking each file.
     
+    Listings are kept with the folder's modification time, which changes whenever a file is added to
+    or removed from the folder, so reloading a sample list only needs one stat per folder to know the
+    listing is still good. This matters when the scripts are on a network share. Names are compared
+    with os.path.normcase so the check is case insensitive on Windows like os.path.exists."""
     
-    def __init__(self, parent, title, *args, **kwargs):
-        
-        super(Automation_GUI, self).__init__(parent, title=title, size = (725, 375), *args, **kwargs) 
-        
-        ## Set up event handlers for serial and batch threads.
-        self.Connect(-1, -1, EVT_PULLED_PLUG, self.pulled_plug)
-        self.Connect(-1, -1, EVT_THREAD_ABORTED, self.thread_aborted)
-        
-        self.InitUI()
-        self.Centre()
-        self.Show()
-
-        
-    def InitUI(self):
-        
-        ## Set some default settings.
-        self.batch_thread = None
-        
-        
-        ##############
-        ## Menu Bar
-        ##############
-        menubar = wx.MenuBar()
-        fileMenu = wx.Menu()
-        
-        ## Add items to file menu.
-        about_item = fileMenu.Append(100, '&About   \tCtrl+A', 'Information about the program')
-        self.Bind(wx.EVT_MENU, self.OnAbout, about_item)
-                
-        fileMenu.AppendSeparator()
-        
-        quit_item = wx.MenuItem(fileMenu, 101, 'Quit', 'Quit Application')
-        fileMenu.Append(quit_item)
-        self.Bind(wx.EVT_MENU, self.OnQuit, quit_item)
-        
-        ## Add file menu to the menu bar.
-        menubar.Append(fileMenu, "&File")
-        
-        menubar.MacSetCommonMenuBar(menubar)
-        ## Put menu bar in frame.
-        self.SetMenuBar(menubar)
-        
-        
-        ## Create main panel.
-        panel = wx.Panel(self)
-        
-        ## Create common sizerflags object.
-        sizer_flags = wx.SizerFlags(1)
-        sizer_flags.Align(wx.ALIGN_LEFT).Border(wx.LEFT | wx.RIGHT | wx.TOP, 10)
-        
-        main_vbox = wx.BoxSizer(wx.VERTICAL)
-        
-        ## Add a status bar to the bottom for reporting messages.
-        #self.statusbar = self.CreateStatusBar()
-        
-        ## TODO: Possible additional feature to add program modes to acquire only, process only, or acquire then process (as a batch).
-        ## Add radio buttons to select the program mode, acquire or process.
-        #mode_st = wx.StaticText(panel, label="Program Mode:")
-        
-        #########################
-        ## Sample List File
-        #########################
-        ## Add label, button, and feedback for sample list file.
-        sample_list_st = wx.StaticText(panel, label="Sample List File (.csv or Excel):")
-        main_vbox.Add(sample_list_st, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT | wx.TOP, border = 10)
-        
-        sample_hbox = wx.BoxSizer(wx.HORIZONTAL)
-        
-        self.sample_list_tc = wx.TextCtrl(panel, value = "", style = wx.TE_READONLY)
-        sample_hbox.Add(self.sample_list_tc, flag = wx.ALIGN_LEFT | wx.EXPAND | wx.LEFT | wx.RIGHT, border = 10, proportion = 1)
-        
-        self.sample_list_button = wx.Button(panel, label = "Open")
-        self.sample_list_button.Bind(wx.EVT_BUTTON, self.On_Sample_List_Open)
-        sample_hbox.Add(self.sample_list_button, flag = wx.ALIGN_LEFT)
-        
-        main_vbox.Add(sample_hbox, flag = wx.ALIGN_LEFT | wx.BOTTOM | wx.EXPAND, border = 10)
-        
-        
-        
-        #########################
-        ## Individual Directory Checkbox
-        #########################
-        self.individual_directories_checkbox = wx.CheckBox(panel, label = "Create Individual Directories For Each Sample")
-        self.individual_directories_checkbox.SetValue(True)
-        self.samples_have_individual_directories = True
-        
-        self.individual_directories_checkbox.Bind(wx.EVT_CHECKBOX, self.OnCheck)
-        
-        main_vbox.Add(self.individual_directories_checkbox, flag = wx.ALIGN_LEFT | wx.LEFT | wx.BOTTOM, border = 10)
-        
-        
-        
-        ##########################
-        ## Number of Samples
-        ##########################
-        ## Add a label to show the number of samples.
-        num_samples_hbox = wx.BoxSizer(wx.HORIZONTAL)
-        
-        num_of_samples_label_st = wx.StaticText(panel, label="Number of Samples:")
-        num_samples_hbox.Add(num_of_samples_label_st, flag = wx.ALIGN_LEFT | wx.ALL, border = 10)
-        
-        self.num_of_samples_st = wx.StaticText(panel, label="")
-        num_samples_hbox.Add(self.num_of_samples_st, flag = wx.ALIGN_LEFT | wx.ALL, border = 10)
-        
-        main_vbox.Add(num_samples_hbox, flag = wx.ALIGN_LEFT)
-        
-        
-        
-        ##########################
-        ## Sample Progress
-        ##########################
-        ## Add text box to display what sample is in progress.
-        run_progress_st = wx.StaticText(panel, label="Run Progress:")
-        main_vbox.Add(run_progress_st, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT | wx.TOP, border = 10)
-        
-        self.list_ctrl_col_names = ["Sample Name", "Save Directory", "Acquire Script", "Process Script",
-                                    "Acquisition Progress", "Processing Progress"]
-        
-        self.sample_list_ctrl = wx.ListCtrl(panel, style=wx.LC_REPORT)
-        
-        
-        for col_name in self.list_ctrl_col_names:    
-            self.sample_list_ctrl.InsertColumn(self.list_ctrl_col_names.index(col_name), col_name, width = (len(col_name)*5 + 35))
-            
-        main_vbox.Add(self.sample_list_ctrl, flag = wx.ALIGN_LEFT | wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border = 10)
-        
+    def __init__(self):
+        ## folder -> (modification time, set of names in the folder)
+        self.listings = {}
+        self.lock = threading.Lock()
+    
+    
+    def Folder_Names(self, folder):
+        """Returns the set of normcased names in folder, or None if it can't be read."""
         
-        ##########################
-        ## Start Batch Button
-        ##########################
-        ## Add button to toggle starting and stopping run.
-        self.toggle_button = wx.ToggleButton(panel, label = "Start Batch")
-        self.toggle_button.Disable()
-        self.toggle_button.Bind(wx.EVT_TOGGLEBUTTON, self.On_Toggle)
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return None
         
+        with self.lock:
+            listing = self.listings.get(folder)
+        if listing is not None and listing[0] == mtime:
+            return listing[1]
         
-        main_vbox.Add(self.toggle_button, flag = wx.ALIGN_CENTER | wx.ALL, border = 10)
+        try:
+            names = frozenset(os.path.normcase(name) for name in os.listdir(folder))
+        except OSError:
+            return None
         
+        with self.lock:
+            self.listings[folder] = (mtime, names)
+        return names
+    
+    
+    def Check_Paths(self, paths, workers = VALIDATION_WORKERS, progress = None):
+        """Returns a dictionary of path -> True if the path exists, False otherwise. Paths are 
+        grouped by folder and the folders are checked in a thread pool of up to workers threads. 
+        progress, if given, is called with (folders checked, total folders) as folders finish."""
+        
+        folders = collections.defaultdict(list)
+        for path in set(paths):
+            folder, name = os.path.split(os.path.normpath(path))
+            folders[folder or os.curdir].append((path, os.path.normcase(name)))
+        
+        def check_folder(folder):
+            names = self.Folder_Names(folder)
+            return {path:names is not None and name in names for path, name in folders[folder]}
+        
+        path_exists = {}
+        if len(folders) == 0:
+            return path_exists
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers = min(workers, len(folders))) as executor:
+            futures = [executor.submit(check_folder, folder) for folder in folders]
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                path_exists.update(future.result())
+                if progress is not None:
+                    progress(done, len(folders))
+        
+        return path_exists
 
-        panel.SetSizer(main_vbox)
-        panel.Fit()
-        self.Fit()
-        
 
 
 
+## The program modes. Process Only batches process experiments acquired earlier without using the autosampler.
+PROGRAM_MODES = ["Acquire Then Process", "Acquire Only", "Process Only"]
 
-    def OnQuit(self, e):
-        self.Close()
 
 
 
-    def OnAbout(self, event):
-        message = "Author: Travis Thompson \n\n" + \
-        "Creation Date: November 2018 \n" + \
-        "Version Number: " + __version__
-       
-        dlg = GMD.GenericMessageDialog(None, message, "About", wx.OK | wx.ICON_INFORMATION)
-        dlg.ShowModal()
-        dlg.Destroy()
+def Experiments_To_Sample_List(folder, process_script):
+    """Makes a sample list for processing every .nano experiment in folder and its subfolders with 
+    process_script. Each sample's Save Directory is the folder its experiment is in, so the batch has 
+    to be run without individual directories. Experiments saved more than once with time stamps are 
+    one sample, and the newest one is processed."""
+    
+    rows = collections.OrderedDict()
+    for directory, subdirectories, filenames in os.walk(folder):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            match = NANO_FILE_REGEX.match(filename)
+            if match:
+                rows[(directory, match.group("sample_name"))] = None
+    
+    import pandas
+    return pandas.DataFrame({"Sample Name":[sample_name for directory, sample_name in rows],
+                             "Save Directory":[directory for directory, sample_name in rows],
+                             "Process Script":[process_script]*len(rows)},
+                            columns = ["Sample Name", "Save Directory", "Process Script"])
 
 
 
 
+## The columns a sample list needs. Process Only sample lists don't need the Acquire Script.
+SAMPLE_LIST_COLUMNS = ["Sample Name", "Save Directory", "Acquire Script", "Process Script"]
 
-    def On_Sample_List_Open(self, event):
-        """Creates the open file dialog box and gets a file from the user. The file 
-        is then checked to make sure it is formatted correctly. The file is checked 
-        to make sure it has the correct columns, it is the correct file type, and 
-        that it has values in every column. Also makes sure that all file paths in 
-        the file exist. If all checks pass then the GUI is updated with the 
-        appropriate information."""
-        
-        message = "Select Sample List File (.csv or Excel)"
-        dlg = wx.FileDialog(None, message = message, style=wx.FD_OPEN | wx.FD_CHANGE_DIR)
+
+
+
+def Required_Columns(program_mode):
+    """Returns the columns a sample list needs to run in program_mode."""
     
-        if dlg.ShowModal() == wx.ID_OK:
-            filepath = dlg.GetPath()
-            dlg.Destroy()
-            
-            if not re.match(r".*\.xlsx|.*\.xlsm|.*\.xls|.*\.csv", filepath):
-                message = "Incorrect file type chosen. Please select an Excel or .csv file."
-                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-                return
-                
-            else:
-                if re.match(r".*\.csv", filepath):
-                    try:
-                        sample_df = pandas.read_csv(filepath)
-                    except Exception:
-                        message = "The selected Sample List File could not be opened. This could be due to the file being corrupted or open in another program."
-                        msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                        msg_dlg.ShowModal()
-                        msg_dlg.Destroy()
-                        return
-                else:
-                    try:
-                        sample_df = pandas.read_excel(filepath)
-                    except Exception:
-                        message = "The selected Sample List File could not be opened. This could be due to the file being corrupted or open in another program."
-                        msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                        msg_dlg.ShowModal()
-                        msg_dlg.Destroy()
-                        return
-                
-                    
-                required_columns = set(self.list_ctrl_col_names) - set(["Acquisition Progress", "Processing Progress"])
-                
-                if not set(required_columns).issubset(sample_df.columns) :
-                    missing_columns = set(required_columns) - set(sample_df.columns)
-                    message = "The selected file is missing columns for: \n\n" + "\n".join(missing_columns)
-                    msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                    msg_dlg.ShowModal()
-                    msg_dlg.Destroy()
-                    
-                elif sample_df.isnull().values.any():
-                    message = "The selected file has missing values."
-                    msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                    msg_dlg.ShowModal()
-                    msg_dlg.Destroy()
-                
-                
-                else:
-                
-                    ## Make sure sample directories are unique.
-                    sample_paths = [os.path.join(save_directory,sample_name) for (sample_name, save_directory) in sample_df.loc[:, ["Sample Name", "Save Directory"]].values]
-                    
-                
-                    if len(sample_paths) > len(set(sample_paths)):
-                        message = "The selected file has duplicate sample names saved to the same directory."
-                        msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                        msg_dlg.ShowModal()
-                        msg_dlg.Destroy()
-                        
-                    else:
-                        
-                        
-                        ## Make sure all script files actually exists.
-                        file_paths_OK = True
-                        
-                        acqs_paths = {str(sample):os.path.exists(str(path)) for (sample, path) in sample_df.loc[:, ["Sample Name", "Acquire Script"]].values}
-                        
-                        if not all(acqs_paths.values()):
-                            message = "The Acquire Script file path given for sample(s): \n\n" + "\n".join([sample for sample, value in acqs_paths.items() if not value]) + "\n\nare not valid file path(s). Check that the path(s) exist and try again."
-                            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-                            msg_dlg.ShowModal()
-                            msg_dlg.Destroy()
-                            file_paths_OK = False
-                        
-        
-                        ps_paths = {str(sample):os.path.exists(str(path)) for (sample, path) in sample_df.loc[:, ["Sample Name", "Process Script"]].values}
-        
-        
-                        if not all(ps_paths.values()):
-                            message = "The Process Script file path given for sample(s): \n\n" + "\n".join([sample for sample, value in ps_paths.items() if not value]) + "\n\nare not valid file path(s). Check that the path(s) exist and try again."
-                            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-                            msg_dlg.ShowModal()
-                            msg_dlg.Destroy()
-                            file_paths_OK = False
-        
-                        
-                        
-                        
-                        
-                        
-                        if file_paths_OK:
-                                                
-                            self.sample_list_tc.SetValue(filepath)
-                            
-                            self.num_of_samples_st.SetLabel(str(len(sample_df)))
-                            
-                            self.sample_list_ctrl.DeleteAllItems()
-                            
-                            for i in range(len(sample_df)):
-                                self.sample_list_ctrl.InsertItem(i, str(sample_df[self.list_ctrl_col_names[0]][i]))
-                                self.sample_list_ctrl.SetItem(i, self.list_ctrl_col_names.index("Acquisition Progress"), "Not Started")
-                                self.sample_list_ctrl.SetItem(i, self.list_ctrl_col_names.index("Processing Progress"), "Not Started")
-                                
-                                for j in range(1,len(required_columns)):
-                                    self.sample_list_ctrl.SetItem(i, j, str(sample_df[self.list_ctrl_col_names[j]][i]))
-                                
-                            
-                            self.sample_df = sample_df
-                            self.toggle_button.Enable()
-    
-            
-        
-    
-    def OnCheck(self, event):
-        """Change the state of the internal variable to match the state of the check box."""
-        
-#        """If the user clicks the check after opening the Sample List File then the directories 
-#        won't get made, so see if the sample list exists and create the directories if the box is checked."""
-        
-        check_box = event.GetEventObject()
-        self.samples_have_individual_directories = check_box.GetValue()
-        
-#        if check_box.GetValue() and self.toggle_button.Enabled():
-#            
-#            sample_df = self.sample_df
-#            
-#            for i in range(len(sample_df)):
-#                directory = sample_df.loc[i, "Save Directory"]
-#                sample_name = sample_df.loc[i, "Sample Name"]
-#                directory = os.path.join(directory, sample_name)
-#                    
-#                try:
-#                    os.makedirs(directory)
-#                except OSError as e:
-#                    if e.errno != errno.EEXIST:
-#                        message = "An error occurred while creating the directory for sample " + sample_name + "."
-#                        message = message + "\n\n" + str(e)
-#                        msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-#                        msg_dlg.ShowModal()
-#                        msg_dlg.Destroy()
-#                        return
-            
+    required_columns = set(SAMPLE_LIST_COLUMNS)
+    if program_mode == "Process Only":
+        required_columns.discard("Acquire Script")
+    
+    return required_columns
+
+
+
+
+def Read_Sample_List(filepath, process_script = None, progress = lambda message: None):
+    """Reads the sample list in filepath, a .csv or Excel file. If filepath is a folder then the sample 
+    list is made from the experiments in it, to be processed with process_script. Returns the sample 
+    list, or None if it couldn't be read, and the list of problems as (message, caption, style) for 
+    message dialogs. progress is called with a message saying what is being done."""
+    
+    import pandas
+    if os.path.isdir(filepath):
+        progress("Looking for experiments in " + filepath)
+        sample_df = Experiments_To_Sample_List(filepath, process_script)
+        if len(sample_df) == 0:
+            message = "No .nano experiment files were found in " + filepath + "."
+            return None, [(message, "Warning", MESSAGE_OK | ICON_EXCLAMATION)]
+        return sample_df, []
     
+    progress("Reading " + os.path.basename(filepath))
+    try:
+        if re.match(r".*\.csv", filepath):
+            sample_df = pandas.read_csv(filepath)
+        else:
+            sample_df = pandas.read_excel(filepath)
     
+    except Exception:
+        message = "The selected Sample List File could not be opened. This could be due to the file being corrupted or open in another program."
+        return None, [(message, "Warning", MESSAGE_OK | ICON_EXCLAMATION)]
     
-        
+    return sample_df, []
+
+
+
+
+def Validate_Sample_List(sample_df, required_columns, path_cache, progress = lambda message: None):
+    """Checks that sample_df has the required columns, has no missing values in them, has no duplicate 
+    samples saved to the same directory, and that all of its required script files exist. Returns 
+    the list of problems found as (message, caption, style) for message dialogs."""
     
+    import pandas
+    if not set(required_columns).issubset(sample_df.columns):
+        missing_columns = set(required_columns) - set(sample_df.columns)
+        message = "The selected file is missing columns for: \n\n" + "\n".join(missing_columns)
+        return [(message, "Warning", MESSAGE_OK | ICON_EXCLAMATION)]
     
+    if sample_df.loc[:, list(required_columns)].isnull().values.any():
+        return [("The selected file has missing values.", "Warning", MESSAGE_OK | ICON_EXCLAMATION)]
     
-    def On_Toggle(self, event):
-        """After clicking the "Start/Abort Batch button this function either 
-        starts or aborts the batch appropriately."""
-        
-        button = event.GetEventObject()
-        
-        
-        if button.GetValue() == True:
-            ## Disable the button to open a different file so the user can't change the sample list mid operation.
-            self.sample_list_button.Disable()
-            self.individual_directories_checkbox.Disable()
-            
-            if not self.batch_thread:
-                self.batch_thread = BatchThread(self)
-                button.SetLabel("Abort Batch")
-            
-            else:
-                message = "Batch thread already started, something seriously wrong happened."
-                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-            
-        
-        else:
-            
-            if self.batch_thread:
-                self.batch_thread.abort()
-                ## Disable button until thread has been aborted.
-                button.Disable()
-            
-            else:
-                message = "Batch thread already aborted, something seriously wrong happened."
-                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
-                msg_dlg.ShowModal()
-                msg_dlg.Destroy()
-            
-            
+    ## Make sure sample directories are unique.
+    sample_paths = sample_df.loc[:, "Save Directory"].astype(str).str.rstrip("\\/") + os.sep + sample_df.loc[:, "Sample Name"].astype(str)
+    if sample_paths.duplicated().any():
+        return [("The selected file has duplicate sample names saved to the same directory.", "Warning", MESSAGE_OK | ICON_EXCLAMATION)]
+    
+    
+    ## Make sure all script files actually exist. Each script is only checked once however many samples use it.
+    script_paths = [(column, sample_df.loc[:, column].astype(str)) for column in ["Acquire Script", "Process Script"] if column in required_columns]
+    unique_paths = pandas.unique(pandas.concat([paths for column, paths in script_paths]))
+    
+    progress("Checking " + str(len(unique_paths)) + " script file(s)")
+    path_exists = path_cache.Check_Paths(unique_paths, progress = lambda done, total: 
+                                         progress("Checking script folders: " + str(done) + " of " + str(total)))
     
+    problems = []
+    for column, paths in script_paths:
+        bad_samples = sample_df.loc[~paths.map(path_exists).astype(bool), "Sample Name"].astype(str).drop_duplicates()
+        if len(bad_samples) > 0:
+            message = "The " + column + " file path given for sample(s): \n\n" + "\n".join(bad_samples) + "\n\nare not valid file path(s). Check that the path(s) exist and try again."
+            problems.append((message, "Error", MESSAGE_OK | ICON_ERROR))
+    
+    return problems
 
 
 
 
 
 
-    def pulled_plug(self, event):
-        """Handler for PulledPlug events. Creates a message to indicate that the 
-        Arduino was disconnected and re-enables all buttons."""
-        
-        message = "Arduino Disconnected. Batch Aborted."
-        msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
-        msg_dlg.ShowModal()
-        msg_dlg.Destroy()
-        
-        self.toggle_button.SetValue(False)
-        self.toggle_button.SetLabel("Start Batch")
-        
-        self.batch_thread = None
-        
-        self.sample_list_button.Enable()
-        self.individual_directories_checkbox.Enable()
-   
 
 
-    def thread_aborted(self, event):
-        """Handler for aborted thread. Re-enables all buttons."""
-        
-        self.toggle_button.SetValue(False)
-        self.toggle_button.SetLabel("Start Batch")
-        self.toggle_button.Enable()
-        
-        self.batch_thread = None
 
-        self.sample_list_button.Enable()
-        self.individual_directories_checkbox.Enable()
+## How often a headless batch rewrites its status file, in seconds.
+STATUS_FILE_INTERVAL = 5
+
+
+
+
+class ConsoleBatchUI(object):
+    """UI of a headless batch. Messages are printed to stream instead of shown, and recorded. There is 
+    no one to answer questions, so each question is answered Yes, which retries, up to max_retries 
+    times and No after that. The count starts again once the step it asks about succeeds."""
+    
+    def __init__(self, max_retries = 3, stream = None):
+        self.max_retries = max_retries
+        self.stream = stream if stream is not None else sys.stderr
+        ## (caption, message) of a question -> how many times it was answered Yes since its step last succeeded.
+        self.retries = collections.Counter()
+        self.messages = []
+        self.completed = False
+        self.pulled_plug = False
+    
+    
+    def Show_Message(self, message, caption, style):
+        self.messages.append((time.strftime("%Y-%m-%d %H:%M:%S"), caption, message))
+        if caption == "Batch Complete":
+            self.completed = True
+        
+        answer = ID_OK
+        if style & MESSAGE_YES_NO:
+            self.retries[(caption, message)] += 1
+            answer = ID_YES if self.retries[(caption, message)] <= self.max_retries else ID_NO
+            message = message + " [Answered " + ("Yes" if answer == ID_YES else "No") + "]"
+        
+        print(caption + ": " + message.replace("\n", " "), file = self.stream)
+        self.stream.flush()
+        return answer
+    
+    
+    def Question_Resolved(self, message, caption):
+        self.retries.pop((caption, message), None)
+    
+    
+    def Post_Event(self, event):
+        if event.GetEventType() == EVT_PULLED_PLUG:
+            self.pulled_plug = True
+    
+    
+    def Outcome(self, final_state = None, aborted_by_user = False):
+        """Returns how the batch ended given the state its state machine ended in: "Complete", 
+        "Arduino Disconnected", "Aborted By User" if it was aborted with Ctrl+C, "Aborted" if a step 
+        failed part way through the batch, or "Stopped" if a check before it started failed."""
+        
+        if self.completed:
+            return "Complete"
+        elif self.pulled_plug:
+            return "Arduino Disconnected"
+        elif aborted_by_user:
+            return "Aborted By User"
+        elif final_state == "Aborted":
+            return "Aborted"
+        else:
+            return "Stopped"
 
 
 
 
+def Write_Status_File(filepath, batch_data, ui, state, failed_state = None):
+    """Writes the state of a headless batch, the progress of each of its samples, and the messages 
+    it has shown to filepath as JSON. failed_state is the state of the batch that failed, if one did.
+    The file is replaced in one step so a reader never sees half of it."""
+    
+    sample_statuses = batch_data.sample_statuses
+    sample_statuses.Apply_Updates()
+    sample_names = batch_data.sample_df.loc[:, "Sample Name"].astype(str).tolist()
+    status = {"sample_list":batch_data.sample_list_filepath,
+              "program_mode":batch_data.program_mode,
+              "state":state,
+              "failed_state":failed_state,
+              "updated":time.strftime("%Y-%m-%d %H:%M:%S"),
+              "samples":[dict([("Sample Name", sample_name)] + [(column, sample_statuses.Status(row, column)) for column in SampleStatusList.COLUMNS]) 
+                         for row, sample_name in enumerate(sample_names)],
+              "messages":[{"time":message_time, "caption":caption, "message":message} for message_time, caption, message in ui.messages]}
+    
+    temporary_filepath = filepath + ".tmp"
+    with open(temporary_filepath, "w") as status_file:
+        json.dump(status, status_file, indent = 1)
+    os.replace(temporary_filepath, filepath)
 
 
-        
-        
-def main():
 
-    ex = wx.App(False)
-    Automation_GUI(None, title = "NanoSight Automation")
-    ex.MainLoop()    
+
+def Run_Headless(args):
+    """Runs the batch described by the command line arguments args without the GUI and returns the 
+    exit code, 0 if the batch completed and 1 if it didn't. Ctrl+C aborts the batch."""
+    
+    if args.program_mode == "Process Only" and os.path.isdir(args.sample_list) and args.process_script is None:
+        print("A --process-script is needed to process a folder of experiments.", file = sys.stderr)
+        return 2
+    
+    sample_df, problems = Read_Sample_List(args.sample_list, args.process_script, print)
+    if sample_df is not None:
+        problems = Validate_Sample_List(sample_df, Required_Columns(args.program_mode), PathExistenceCache(), print)
+    if len(problems) > 0:
+        for message, caption, style in problems:
+            print(caption + ": " + message.replace("\n", " "), file = sys.stderr)
+        return 2
+    
+    ## The Save Directory of each experiment found in a folder is the folder it is in.
+    individual_directories = args.individual_directories and not os.path.isdir(args.sample_list)
+    batch_data = StationBatchData(sample_df, args.sample_list, args.program_mode, args.pipelined_processing, individual_directories)
+    batch_data.resume_batch = args.resume
+    ## The batch isn't marked unattended, since the console answers its questions by --retries and never waits on a notice.
+    ui = ConsoleBatchUI(args.retries)
+    
+    print("Running " + str(len(sample_df)) + " samples from " + args.sample_list + " in " + args.program_mode + " mode.")
+    batch_thread = BatchThread(batch_data, WindowsDrivers(batch_data, ui))
+    aborted_by_user = False
+    while not batch_thread.finished.is_set():
+        try:
+            if args.status_file is not None:
+                Write_Status_File(args.status_file, batch_data, ui, "Running")
+            batch_thread.finished.wait(STATUS_FILE_INTERVAL)
+        except KeyboardInterrupt:
+            print("Aborting the batch.", file = sys.stderr)
+            aborted_by_user = True
+            batch_thread.abort()
+    batch_thread.join()
+    
+    outcome = ui.Outcome(batch_thread.state_machine.state, aborted_by_user)
+    failed_state = batch_thread.state_machine.failed_state if outcome != "Complete" else None
+    if args.status_file is not None:
+        Write_Status_File(args.status_file, batch_data, ui, outcome, failed_state)
+    print("Batch " + outcome + "." + (" It failed in " + failed_state + "." if failed_state is not None and not aborted_by_user else ""))
+    
+    return 0 if outcome == "Complete" else 1
+
+
+
+
+def main(argv = None):
+    """Opens the GUI, or runs a sample list headless if one is given on the command line:
+    
+        python -m NanoSight_Automation "Sample List.csv" --status-file status.json
+    """
+    
+    parser = argparse.ArgumentParser(description = "Automate NanoSight acquisition and processing. Without a sample list the GUI is opened.")
+    parser.add_argument("sample_list", nargs = "?", help = "sample list file (.csv or Excel) to run without the GUI, or in Process Only mode a folder of experiments")
+    parser.add_argument("--mode", dest = "program_mode", choices = PROGRAM_MODES, default = PROGRAM_MODES[0], help = "program mode, default %(default)s")
+    parser.add_argument("--individual-directories", dest = "individual_directories", action = "store_true", default = True, 
+                        help = "create a directory for each sample in its Save Directory (the default)")
+    parser.add_argument("--no-individual-directories", dest = "individual_directories", action = "store_false", 
+                        help = "save each sample straight into its Save Directory")
+    parser.add_argument("--pipelined", dest = "pipelined_processing", action = "store_true", help = "process samples while the autosampler moves")
+    parser.add_argument("--resume", action = "store_true", help = "skip the samples an earlier run of the sample list completed")
+    parser.add_argument("--process-script", help = "process script for a folder of experiments in Process Only mode")
+    parser.add_argument("--status-file", help = "JSON file to keep updated with the batch's progress and messages")
+    parser.add_argument("--retries", type = int, default = 3, help = "how many times in a row to answer Yes to retry a step before aborting, default %(default)s")
+    args = parser.parse_args(argv)
+    
+    if args.sample_list is None:
+        import NanoSight_GUI
+        NanoSight_GUI.main()
+        return 0
+    
+    return Run_Headless(args)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    ## Run from the imported module rather than __main__, so the GUI, which imports NanoSight_Automation, 
+    ## and the batch share one copy of its classes and constants.
+    import NanoSight_Automation
+    sys.exit(NanoSight_Automation.main())
@@ -0,0 +1,228 @@
+"""Runs full batches through BatchThread against the simulated instruments in NanoSight_Simulation.py
+and reports how many samples per hour the batch logic gets through and how long each step takes.
+
+Each batch is run once without and once with processing while the autosampler moves, so the effect
+of a scheduling or wait change can be seen by running the benchmark before and after it. It is then 
+run with processing that takes twice as long as the autosampler move, and the benchmark fails if that 
+batch loses a sample, since processing during the move must never hold up the autosampler. Times are 
+in simulated seconds. Example:
+
+    python NanoSight_Benchmark.py --samples 10 --speedup 200 --latency acquisition=90 --failure overwrite_warning=0.2
+
+With --import-time it instead times importing NanoSight_Automation in a fresh interpreter, which is 
+the start up cost of every headless batch, and fails if it is too slow or imports a heavy module.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas
+
+import NanoSight_Automation
+from NanoSight_Automation import BatchThread, Station, StationBatchData, StationScheduler
+from NanoSight_Simulation import SimulatedBatchData, SimulatedDrivers, DEFAULT_LATENCIES, DEFAULT_FAILURE_RATES
+
+
+
+
+def Make_Sample_List(directory, number_of_samples):
+    """Makes a sample list of number_of_samples samples that are saved in directory, and the scripts it uses."""
+
+    for script_name in ["Acquire.txt", "Process.txt"]:
+        with open(os.path.join(directory, script_name), "w") as script_file:
+            script_file.write("Simulated " + os.path.splitext(script_name)[0] + " Script\n")
+
+    return pandas.DataFrame({"Sample Name":["Sample " + str(i+1) for i in range(number_of_samples)],
+                             "Save Directory":[directory]*number_of_samples,
+                             "Acquire Script":[os.path.join(directory, "Acquire.txt")]*number_of_samples,
+                             "Process Script":[os.path.join(directory, "Process.txt")]*number_of_samples})
+
+
+
+
+def Run_Batch(number_of_samples, pipelined_processing, driver_settings):
+    """Runs one simulated batch and returns a dictionary of its results."""
+
+    directory = tempfile.mkdtemp(prefix = "NanoSight Benchmark ")
+    sample_df = Make_Sample_List(directory, number_of_samples)
+    batch_data = SimulatedBatchData(sample_df, os.path.join(directory, "Sample List.csv"), pipelined_processing)
+    drivers = SimulatedDrivers(batch_data, **driver_settings)
+
+    start_time = drivers.clock.perf_counter()
+    batch_thread = BatchThread(batch_data, drivers)
+    batch_thread.join()
+    batch_seconds = drivers.clock.perf_counter() - start_time
+
+    batch_data.sample_statuses.Apply_Updates()
+    completed = len([row for row in range(number_of_samples) if batch_data.sample_statuses.Status(row, "Processing Progress") == "Complete"])
+
+    return {"directory":directory,
+            "completed":completed,
+            "seconds":batch_seconds,
+            "samples_per_hour":completed / batch_seconds * 3600 if batch_seconds > 0 else 0,
+            ## The time NTA was not acquiring, processing, or exporting is the overhead of the batch logic.
+            "NTA_idle_seconds":batch_seconds - drivers.nta.busy_time,
+            "late_acquisitions":drivers.nta.late_acquisitions,
+            "steps":batch_thread.profiler.Summarize(),
+            "messages":drivers.ui.messages}
+
+
+
+
+def Run_Stations(number_of_stations, number_of_samples, pipelined_processing, driver_settings):
+    """Runs one sample list of number_of_samples samples per station on number_of_stations simulated 
+    stations at once through a StationScheduler and returns the samples completed and the simulated seconds taken."""
+
+    ## The stations share one process, so each runs proportionally slower to keep the simulated timing as accurate as a single batch's.
+    driver_settings = dict(driver_settings, speedup = driver_settings["speedup"] / number_of_stations)
+    stations = [Station("Station " + str(i+1), "SIM" + str(i+1)) for i in range(number_of_stations)]
+    scheduler = StationScheduler(stations, lambda batch_data, station: SimulatedDrivers(batch_data, **driver_settings))
+    for i in range(number_of_stations):
+        directory = tempfile.mkdtemp(prefix = "NanoSight Benchmark ")
+        scheduler.Add_Sample_List(StationBatchData(Make_Sample_List(directory, number_of_samples), os.path.join(directory, "Sample List.csv"), 
+                                                   pipelined_processing = pipelined_processing))
+
+    start_time = time.perf_counter()
+    scheduler.Start()
+    scheduler.Join()
+    batch_seconds = (time.perf_counter() - start_time) * driver_settings["speedup"]
+
+    completed = 0
+    for job in scheduler.jobs:
+        job.batch_data.sample_statuses.Apply_Updates()
+        completed += len([row for row in range(number_of_samples) if job.batch_data.sample_statuses.Status(row, "Processing Progress") == "Complete"])
+
+    return completed, batch_seconds
+
+
+
+
+## Modules NanoSight_Automation only imports when they are needed, and how long importing it may take, in seconds.
+HEAVY_MODULES = ["wx", "pandas", "numpy", "serial", "pywinauto", "uiautomation"]
+IMPORT_TIME_LIMIT = 0.25
+
+IMPORT_TIME_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import NanoSight_Automation
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds":seconds, "heavy_modules":[name for name in json.loads(sys.argv[1]) if name in sys.modules]}))
+"""
+
+
+
+
+def Measure_Import_Time(repeats):
+    """Imports NanoSight_Automation in repeats fresh interpreters and returns the fastest import time 
+    in seconds and the heavy modules that were imported with it."""
+    
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for repeat in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", IMPORT_TIME_SCRIPT, json.dumps(HEAVY_MODULES)], cwd = directory)
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+    
+    return min(result["seconds"] for result in results), sorted(set(name for result in results for name in result["heavy_modules"]))
+
+
+
+
+def Print_Results(name, number_of_samples, results):
+    print("")
+    print(name)
+    print("=" * len(name))
+    print("Samples completed:        " + str(results["completed"]) + " of " + str(number_of_samples))
+    print("Batch time:               " + format(results["seconds"]/60, ".1f") + " minutes")
+    print("Samples per hour:         " + format(results["samples_per_hour"], ".2f"))
+    print("NTA idle time per sample: " + format(results["NTA_idle_seconds"]/max(1, results["completed"]), ".1f") + " seconds")
+    print("Late acquisitions:        " + str(results["late_acquisitions"]))
+    print("Profile written to:       " + results["directory"])
+
+    for caption, message in results["messages"]:
+        if caption != "Batch Complete":
+            print("Message: " + caption + ": " + message.replace("\n", " "))
+
+    print("")
+    print("{:<45}{:>7}{:>12}{:>12}{:>12}".format("Step", "Calls", "Total (s)", "Mean (s)", "Max (s)"))
+    for step in results["steps"]:
+        print("{:<45}{:>7}{:>12.1f}{:>12.2f}{:>12.2f}".format(step["Category"] + ": " + step["Step"], step["Calls"],
+                                                             step["Total Seconds"], step["Mean Seconds"], step["Max Seconds"]))
+
+
+
+
+def Parse_Settings(settings, defaults, kind):
+    """Turns a list of NAME=VALUE strings into a dictionary, checking the names against defaults."""
+
+    parsed = {}
+    for setting in settings or []:
+        name, _, value = setting.partition("=")
+        if name not in defaults:
+            raise SystemExit("Unknown " + kind + " " + name + ". Choose from " + ", ".join(sorted(defaults)) + ".")
+        parsed[name] = float(value)
+
+    return parsed
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark NanoSight Automation batches against simulated instruments.")
+    parser.add_argument("--samples", type = int, default = 10, help = "number of samples in each batch")
+    parser.add_argument("--speedup", type = float, default = 100, help = "how many times faster than real time to run")
+    parser.add_argument("--latency", action = "append", metavar = "NAME=SECONDS", help = "override a simulated latency, can be repeated")
+    parser.add_argument("--failure", action = "append", metavar = "NAME=RATE", help = "override a simulated failure rate, can be repeated")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed for the simulated failures")
+    parser.add_argument("--binary", action = "store_true", help = "talk to the simulated Arduino with the binary protocol")
+    parser.add_argument("--stations", type = int, default = 0, help = "also run a sample list on each of this many simulated stations at once")
+    parser.add_argument("--import-time", action = "store_true", help = "only time importing NanoSight_Automation, which is the start up cost of a headless batch")
+    args = parser.parse_args()
+    
+    if args.import_time:
+        seconds, heavy_modules = Measure_Import_Time(5)
+        print("Import time:    " + format(seconds*1000, ".1f") + " ms (limit " + format(IMPORT_TIME_LIMIT*1000, ".0f") + " ms)")
+        print("Heavy modules:  " + (", ".join(heavy_modules) if heavy_modules else "none"))
+        if seconds > IMPORT_TIME_LIMIT or heavy_modules:
+            raise SystemExit("Importing NanoSight_Automation is too slow or imports a heavy module.")
+        return
+
+    NanoSight_Automation.ARDUINO_BINARY_PROTOCOL = args.binary
+
+    driver_settings = {"speedup":args.speedup,
+                       "latencies":Parse_Settings(args.latency, DEFAULT_LATENCIES, "latency"),
+                       "failure_rates":Parse_Settings(args.failure, DEFAULT_FAILURE_RATES, "failure rate"),
+                       "seed":args.seed}
+
+    for name, pipelined_processing in [("Process After Acquiring", False), ("Process While The Autosampler Moves", True)]:
+        results = Run_Batch(args.samples, pipelined_processing, driver_settings)
+        Print_Results(name, args.samples, results)
+
+    ## Processing that can't fit in an autosampler move must wait for the acquisitions instead of losing samples.
+    latencies = dict(DEFAULT_LATENCIES, **driver_settings["latencies"])
+    overrun_settings = dict(driver_settings, latencies = dict(latencies, processing = 2 * latencies["autosampler_move"]))
+    overrun_results = Run_Batch(args.samples, True, overrun_settings)
+    Print_Results("Processing Longer Than The Autosampler Move", args.samples, overrun_results)
+
+    if args.stations > 0:
+        completed, batch_seconds = Run_Stations(args.stations, args.samples, True, driver_settings)
+        name = str(args.stations) + " Stations Processing While The Autosampler Moves"
+        print("")
+        print(name)
+        print("=" * len(name))
+        print("Samples completed:        " + str(completed) + " of " + str(args.stations * args.samples))
+        print("Batch time:               " + format(batch_seconds/60, ".1f") + " minutes")
+        print("Samples per hour:         " + format(completed / batch_seconds * 3600 if batch_seconds > 0 else 0, ".2f"))
+
+    if overrun_results["completed"] < args.samples:
+        raise SystemExit(str(args.samples - overrun_results["completed"]) + " samples were lost when processing took longer than the autosampler move.")
+
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1059 @@
+"""The wx GUI of NanoSight Automation. It is opened by running NanoSight_Automation.py without a 
+sample list, and is kept apart from the batch logic so that running a batch headless doesn't 
+import wx."""
+
+import os
+import re
+import threading
+
+import wx
+import wx.lib.agw.genericmessagedialog as GMD
+
+from NanoSight_Automation import (__version__, EVT_PULLED_PLUG, EVT_THREAD_ABORTED, PROGRAM_MODES, SAMPLE_LIST_REFRESH_INTERVAL, 
+                                  STATIONS_CONFIG_FILENAME, BatchThread, BatchPlanner, BatchJournal, Journal_Filepath, NTARecoveryPolicy, Default_Retry_Policies, 
+                                  PathExistenceCache, SampleStatusList, StationBatchData, StationScheduler, Load_Stations, 
+                                  Read_Sample_List, Validate_Sample_List, Required_Columns)
+
+
+## wx event types for the events the batch thread posts.
+WX_EVENT_TYPES = {EVT_PULLED_PLUG:wx.NewId(), EVT_THREAD_ABORTED:wx.NewId()}
+
+## Make new events so the thread can signal the main GUI.
+class WxBatchEvent(wx.PyEvent):
+    def __init__(self, event):
+        wx.PyEvent.__init__(self)
+        self.SetEventType(WX_EVENT_TYPES[event.GetEventType()])
+        
+
+
+
+EVT_VALIDATION_PROGRESS = wx.NewId()
+EVT_VALIDATION_DONE = wx.NewId()
+
+## Events for the sample list validation thread to report to the main GUI.
+class ValidationProgressEvent(wx.PyEvent):
+    def __init__(self, message):
+        wx.PyEvent.__init__(self)
+        self.SetEventType(EVT_VALIDATION_PROGRESS)
+        self.message = message
+        
+
+
+
+class ValidationDoneEvent(wx.PyEvent):
+    def __init__(self, filepath, sample_df, problems):
+        wx.PyEvent.__init__(self)
+        self.SetEventType(EVT_VALIDATION_DONE)
+        self.filepath = filepath
+        self.sample_df = sample_df
+        self.problems = problems
+        
+
+
+
+
+## Batches running on several stations can show messages at the same time, and only one is shown at a time.
+MESSAGE_LOCK = threading.Lock()
+
+class WxBatchUI(object):
+    """Shows the batch thread's messages as wx dialogs and posts its events to the GUI."""
+
+    def __init__(self, batch_data):
+        self.batch_data = batch_data
+
+    def Show_Message(self, message, caption, style):
+        """Shows a modal message dialog and returns the button that was clicked. The batch thread calls 
+        this, and wx windows may only be made on the GUI thread, so the dialog is shown there with 
+        wx.CallAfter while the calling thread waits for the answer. Messages from other threads are 
+        shown one at a time, so the dialogs of several stations aren't stacked on top of each other. 
+        In an unattended batch a message that only has an OK button is left up for the operator to 
+        read later, and the calling thread goes on without waiting for it."""
+
+        if wx.IsMainThread():
+            return self.Show_Modal(message, caption, style)
+
+        if self.batch_data.unattended and not style & wx.YES_NO:
+            wx.CallAfter(self.Show_Modal, message, caption, style)
+            return wx.ID_OK
+
+        answer = []
+        answered = threading.Event()
+        def show():
+            try:
+                answer.append(self.Show_Modal(message, caption, style))
+            finally:
+                answered.set()
+        with MESSAGE_LOCK:
+            wx.CallAfter(show)
+            answered.wait()
+        return answer[0] if answer else wx.ID_CANCEL
+
+    def Show_Modal(self, message, caption, style):
+        """Shows a modal message dialog on the GUI thread and returns the button that was clicked."""
+
+        msg_dlg = wx.MessageDialog(None, message, caption, style)
+        answer = msg_dlg.ShowModal()
+        msg_dlg.Destroy()
+        return answer
+
+    def Question_Resolved(self, message, caption):
+        """The operator answers every question, so there is nothing to count."""
+
+        pass
+
+    def Post_Event(self, event):
+        """Posts event to the GUI."""
+
+        wx.PostEvent(self.batch_data, WxBatchEvent(event))
+
+
+
+
+
+class SampleListValidationThread(threading.Thread):
+    """Reads and validates a sample list file off the GUI thread. Posts ValidationProgressEvents as 
+    it goes and a ValidationDoneEvent with the sample list and the problems found when it is done. 
+    Problems are (message, caption, style) for the GUI to show as message dialogs. If filepath is a 
+    folder then the sample list is made from the experiments in it, to be processed with process_script."""
+    def __init__(self, gui, filepath, required_columns, path_cache, process_script = None):
+        """Init Sample List Validation Thread Class."""
+        threading.Thread.__init__(self)
+        self.gui = gui
+        self.filepath = filepath
+        self.required_columns = required_columns
+        self.path_cache = path_cache
+        self.process_script = process_script
+        self.daemon = True
+        self.start()
+    
+    
+    def run(self):
+        """Run Sample List Validation Thread."""
+        
+        sample_df, problems = Read_Sample_List(self.filepath, self.process_script, self.Post_Progress)
+        if sample_df is not None:
+            problems = Validate_Sample_List(sample_df, self.required_columns, self.path_cache, self.Post_Progress)
+        
+        wx.PostEvent(self.gui, ValidationDoneEvent(self.filepath, sample_df, problems))
+    
+    
+    def Post_Progress(self, message):
+        wx.PostEvent(self.gui, ValidationProgressEvent(message))
+
+
+
+
+
+
+
+
+
+class SampleListCtrl(wx.ListCtrl):
+    """Virtual list of the samples in the sample list and their progress. wx asks for the text 
+    and colour of a row only when it is drawn, so loading thousands of samples doesn't insert 
+    thousands of rows, and the progress columns are read from the batch's SampleStatusList."""
+    def __init__(self, parent, col_names):
+        wx.ListCtrl.__init__(self, parent, style = wx.LC_REPORT | wx.LC_VIRTUAL)
+        self.col_names = col_names
+        self.cell_text = {}
+        self.sample_statuses = None
+        
+        ## White rows use the default attributes.
+        self.colour_attrs = {}
+        for colour in SampleStatusList.COLOURS[1:]:
+            self.colour_attrs[colour] = wx.ItemAttr()
+            self.colour_attrs[colour].SetBackgroundColour(colour)
+    
+    
+    def Set_Samples(self, sample_df, sample_statuses):
+        """Shows the samples in sample_df with the progress in sample_statuses."""
+        
+        self.cell_text = {name:sample_df.loc[:, name].astype(str).tolist() for name in self.col_names if name in sample_df.columns}
+        self.sample_statuses = sample_statuses
+        self.SetItemCount(len(sample_df))
+        self.Refresh()
+    
+    
+    def OnGetItemText(self, item, column):
+        name = self.col_names[column]
+        if name in SampleStatusList.COLUMNS:
+            return self.sample_statuses.Status(item, name)
+        ## Sample lists made from a folder of experiments have no Acquire Script.
+        if name not in self.cell_text:
+            return ""
+        return self.cell_text[name][item]
+    
+    
+    def OnGetItemAttr(self, item):
+        return self.colour_attrs.get(self.sample_statuses.Colour(item))
+
+
+
+
+
+
+
+
+
+## How often the stations window is redrawn with the stations' progress, in milliseconds.
+STATIONS_REFRESH_INTERVAL = 1000
+
+
+
+
+class StationsFrame(wx.Frame):
+    """Window for running sample lists on several stations at once. Sample lists are checked like 
+    the main window's, with its program mode and settings at the time they are added, and queued on 
+    a StationScheduler, which runs each one on the next free station."""
+    
+    def __init__(self, gui, stations, stations_filepath):
+        super(StationsFrame, self).__init__(gui, title = "NanoSight Automation Stations - " + os.path.basename(stations_filepath), size = (725, 450))
+        
+        self.gui = gui
+        self.scheduler = StationScheduler(stations)
+        ## Sample list file path -> settings of the main window when it was added, until it has been checked.
+        self.pending_settings = {}
+        
+        self.Connect(-1, -1, EVT_VALIDATION_PROGRESS, self.validation_progress)
+        self.Connect(-1, -1, EVT_VALIDATION_DONE, self.validation_done)
+        
+        panel = wx.Panel(self)
+        main_vbox = wx.BoxSizer(wx.VERTICAL)
+        self.statusbar = self.CreateStatusBar()
+        
+        stations_st = wx.StaticText(panel, label = "Stations:")
+        main_vbox.Add(stations_st, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT | wx.TOP, border = 10)
+        
+        self.stations_ctrl = wx.ListCtrl(panel, style = wx.LC_REPORT)
+        for column, width in enumerate([150, 200, 250, 90]):
+            self.stations_ctrl.InsertColumn(column, ["Station", "State", "Sample List", "Completed"][column], width = width)
+        main_vbox.Add(self.stations_ctrl, flag = wx.ALIGN_LEFT | wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border = 10, proportion = 1)
+        
+        sample_lists_st = wx.StaticText(panel, label = "Sample Lists:")
+        main_vbox.Add(sample_lists_st, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT, border = 10)
+        
+        self.jobs_ctrl = wx.ListCtrl(panel, style = wx.LC_REPORT)
+        for column, width in enumerate([350, 200, 150]):
+            self.jobs_ctrl.InsertColumn(column, ["Sample List", "State", "Station"][column], width = width)
+        main_vbox.Add(self.jobs_ctrl, flag = wx.ALIGN_LEFT | wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border = 10, proportion = 1)
+        
+        button_hbox = wx.BoxSizer(wx.HORIZONTAL)
+        self.add_button = wx.Button(panel, label = "Add Sample Lists")
+        self.add_button.Bind(wx.EVT_BUTTON, self.On_Add_Sample_Lists)
+        button_hbox.Add(self.add_button, flag = wx.ALL, border = 5)
+        
+        self.start_button = wx.Button(panel, label = "Start Stations")
+        self.start_button.Bind(wx.EVT_BUTTON, self.On_Start)
+        button_hbox.Add(self.start_button, flag = wx.ALL, border = 5)
+        
+        self.abort_button = wx.Button(panel, label = "Abort Stations")
+        self.abort_button.Bind(wx.EVT_BUTTON, self.On_Abort)
+        button_hbox.Add(self.abort_button, flag = wx.ALL, border = 5)
+        
+        main_vbox.Add(button_hbox, flag = wx.ALIGN_CENTER | wx.ALL, border = 5)
+        
+        self.Bind(wx.EVT_CLOSE, self.On_Close)
+        self.refresh_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.On_Refresh_Timer, self.refresh_timer)
+        self.refresh_timer.Start(STATIONS_REFRESH_INTERVAL)
+        
+        panel.SetSizer(main_vbox)
+        self.Refresh_Lists()
+        self.Show()
+    
+    
+    
+    
+    def On_Add_Sample_Lists(self, event):
+        """Gets sample list files from the user and checks each one in a SampleListValidationThread. 
+        validation_done queues the ones without problems."""
+        
+        dlg = wx.FileDialog(self, message = "Select Sample List Files (.csv or Excel)", style = wx.FD_OPEN | wx.FD_MULTIPLE)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        filepaths = dlg.GetPaths()
+        dlg.Destroy()
+        
+        for filepath in filepaths:
+            if not re.match(r".*\.xlsx|.*\.xlsm|.*\.xls|.*\.csv", filepath):
+                message = os.path.basename(filepath) + " is not an Excel or .csv file and was not added."
+                msg_dlg = wx.MessageDialog(self, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
+                msg_dlg.ShowModal()
+                msg_dlg.Destroy()
+                continue
+            
+            self.pending_settings[filepath] = (self.gui.program_mode, self.gui.pipelined_processing, 
+                                               self.gui.samples_have_individual_directories, self.gui.nta_recovery_policy, self.gui.retry_policies, 
+                                               self.gui.unattended)
+            SampleListValidationThread(self, filepath, Required_Columns(self.gui.program_mode), self.gui.path_cache)
+    
+    
+    
+    
+    def validation_progress(self, event):
+        """Handler for validation progress events. Shows the progress in the status bar."""
+        
+        self.statusbar.SetStatusText(event.message)
+    
+    
+    
+    
+    def validation_done(self, event):
+        """Handler for validation done events. Shows any problems found with the sample list file, 
+        otherwise queues it to run on the stations."""
+        
+        settings = self.pending_settings.pop(event.filepath, None)
+        
+        for message, caption, style in event.problems:
+            msg_dlg = wx.MessageDialog(self, os.path.basename(event.filepath) + ": " + message, caption, style)
+            msg_dlg.ShowModal()
+            msg_dlg.Destroy()
+        
+        if len(event.problems) > 0 or settings is None:
+            self.statusbar.SetStatusText("")
+            return
+        
+        program_mode, pipelined_processing, samples_have_individual_directories, nta_recovery_policy, retry_policies, unattended = settings
+        self.scheduler.Add_Sample_List(StationBatchData(event.sample_df, event.filepath, program_mode, pipelined_processing, 
+                                                        samples_have_individual_directories, nta_recovery_policy, retry_policies, unattended))
+        self.statusbar.SetStatusText("Queued " + os.path.basename(event.filepath) + " with " + str(len(event.sample_df)) + " samples.")
+        self.Refresh_Lists()
+    
+    
+    
+    
+    def On_Start(self, event):
+        """Starts the stations on the queued sample lists."""
+        
+        self.scheduler.Start()
+        self.Refresh_Lists()
+    
+    
+    
+    
+    def On_Abort(self, event):
+        """Cancels the queued sample lists and aborts the batches running on the stations."""
+        
+        self.scheduler.Abort()
+        self.Refresh_Lists()
+    
+    
+    
+    
+    def On_Refresh_Timer(self, event):
+        self.Refresh_Lists()
+    
+    
+    
+    
+    def Refresh_Lists(self):
+        """Redraws the stations and sample lists with their current states."""
+        
+        for ctrl, rows in [(self.stations_ctrl, [[str(value) for value in status] for status in self.scheduler.Station_Statuses()]), 
+                           (self.jobs_ctrl, [[job.Name(), job.state, job.station_name or ""] for job in list(self.scheduler.jobs)])]:
+            if ctrl.GetItemCount() != len(rows):
+                ctrl.DeleteAllItems()
+                for row in rows:
+                    ctrl.Append(row)
+                continue
+            
+            for index, row in enumerate(rows):
+                for column, text in enumerate(row):
+                    if ctrl.GetItemText(index, column) != text:
+                        ctrl.SetItem(index, column, text)
+    
+    
+    
+    
+    def On_Close(self, event):
+        """Asks before closing while stations are running, and aborts them if the window is closed."""
+        
+        if self.scheduler.Is_Running():
+            message = "Batches are still running on the stations. Click Yes to abort them and close the window."
+            msg_dlg = wx.MessageDialog(self, message, "Stations Running", wx.YES_NO | wx.ICON_QUESTION)
+            answer = msg_dlg.ShowModal()
+            msg_dlg.Destroy()
+            if answer != wx.ID_YES:
+                event.Veto()
+                return
+            self.scheduler.Abort()
+        
+        self.refresh_timer.Stop()
+        self.Destroy()
+
+
+
+
+
+
+
+
+
+class Automation_GUI(wx.Frame):
+    
+    
+    def __init__(self, parent, title, *args, **kwargs):
+        
+        super(Automation_GUI, self).__init__(parent, title=title, size = (725, 375), *args, **kwargs) 
+        
+        ## Set up event handlers for serial and batch threads.
+        self.Connect(-1, -1, WX_EVENT_TYPES[EVT_PULLED_PLUG], self.pulled_plug)
+        self.Connect(-1, -1, WX_EVENT_TYPES[EVT_THREAD_ABORTED], self.thread_aborted)
+        self.Connect(-1, -1, EVT_VALIDATION_PROGRESS, self.validation_progress)
+        self.Connect(-1, -1, EVT_VALIDATION_DONE, self.validation_done)
+        
+        self.InitUI()
+        self.Centre()
+        self.Show()
+
+        
+    def InitUI(self):
+        
+        ## Set some default settings.
+        self.batch_thread = None
+        ## Script folder listings are kept between sample list loads so reloads don't list them again.
+        self.path_cache = PathExistenceCache()
+        self.sample_statuses = None
+        
+        
+        ##############
+        ## Menu Bar
+        ##############
+        menubar = wx.MenuBar()
+        fileMenu = wx.Menu()
+        
+        ## Add items to file menu.
+        about_item = fileMenu.Append(100, '&About   \tCtrl+A', 'Information about the program')
+        self.Bind(wx.EVT_MENU, self.OnAbout, about_item)
+                
+        ## Run sample lists on several NanoSight stations from this PC.
+        stations_item = fileMenu.Append(102, '&Run On Stations...', 'Run sample lists on several stations at once')
+        self.Bind(wx.EVT_MENU, self.On_Stations, stations_item)
+        
+        fileMenu.AppendSeparator()
+        
+        quit_item = wx.MenuItem(fileMenu, 101, 'Quit', 'Quit Application')
+        fileMenu.Append(quit_item)
+        self.Bind(wx.EVT_MENU, self.OnQuit, quit_item)
+        
+        ## Add file menu to the menu bar.
+        menubar.Append(fileMenu, "&File")
+        
+        menubar.MacSetCommonMenuBar(menubar)
+        ## Put menu bar in frame.
+        self.SetMenuBar(menubar)
+        
+        
+        ## Create main panel.
+        panel = wx.Panel(self)
+        
+        ## Create common sizerflags object.
+        sizer_flags = wx.SizerFlags(1)
+        sizer_flags.Align(wx.ALIGN_LEFT).Border(wx.LEFT | wx.RIGHT | wx.TOP, 10)
+        
+        main_vbox = wx.BoxSizer(wx.VERTICAL)
+        
+        ## Add a status bar to the bottom for reporting messages.
+        self.statusbar = self.CreateStatusBar()
+        
+        #########################
+        ## Program Mode
+        #########################
+        ## Add radio buttons to select the program mode, acquire then process, acquire only, or process only.
+        self.mode_radio_box = wx.RadioBox(panel, label = "Program Mode", choices = PROGRAM_MODES, majorDimension = len(PROGRAM_MODES), style = wx.RA_SPECIFY_COLS)
+        self.program_mode = PROGRAM_MODES[0]
+        self.sample_list_mode = None
+        
+        self.mode_radio_box.Bind(wx.EVT_RADIOBOX, self.On_Mode_Select)
+        
+        main_vbox.Add(self.mode_radio_box, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT | wx.TOP, border = 10)
+        
+        
+        #########################
+        ## Sample List File
+        #########################
+        ## Add label, button, and feedback for sample list file.
+        sample_list_st = wx.StaticText(panel, label="Sample List File (.csv or Excel):")
+        main_vbox.Add(sample_list_st, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT | wx.TOP, border = 10)
+        
+        sample_hbox = wx.BoxSizer(wx.HORIZONTAL)
+        
+        self.sample_list_tc = wx.TextCtrl(panel, value = "", style = wx.TE_READONLY)
+        sample_hbox.Add(self.sample_list_tc, flag = wx.ALIGN_LEFT | wx.EXPAND | wx.LEFT | wx.RIGHT, border = 10, proportion = 1)
+        
+        self.sample_list_button = wx.Button(panel, label = "Open")
+        self.sample_list_button.Bind(wx.EVT_BUTTON, self.On_Sample_List_Open)
+        sample_hbox.Add(self.sample_list_button, flag = wx.ALIGN_LEFT)
+        
+        ## In Process Only mode a folder of experiments can be processed instead of a sample list.
+        self.experiments_folder_button = wx.Button(panel, label = "Open Experiments Folder")
+        self.experiments_folder_button.Bind(wx.EVT_BUTTON, self.On_Experiments_Folder_Open)
+        self.experiments_folder_button.Disable()
+        sample_hbox.Add(self.experiments_folder_button, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT, border = 10)
+        
+        main_vbox.Add(sample_hbox, flag = wx.ALIGN_LEFT | wx.BOTTOM | wx.EXPAND, border = 10)
+        
+        
+        
+        #########################
+        ## Individual Directory Checkbox
+        #########################
+        self.individual_directories_checkbox = wx.CheckBox(panel, label = "Create Individual Directories For Each Sample")
+        self.individual_directories_checkbox.SetValue(True)
+        self.samples_have_individual_directories = True
+        
+        self.individual_directories_checkbox.Bind(wx.EVT_CHECKBOX, self.OnCheck)
+        
+        main_vbox.Add(self.individual_directories_checkbox, flag = wx.ALIGN_LEFT | wx.LEFT | wx.BOTTOM, border = 10)
+        
+        
+        
+        #########################
+        ## Pipelined Processing Checkbox
+        #########################
+        self.pipelined_processing_checkbox = wx.CheckBox(panel, label = "Process Samples While The Autosampler Moves")
+        self.pipelined_processing_checkbox.SetValue(False)
+        self.pipelined_processing = False
+        self.resume_batch = False
+        self.nta_recovery_policy = NTARecoveryPolicy()
+        self.retry_policies = Default_Retry_Policies()
+        
+        self.pipelined_processing_checkbox.Bind(wx.EVT_CHECKBOX, self.OnPipelineCheck)
+        
+        main_vbox.Add(self.pipelined_processing_checkbox, flag = wx.ALIGN_LEFT | wx.LEFT | wx.BOTTOM, border = 10)
+        
+        
+        
+        #########################
+        ## Plan Batch Checkbox
+        #########################
+        self.plan_batch_checkbox = wx.CheckBox(panel, label = "Reorder Samples To Reduce Script Loads")
+        self.plan_batch_checkbox.SetValue(False)
+        self.plan_batch = False
+        
+        self.plan_batch_checkbox.Bind(wx.EVT_CHECKBOX, self.OnPlanCheck)
+        
+        main_vbox.Add(self.plan_batch_checkbox, flag = wx.ALIGN_LEFT | wx.LEFT | wx.BOTTOM, border = 10)
+        
+        
+        
+        #########################
+        ## Unattended Checkbox
+        #########################
+        self.unattended_checkbox = wx.CheckBox(panel, label = "Unattended (Don't Wait For OK Or Ask To Retry)")
+        self.unattended_checkbox.SetValue(False)
+        self.unattended = False
+        
+        self.unattended_checkbox.Bind(wx.EVT_CHECKBOX, self.OnUnattendedCheck)
+        
+        main_vbox.Add(self.unattended_checkbox, flag = wx.ALIGN_LEFT | wx.LEFT | wx.BOTTOM, border = 10)
+        
+        
+        
+        ##########################
+        ## Number of Samples
+        ##########################
+        ## Add a label to show the number of samples.
+        num_samples_hbox = wx.BoxSizer(wx.HORIZONTAL)
+        
+        num_of_samples_label_st = wx.StaticText(panel, label="Number of Samples:")
+        num_samples_hbox.Add(num_of_samples_label_st, flag = wx.ALIGN_LEFT | wx.ALL, border = 10)
+        
+        self.num_of_samples_st = wx.StaticText(panel, label="")
+        num_samples_hbox.Add(self.num_of_samples_st, flag = wx.ALIGN_LEFT | wx.ALL, border = 10)
+        
+        main_vbox.Add(num_samples_hbox, flag = wx.ALIGN_LEFT)
+        
+        
+        
+        ##########################
+        ## Sample Progress
+        ##########################
+        ## Add text box to display what sample is in progress.
+        run_progress_st = wx.StaticText(panel, label="Run Progress:")
+        main_vbox.Add(run_progress_st, flag = wx.ALIGN_LEFT | wx.LEFT | wx.RIGHT | wx.TOP, border = 10)
+        
+        self.list_ctrl_col_names = ["Sample Name", "Save Directory", "Acquire Script", "Process Script",
+                                    "Acquisition Progress", "Processing Progress", "Analysis Progress"]
+        
+        self.sample_list_ctrl = SampleListCtrl(panel, self.list_ctrl_col_names)
+        
+        
+        for col_name in self.list_ctrl_col_names:    
+            self.sample_list_ctrl.InsertColumn(self.list_ctrl_col_names.index(col_name), col_name, width = (len(col_name)*5 + 35))
+            
+        main_vbox.Add(self.sample_list_ctrl, flag = wx.ALIGN_LEFT | wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, border = 10)
+        
+        
+        ##########################
+        ## Start Batch Button
+        ##########################
+        ## Add button to toggle starting and stopping run.
+        self.toggle_button = wx.ToggleButton(panel, label = "Start Batch")
+        self.toggle_button.Disable()
+        self.toggle_button.Bind(wx.EVT_TOGGLEBUTTON, self.On_Toggle)
+        
+        
+        main_vbox.Add(self.toggle_button, flag = wx.ALIGN_CENTER | wx.ALL, border = 10)
+        
+        
+        ## Redraw the rows whose progress changed at a bounded rate instead of on every change.
+        self.sample_list_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.On_Sample_List_Timer, self.sample_list_timer)
+        self.sample_list_timer.Start(SAMPLE_LIST_REFRESH_INTERVAL)
+        
+
+        panel.SetSizer(main_vbox)
+        panel.Fit()
+        self.Fit()
+        
+
+
+
+
+    def OnQuit(self, e):
+        self.Close()
+
+
+
+    def On_Stations(self, event):
+        """Gets the stations file from the user, NanoSight_Stations.json next to the program by default, 
+        and opens a StationsFrame to run sample lists on the stations in it."""
+        
+        if self.batch_thread:
+            message = "Stations can't be run while a batch is running in this window."
+            msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
+            msg_dlg.ShowModal()
+            msg_dlg.Destroy()
+            return
+        
+        dlg = wx.FileDialog(None, message = "Select Stations File (.json)", defaultDir = os.path.dirname(os.path.abspath(__file__)), 
+                            defaultFile = STATIONS_CONFIG_FILENAME, wildcard = "Stations files (*.json)|*.json", style = wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        filepath = dlg.GetPath()
+        dlg.Destroy()
+        
+        try:
+            stations = Load_Stations(filepath)
+        except (IOError, OSError, ValueError, TypeError) as e:
+            message = "The stations file could not be loaded.\n\n" + str(e)
+            msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
+            msg_dlg.ShowModal()
+            msg_dlg.Destroy()
+            return
+        
+        StationsFrame(self, stations, filepath)
+
+
+
+    def OnAbout(self, event):
+        message = "Author: Travis Thompson \n\n" + \
+        "Creation Date: November 2018 \n" + \
+        "Version Number: " + __version__
+       
+        dlg = GMD.GenericMessageDialog(None, message, "About", wx.OK | wx.ICON_INFORMATION)
+        dlg.ShowModal()
+        dlg.Destroy()
+
+
+
+
+
+    def On_Sample_List_Open(self, event):
+        """Creates the open file dialog box and gets a file from the user. The file 
+        is then checked to make sure it is formatted correctly. The file is checked 
+        to make sure it has the correct columns, it is the correct file type, and 
+        that it has values in every column. Also makes sure that all file paths in 
+        the file exist. The checks other than the file type are done in a 
+        SampleListValidationThread so the GUI doesn't freeze on large sample lists, 
+        and validation_done updates the GUI once they finish."""
+        
+        message = "Select Sample List File (.csv or Excel)"
+        dlg = wx.FileDialog(None, message = message, style=wx.FD_OPEN | wx.FD_CHANGE_DIR)
+    
+        if dlg.ShowModal() == wx.ID_OK:
+            filepath = dlg.GetPath()
+            dlg.Destroy()
+            
+            if not re.match(r".*\.xlsx|.*\.xlsm|.*\.xls|.*\.csv", filepath):
+                message = "Incorrect file type chosen. Please select an Excel or .csv file."
+                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
+                msg_dlg.ShowModal()
+                msg_dlg.Destroy()
+                return
+                
+            else:
+                self.Start_Validation(filepath)
+    
+    
+    
+    
+    def On_Experiments_Folder_Open(self, event):
+        """Gets a folder of .nano experiments and the Process Script to process them with from the user, 
+        and makes a sample list for processing every experiment in the folder and its subfolders."""
+        
+        dlg = wx.DirDialog(None, message = "Select Folder Of Experiments To Process", style = wx.DD_DIR_MUST_EXIST)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        folder = dlg.GetPath()
+        dlg.Destroy()
+        
+        dlg = wx.FileDialog(None, message = "Select The Process Script", style = wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+        process_script = dlg.GetPath()
+        dlg.Destroy()
+        
+        self.Start_Validation(folder, process_script)
+    
+    
+    
+    
+    def Start_Validation(self, filepath, process_script = None):
+        """Starts a SampleListValidationThread to read and check the sample list in filepath, 
+        or to make one from the experiments in filepath if it is a folder."""
+        
+        ## Don't allow another file to be opened or a batch to be started until the checks are done.
+        self.sample_list_button.Disable()
+        self.experiments_folder_button.Disable()
+        self.mode_radio_box.Disable()
+        self.toggle_was_enabled = self.toggle_button.IsEnabled()
+        self.toggle_button.Disable()
+        
+        self.validation_mode = self.program_mode
+        self.validation_thread = SampleListValidationThread(self, filepath, Required_Columns(self.program_mode), self.path_cache, process_script)
+    
+    
+    
+    
+    def validation_progress(self, event):
+        """Handler for validation progress events. Shows the progress in the status bar."""
+        
+        self.statusbar.SetStatusText(event.message)
+    
+    
+    
+    
+    def validation_done(self, event):
+        """Handler for validation done events. Shows any problems found with the sample list file, 
+        otherwise updates the GUI with the new sample list."""
+        
+        self.validation_thread = None
+        self.sample_list_button.Enable()
+        self.experiments_folder_button.Enable(self.program_mode == "Process Only")
+        self.mode_radio_box.Enable()
+        
+        for message, caption, style in event.problems:
+            msg_dlg = wx.MessageDialog(None, message, caption, style)
+            msg_dlg.ShowModal()
+            msg_dlg.Destroy()
+        
+        if len(event.problems) > 0:
+            self.statusbar.SetStatusText("")
+            if self.toggle_was_enabled:
+                self.toggle_button.Enable()
+            return
+        
+        
+        filepath = event.filepath
+        sample_df = event.sample_df
+        
+        self.sample_list_tc.SetValue(filepath)
+        
+        self.num_of_samples_st.SetLabel(str(len(sample_df)))
+        
+        self.sample_statuses = SampleStatusList(len(sample_df))
+        self.sample_list_ctrl.Set_Samples(sample_df, self.sample_statuses)
+        
+        self.sample_df = sample_df
+        self.sample_list_filepath = filepath
+        self.sample_list_mode = self.validation_mode
+        
+        ## The Save Directory of each experiment found in a folder is the folder it is in.
+        if os.path.isdir(filepath):
+            self.individual_directories_checkbox.SetValue(False)
+            self.samples_have_individual_directories = False
+        
+        self.statusbar.SetStatusText("Loaded " + str(len(sample_df)) + " samples.")
+        self.toggle_button.Enable()
+            
+        
+    
+    
+    def On_Sample_List_Timer(self, event):
+        """Applies the progress changes queued by the batch thread and redraws the rows that changed."""
+        
+        if self.sample_statuses is None:
+            return
+        
+        changed_rows = self.sample_statuses.Apply_Updates()
+        if len(changed_rows) > 0:
+            self.sample_list_ctrl.RefreshItems(min(changed_rows), max(changed_rows))
+    
+    
+    
+    
+    def OnCheck(self, event):
+        """Change the state of the internal variable to match the state of the check box."""
+        
+#        """If the user clicks the check after opening the Sample List File then the directories 
+#        won't get made, so see if the sample list exists and create the directories if the box is checked."""
+        
+        check_box = event.GetEventObject()
+        self.samples_have_individual_directories = check_box.GetValue()
+        
+#        if check_box.GetValue() and self.toggle_button.Enabled():
+#            
+#            sample_df = self.sample_df
+#            
+#            for i in range(len(sample_df)):
+#                directory = sample_df.loc[i, "Save Directory"]
+#                sample_name = sample_df.loc[i, "Sample Name"]
+#                directory = os.path.join(directory, sample_name)
+#                    
+#                try:
+#                    os.makedirs(directory)
+#                except OSError as e:
+#                    if e.errno != errno.EEXIST:
+#                        message = "An error occurred while creating the directory for sample " + sample_name + "."
+#                        message = message + "\n\n" + str(e)
+#                        msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
+#                        msg_dlg.ShowModal()
+#                        msg_dlg.Destroy()
+#                        return
+            
+    
+    
+    
+        
+    
+    
+    
+    def On_Mode_Select(self, event):
+        """Changes the program mode. A sample list checked for Process Only hasn't had its Acquire Scripts 
+        checked, so it has to be opened again before acquiring."""
+        
+        self.program_mode = PROGRAM_MODES[event.GetEventObject().GetSelection()]
+        self.experiments_folder_button.Enable(self.program_mode == "Process Only")
+        
+        if self.sample_list_mode is not None and not Required_Columns(self.program_mode).issubset(Required_Columns(self.sample_list_mode)):
+            self.toggle_button.Disable()
+            self.statusbar.SetStatusText("Open the sample list again to check it for " + self.program_mode + ".")
+        elif self.sample_list_mode is not None:
+            self.toggle_button.Enable()
+            self.statusbar.SetStatusText("")
+    
+    
+    
+    
+    def OnPipelineCheck(self, event):
+        """Change the state of the internal variable to match the state of the pipelined processing check box."""
+        
+        check_box = event.GetEventObject()
+        self.pipelined_processing = check_box.GetValue()
+    
+    
+    
+    
+    
+    def OnPlanCheck(self, event):
+        """Change the state of the internal variable to match the state of the plan batch check box."""
+        
+        check_box = event.GetEventObject()
+        self.plan_batch = check_box.GetValue()
+    
+    
+    
+    
+    
+    def OnUnattendedCheck(self, event):
+        """Change the state of the internal variable to match the state of the unattended check box."""
+        
+        check_box = event.GetEventObject()
+        self.unattended = check_box.GetValue()
+    
+    
+    
+    
+    
+    def On_Toggle(self, event):
+        """After clicking the "Start/Abort Batch button this function either 
+        starts or aborts the batch appropriately."""
+        
+        button = event.GetEventObject()
+        
+        
+        if button.GetValue() == True:
+            ## Disable the button to open a different file so the user can't change the sample list mid operation.
+            self.sample_list_button.Disable()
+            self.experiments_folder_button.Disable()
+            self.mode_radio_box.Disable()
+            self.individual_directories_checkbox.Disable()
+            self.pipelined_processing_checkbox.Disable()
+            self.plan_batch_checkbox.Disable()
+            self.unattended_checkbox.Disable()
+            
+            if not self.batch_thread:
+                if self.plan_batch:
+                    self.Plan_Batch()
+                self.resume_batch = self.Ask_To_Resume()
+                self.batch_thread = BatchThread(self)
+                button.SetLabel("Abort Batch")
+            
+            else:
+                message = "Batch thread already started, something seriously wrong happened."
+                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
+                msg_dlg.ShowModal()
+                msg_dlg.Destroy()
+            
+        
+        else:
+            
+            if self.batch_thread:
+                self.batch_thread.abort()
+                ## Disable button until thread has been aborted.
+                button.Disable()
+            
+            else:
+                message = "Batch thread already aborted, something seriously wrong happened."
+                msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
+                msg_dlg.ShowModal()
+                msg_dlg.Destroy()
+            
+            
+    
+
+
+
+
+
+
+    def Plan_Batch(self):
+        """Plans an order for the sample list that loads fewer scripts in NTA and shows the user the 
+        estimated time saved. The order and the tube each sample is in are written to "<sample list> Plan.csv" 
+        so the CETAC sample set can be made to match. If the user accepts, the batch runs in the planned order."""
+        
+        planner = BatchPlanner(self.sample_df, self.program_mode, self.pipelined_processing)
+        order = planner.Plan_Order()
+        original_loads, planned_loads, seconds_saved = planner.Estimate(order)
+        
+        if seconds_saved <= 0:
+            self.statusbar.SetStatusText("Reordering the samples would not reduce the script loads, running in sample list order.")
+            return
+        
+        plan_filepath = os.path.splitext(self.sample_list_filepath)[0] + " Plan.csv"
+        try:
+            planner.Write_Plan(plan_filepath, order)
+        except (IOError, OSError) as e:
+            message = "Could not write the batch plan to " + plan_filepath + ". The batch will run in sample list order.\n\n" + str(e)
+            msg_dlg = wx.MessageDialog(None, message, "Warning", wx.OK | wx.ICON_EXCLAMATION)
+            msg_dlg.ShowModal()
+            msg_dlg.Destroy()
+            return
+        
+        message = "Reordering the samples reduces the script loads in NTA from " + str(original_loads) + " to " + str(planned_loads) + \
+                  ", saving about " + str(int(round(seconds_saved/60.0))) + " minute(s). \nThe planned order was written to " + plan_filepath + "."
+        if self.program_mode != "Process Only":
+            message = message + "\n\nThe autosampler has to deliver the samples in the planned order, so the sample set selected in CETAC must visit the tubes in the order in the Tube column."
+        message = message + "\n\nClick Yes to run the batch in the planned order, or No to run it in sample list order."
+        
+        msg_dlg = wx.MessageDialog(None, message, "Batch Plan", wx.YES_NO | wx.ICON_QUESTION)
+        answer = msg_dlg.ShowModal()
+        msg_dlg.Destroy()
+        
+        if answer == wx.ID_YES:
+            self.sample_df = self.sample_df.loc[order].reset_index(drop = True)
+            self.sample_statuses = SampleStatusList(len(self.sample_df))
+            self.sample_list_ctrl.Set_Samples(self.sample_df, self.sample_statuses)
+    
+    
+    
+    
+    def Ask_To_Resume(self):
+        """If the journal of an earlier run of the sample list has completed steps in it, asks the user 
+        whether to resume that run. Returns True to resume and False to start the batch from the beginning."""
+        
+        journal = BatchJournal(Journal_Filepath(self.sample_list_filepath), self.sample_df.loc[:, "Sample Name"])
+        completed_steps = journal.Completed_Steps()
+        acquired = [i for i in range(len(self.sample_df)) if "Acquired" in completed_steps.get(i, ())]
+        exported = [i for i in range(len(self.sample_df)) if "Exported" in completed_steps.get(i, ())]
+        
+        if len(acquired) == 0 and len(exported) == 0:
+            return False
+        
+        message = "An earlier run of this sample list acquired " + str(len(acquired)) + " and processed " + str(len(exported)) + \
+                  " of the " + str(len(self.sample_df)) + " samples. \nClick Yes to resume it and skip the completed samples, or No to start from the beginning."
+        not_acquired = [i for i in range(len(self.sample_df)) if i not in acquired]
+        if len(not_acquired) > 0:
+            message = message + "\n\nWhen resuming, the sample set selected in CETAC must start at sample " + str(self.sample_df.loc[not_acquired[0], "Sample Name"]) + "."
+        
+        msg_dlg = wx.MessageDialog(None, message, "Resume Batch", wx.YES_NO | wx.ICON_QUESTION)
+        answer = msg_dlg.ShowModal()
+        msg_dlg.Destroy()
+        
+        return answer == wx.ID_YES
+    
+    
+    
+    
+    def pulled_plug(self, event):
+        """Handler for PulledPlug events. Creates a message to indicate that the 
+        Arduino was disconnected and re-enables all buttons."""
+        
+        message = "Arduino Disconnected. Batch Aborted."
+        msg_dlg = wx.MessageDialog(None, message, "Error", wx.OK | wx.ICON_ERROR)
+        msg_dlg.ShowModal()
+        msg_dlg.Destroy()
+        
+        self.toggle_button.SetValue(False)
+        self.toggle_button.SetLabel("Start Batch")
+        
+        self.batch_thread = None
+        
+        self.sample_list_button.Enable()
+        self.experiments_folder_button.Enable(self.program_mode == "Process Only")
+        self.mode_radio_box.Enable()
+        self.individual_directories_checkbox.Enable()
+        self.pipelined_processing_checkbox.Enable()
+        self.plan_batch_checkbox.Enable()
+        self.unattended_checkbox.Enable()
+   
+
+
+    def thread_aborted(self, event):
+        """Handler for aborted thread. Re-enables all buttons."""
+        
+        self.toggle_button.SetValue(False)
+        self.toggle_button.SetLabel("Start Batch")
+        self.toggle_button.Enable()
+        
+        self.batch_thread = None
+
+        self.sample_list_button.Enable()
+        self.experiments_folder_button.Enable(self.program_mode == "Process Only")
+        self.mode_radio_box.Enable()
+        self.individual_directories_checkbox.Enable()
+        self.pipelined_processing_checkbox.Enable()
+        self.plan_batch_checkbox.Enable()
+        self.unattended_checkbox.Enable()
+
+
+
+
+
+        
+        
+def main():
+
+    ex = wx.App(False)
+    Automation_GUI(None, title = "NanoSight Automation")
+    ex.MainLoop()    
+
+
+if __name__ == '__main__':
+    main()
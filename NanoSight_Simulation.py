@@ -0,0 +1,1021 @@
+"""Simulated stand-ins for the NTA 3.3 program, the CETAC Workstation program, the MVX autosampler,
+and the Arduino so that batches can be run through BatchThread without the instruments.
+
+SimulatedDrivers has the same interface as WindowsDrivers in NanoSight_Automation.py. The simulated
+programs answer the same pywinauto and uiautomation calls BatchThread makes, so the real batch logic
+is what runs. Every delay is given in simulated seconds and the ScaledClock runs the simulation
+faster than real time, so an hour long batch can be timed in a few seconds. Each instrument can also
+be given failure rates so that the error paths can be exercised."""
+
+import threading
+import time
+import os
+import random
+import difflib
+import collections
+import math
+import struct
+
+from NanoSight_Automation import (FakeWindowBackend, SampleStatusList, NTARecoveryPolicy, Default_Retry_Policies, Encode_Frame, Decode_Frame, FRAME_SYNC, FRAME_REPLY_BIT, FRAME_NAK, FRAME_PULSE, 
+                                  MESSAGE_YES_NO, ID_OK, ID_YES, ID_NO)
+
+
+
+## How long each simulated action takes, in simulated seconds.
+DEFAULT_LATENCIES = {"ui_action":0.2,           ## A click, tab selection, or text entry in NTA or CETAC.
+                     "dialog_open":0.5,         ## From clicking a button to its dialog appearing.
+                     "dialog_close":0.3,        ## From clicking a dialog button to the dialog closing.
+                     "acquisition":60,          ## Running an acquire script in NTA.
+                     "processing":30,           ## Running a process script in NTA.
+                     "experiment_load":3,       ## Loading an experiment in NTA.
+                     "export":5,                ## Exporting results in NTA.
+                     "autosampler_move":45,     ## The autosampler moving to and loading a tube.
+                     "autosampler_dwell":75,    ## From the sample loaded signal to the trigger request signal. The CETAC script has to wait longer than the acquisition.
+                     "autosampler_pulse":1,     ## How long the autosampler holds its output on.
+                     "serial_response":0.01,    ## The Arduino responding to a command.
+                     "nta_restart":30,          ## From killing NTA to its window being back.
+                     "arduino_replug":5}        ## How long the Arduino's USB connection is gone when it drops.
+
+
+## The chance of each simulated failure happening, from 0 to 1.
+DEFAULT_FAILURE_RATES = {"ui_click":0.0,            ## A click in NTA is lost and its dialog never appears.
+                         "overwrite_warning":0.0,   ## NTA shows a Warning dialog after Run is clicked.
+                         "cetac_error":0.0,         ## CETAC shows an Error dialog and stops the autosampler.
+                         "serial_drop":0.0,         ## A response from the Arduino is lost.
+                         "nta_lockup":0.0,          ## NTA stops responding after an export until it is restarted.
+                         "serial_unplug":0.0,       ## The Arduino's USB connection drops when a command is written.
+                         "serial_corrupt":0.0}      ## A byte of a command or response is corrupted on the wire.
+
+
+
+
+class ScaledClock(object):
+    """Clock that runs speedup times faster than real time. Has the same interface as SystemClock
+    in NanoSight_Automation.py plus the scheduling calls the simulated instruments use."""
+
+    def __init__(self, speedup = 100):
+        self.speedup = float(speedup)
+        self.real_start = time.perf_counter()
+        self.simulated_start = time.time()
+
+
+    def time(self):
+        return self.simulated_start + self.perf_counter()
+
+
+    def perf_counter(self):
+        return (time.perf_counter() - self.real_start) * self.speedup
+
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds) / self.speedup)
+
+
+    def real_seconds(self, seconds):
+        return max(0, seconds) / self.speedup
+
+
+    def wait(self, event, seconds):
+        """Waits up to seconds for event to be set. Returns True if it was set."""
+        return event.wait(max(0, seconds) / self.speedup)
+
+
+    def call_later(self, seconds, function, *args):
+        """Calls function with args after seconds in a separate thread. Returns the timer so it can be cancelled."""
+
+        timer = threading.Timer(max(0, seconds) / self.speedup, function, args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+
+
+class SimulatedDesktop(object):
+    """The simulated programs' top level windows. The window registry reads them through
+    the same FakeWindowBackend used to benchmark it."""
+
+    def __init__(self):
+        self.backend = FakeWindowBackend()
+        self.lock = threading.Lock()
+        self.next_process_id = 1000
+
+
+    def New_Process_ID(self):
+        with self.lock:
+            self.next_process_id += 4
+            return self.next_process_id
+
+
+    def Add_Window(self, title, process_id, owner = None):
+        with self.lock:
+            return self.backend.Add_Window(title, process_id, owner = owner)
+
+
+    def Remove_Window(self, handle):
+        with self.lock:
+            self.backend.Remove_Window(handle)
+
+
+
+
+######################
+## Arduino
+######################
+class SimulatedArduino(object):
+    """Serial port stand-in that behaves like the Arduino running NanoSight_Triggering.ino.
+    Supports the R, S, C, T, P, N, B, and X commands, as text and in binary frames. The autosampler 
+    changes pin 7 through Set_Pin_7 and \"T\" triggers the autosampler through its Trigger method."""
+
+    def __init__(self, clock, rng, latencies, failure_rates):
+        self.clock = clock
+        self.rng = rng
+        self.latencies = latencies
+        self.failure_rates = failure_rates
+        self.autosampler = None
+        self.timeout = 1
+        self.condition = threading.Condition()
+        self.output = bytearray()
+        self.closed = False
+        self.plugged_in = True
+        self.start_time = clock.time()
+
+        self.pin_7_low = False
+        self.latch = False
+        self.push_mode = False
+        self.binary_mode = False
+        self.received = b""
+        self.last_sequence = 0
+        self.pulse_count = 0
+        self.pulse_millis = 0
+
+
+    def millis(self):
+        return int((self.clock.time() - self.start_time) * 1000)
+
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            return len(self.output)
+
+
+    def read(self, size = 1):
+        """Returns up to size bytes, waiting up to timeout seconds for the first one."""
+
+        with self.condition:
+            if self.closed:
+                raise OSError("The simulated Arduino is closed.")
+
+            if len(self.output) == 0:
+                ## Don't spin when the simulation runs much faster than real time.
+                self.condition.wait(max(self.clock.real_seconds(self.timeout), 0.001))
+
+            data = bytes(self.output[:size])
+            del self.output[:size]
+            return data
+
+
+    def write(self, data):
+        if self.closed:
+            raise OSError("The simulated Arduino is closed.")
+
+        if self.rng.random() < self.failure_rates["serial_unplug"]:
+            self.Unplug()
+            raise OSError("The simulated Arduino was unplugged.")
+
+        data = self.Corrupt(data)
+        for byte in bytearray(data):
+            if self.binary_mode or len(self.received) > 0 or byte == FRAME_SYNC:
+                self.received += bytes(bytearray([byte]))
+                self.Read_Frames()
+            else:
+                self.Handle_Command(chr(byte))
+
+        return len(data)
+
+
+    def Read_Frames(self):
+        """Handles the whole frames received. A frame with a bad CRC is answered with a NAK."""
+
+        while True:
+            frame, self.received, bad_frames = Decode_Frame(self.received)
+            if bad_frames > 0:
+                ## The firmware reads the sequence number from the corrupted frame, which is usually still right.
+                self.Send_Frame(FRAME_NAK, self.last_sequence)
+            if frame is None:
+                return
+            opcode, self.last_sequence, payload, frame_bytes = frame
+            self.Handle_Command(chr(opcode), self.last_sequence, True)
+
+
+    def Corrupt(self, data):
+        """Flips a bit in data at the serial_corrupt failure rate."""
+
+        if len(data) == 0 or self.rng.random() >= self.failure_rates["serial_corrupt"]:
+            return data
+        data = bytearray(data)
+        data[self.rng.randrange(len(data))] ^= 1 << self.rng.randrange(8)
+        return bytes(data)
+
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+    def Unplug(self):
+        """Drops the USB connection, which closes the port, and plugs it back in after the replug latency."""
+
+        with self.condition:
+            self.closed = True
+            self.plugged_in = False
+            self.condition.notify_all()
+
+        self.clock.call_later(self.latencies["arduino_replug"], self.Plug_In)
+
+
+    def Plug_In(self):
+        with self.condition:
+            self.plugged_in = True
+
+
+    def Open(self):
+        """Opens the port again. Like the real board, the Arduino restarts, which turns push mode off, 
+        starts its pulse count and clock from 0, and sets the latch only if the autosampler output is on."""
+
+        with self.condition:
+            if not self.plugged_in:
+                raise OSError("The simulated Arduino is unplugged.")
+
+            self.closed = False
+            self.output = bytearray()
+            self.push_mode = False
+            self.binary_mode = False
+            self.received = b""
+            self.pulse_count = 0
+            self.pulse_millis = 0
+            self.latch = self.pin_7_low
+            self.start_time = self.clock.time()
+
+
+    def Print(self, line, delay = None):
+        """Sends line to the host after delay simulated seconds, unless the response is dropped."""
+
+        if self.rng.random() < self.failure_rates["serial_drop"]:
+            return
+
+        if delay is None:
+            delay = self.latencies["serial_response"]
+        self.clock.call_later(delay, self._Send, line)
+
+
+    def _Send(self, line):
+        self._Send_Bytes((line + "\r\n").encode("ascii"))
+
+
+    def _Send_Bytes(self, data):
+        with self.condition:
+            self.output.extend(self.Corrupt(data))
+            self.condition.notify_all()
+
+
+    def Send_Frame(self, opcode, sequence, payload = b"", delay = None):
+        if self.rng.random() < self.failure_rates["serial_drop"]:
+            return
+
+        if delay is None:
+            delay = self.latencies["serial_response"]
+        self.clock.call_later(delay, self._Send_Bytes, Encode_Frame(opcode, sequence, payload))
+
+
+    def Reply(self, command, sequence, framed, answer, line, delay = None):
+        """Answers command with line, or with a reply frame with answer as its payload if the command was framed."""
+
+        if framed:
+            self.Send_Frame(ord(command) | FRAME_REPLY_BIT, sequence, b"" if answer is None else bytes(bytearray([answer])), delay)
+        else:
+            self.Print(line, delay)
+
+
+    def Handle_Command(self, command, sequence = 0, framed = False):
+        if command == "T":
+            if self.autosampler is not None:
+                self.autosampler.Trigger()
+            self.Reply(command, sequence, framed, None, "Signal Sent To Autosampler", 2 + self.latencies["serial_response"])
+        elif command == "R":
+            self.Reply(command, sequence, framed, int(self.pin_7_low), "Signal From Autosampler Detected" if self.pin_7_low else "No Signal From Autosampler")
+        elif command == "S":
+            self.Reply(command, sequence, framed, int(self.latch), "Autosampler Signal Latched As True" if self.latch else "Autosampler Signal Latched As False")
+        elif command == "C":
+            self.latch = self.pin_7_low
+            self.Reply(command, sequence, framed, None, "Autosampler Signal Latch Cleared")
+        elif command == "P":
+            self.push_mode = True
+            self.Reply(command, sequence, framed, None, "Push Mode Enabled")
+        elif command == "N":
+            self.push_mode = False
+            self.Reply(command, sequence, framed, None, "Push Mode Disabled")
+        elif command == "B":
+            self.Reply(command, sequence, framed, None, "Binary Mode Enabled")
+            self.binary_mode = True
+        elif command == "X" and self.binary_mode:
+            self.Reply(command, sequence, framed, None, "Text Mode Enabled")
+            self.binary_mode = False
+
+
+    def Set_Pin_7(self, low):
+        """Sets the level of the autosampler output. A falling edge counts as a pulse."""
+
+        if low and not self.pin_7_low:
+            self.pulse_count += 1
+            self.pulse_millis = self.millis()
+            ## Pulses are sent as soon as they happen, so they are never dropped.
+            if self.push_mode and self.binary_mode:
+                self._Send_Bytes(Encode_Frame(FRAME_PULSE, 0, struct.pack("<II", self.pulse_count, self.pulse_millis)))
+            elif self.push_mode:
+                self._Send("Autosampler Signal Event " + str(self.pulse_count) + " " + str(self.pulse_millis))
+
+        self.pin_7_low = low
+        if low:
+            self.latch = True
+
+
+
+
+######################
+## CETAC and the autosampler
+######################
+class SimulatedAutosampler(object):
+    """Runs the CETAC script on the MVX autosampler. For every tube the autosampler moves to and
+    loads the tube, signals that the sample is loaded, waits the dwell time, signals that it is ready
+    for the next trigger, and then waits for the trigger. The script ends after the last tube is triggered."""
+
+    def __init__(self, clock, rng, latencies, failure_rates, desktop, arduino):
+        self.clock = clock
+        self.rng = rng
+        self.latencies = latencies
+        self.failure_rates = failure_rates
+        self.desktop = desktop
+        self.arduino = arduino
+        arduino.autosampler = self
+
+        self.running = False
+        self.waiting_for_trigger = False
+        self.triggered = threading.Event()
+        self.aborted = threading.Event()
+        self.tubes_done = 0
+        self.move_time = 0
+        self.error_handle = None
+        ## The CETAC Workstation window, which owns the Error dialog.
+        self.cetac_handle = None
+
+
+    def Run_Script(self, tube_count):
+        self.running = True
+        self.aborted.clear()
+        self.tubes_done = 0
+        thread = threading.Thread(target = self._Run, args = (tube_count,), name = "Simulated Autosampler")
+        thread.daemon = True
+        thread.start()
+
+
+    def _Run(self, tube_count):
+        for tube in range(tube_count):
+            if self.clock.wait(self.aborted, self.latencies["autosampler_move"]):
+                break
+            self.move_time += self.latencies["autosampler_move"]
+
+            ## CETAC errors show up as a dialog titled Error in a process of its own, owned by the CETAC window.
+            if self.rng.random() < self.failure_rates["cetac_error"]:
+                self.error_handle = self.desktop.Add_Window("Error", self.desktop.New_Process_ID(), self.cetac_handle)
+                break
+
+            if not self.Pulse() or self.clock.wait(self.aborted, self.latencies["autosampler_dwell"]) or not self.Pulse():
+                break
+
+            self.triggered.clear()
+            self.waiting_for_trigger = True
+            while not self.triggered.wait(0.01):
+                if self.aborted.is_set():
+                    break
+            self.waiting_for_trigger = False
+
+            if self.aborted.is_set():
+                break
+            self.tubes_done += 1
+
+        self.running = False
+
+
+    def Pulse(self):
+        """Turns the output on for the pulse time. Returns False if the script was aborted."""
+
+        self.arduino.Set_Pin_7(True)
+        aborted = self.clock.wait(self.aborted, self.latencies["autosampler_pulse"])
+        self.arduino.Set_Pin_7(False)
+        return not aborted
+
+
+    def Trigger(self):
+        if self.waiting_for_trigger:
+            self.triggered.set()
+
+
+    def Abort(self):
+        self.aborted.set()
+
+
+
+
+class SimulatedCETAC(object):
+    """The CETAC Workstation program. tube_count is the number of tubes chosen in Select Sample Set."""
+
+    def __init__(self, clock, rng, latencies, failure_rates, desktop, autosampler, tube_count):
+        self.clock = clock
+        self.rng = rng
+        self.latencies = latencies
+        self.desktop = desktop
+        self.autosampler = autosampler
+        self.tube_count = tube_count
+        self.connected = True
+        self.script_loaded = True
+        self.dialogs = []
+        self.process_id = desktop.New_Process_ID()
+        self.handle = desktop.Add_Window("CETAC Workstation", self.process_id)
+        autosampler.cetac_handle = self.handle
+
+
+    def Is_Enabled(self, button):
+        if button == "Run Script":
+            return self.script_loaded and not self.autosampler.running
+        elif button == "Abort Script":
+            return self.autosampler.running
+        elif button == "Disconnect":
+            return self.connected
+        return True
+
+
+    def Click(self, button):
+        self.clock.sleep(self.latencies["ui_action"])
+        if not self.Is_Enabled(button):
+            return
+
+        if button == "Run Script":
+            if self.tube_count == 0:
+                self.dialogs.append(SimulatedCETACDialog(self, "Warning", "No tube locations have been selected in \"Select Sample Set\""))
+            else:
+                self.autosampler.Run_Script(self.tube_count)
+        elif button == "Abort Script":
+            self.autosampler.Abort()
+
+
+
+
+class SimulatedCETACButton(object):
+    def __init__(self, cetac, name):
+        self.cetac = cetac
+        self.name = name
+
+    @property
+    def IsEnabled(self):
+        return self.cetac.Is_Enabled(self.name)
+
+    def Click(self):
+        self.cetac.Click(self.name)
+
+    def GetChildren(self):
+        ## Only used on the Home tab, which has more than one child when it is the active tab.
+        return [None, None]
+
+
+
+
+class SimulatedCETACDialog(object):
+    ControlTypeName = "WindowControl"
+
+    def __init__(self, cetac, name, text):
+        self.cetac = cetac
+        self.Name = name
+        self.text = text
+
+    def TextControl(self):
+        return collections.namedtuple("TextControl", ["Name"])(self.text)
+
+    def SetActive(self, waitTime = 1):
+        pass
+
+    def ButtonControl(self, Name):
+        return self
+
+    def Click(self):
+        if self in self.cetac.dialogs:
+            self.cetac.dialogs.remove(self)
+
+
+
+
+class SimulatedCETACWindow(object):
+    """Answers the uiautomation calls made on the CETAC Workstation window."""
+
+    def __init__(self, cetac):
+        self.cetac = cetac
+        self.ProcessId = cetac.process_id
+
+    def SetActive(self, waitTime = 1):
+        pass
+
+    def ButtonControl(self, Name):
+        return SimulatedCETACButton(self.cetac, Name)
+
+    def TabItemControl(self, Name):
+        return SimulatedCETACButton(self.cetac, Name)
+
+    def GetChildren(self):
+        return list(self.cetac.dialogs)
+
+
+
+
+######################
+## NTA
+######################
+class SimulatedNTA(object):
+    """The NTA 3.3 program. Keeps track of the selected tabs, the open dialogs, the base filename,
+    the loaded script and experiment, and whether a script is running. Acquisitions write a .nano
+    file to the base filename and exports write an ExperimentSummary .csv next to the experiment
+    so the rest of the batch can find them."""
+
+    ## Tab names of the tab controls BatchThread selects, in order.
+    TABS = {"TabControl2":["SOP", "Capture", "Analysis"],
+            "TabControl3":["Recent Measurements", "Script Editor"],
+            "TabControl4":["Experiment Summary", "Current Experiment"]}
+    MAIN_CONTROLS = list(TABS.keys()) + ["ListBox", "...", "Load Script", "Run", "Open Experiment", "Export Results", "Abort"]
+
+    def __init__(self, clock, rng, latencies, failure_rates, desktop):
+        self.clock = clock
+        self.rng = rng
+        self.latencies = latencies
+        self.failure_rates = failure_rates
+        self.desktop = desktop
+        self.lock = threading.RLock()
+        self.process_id = desktop.New_Process_ID()
+        self.dialogs = collections.OrderedDict([("NTA 3.3", desktop.Add_Window("NTA 3.3", self.process_id))])
+        self.dialog_purpose = None
+        self.edit_text = ""
+        self.selected_tabs = {name:0 for name in self.TABS}
+        self.base_filepath = None
+        self.loaded_script = None
+        self.loaded_experiment = None
+        self.loaded_samples = []
+        self.mode = "acquire"
+        self.script_timer = None
+        self.acquisitions = 0
+        self.processings = 0
+        self.busy_time = 0
+        ## Acquisitions started after the autosampler finished its dwell, when the sample may no longer be in the flow cell.
+        self.autosampler = None
+        self.late_acquisitions = 0
+        self.hung = False
+        self.ghost_window = None
+        self.restarts = 0
+
+
+    def Best_Match(self, name, names):
+        """Matches a control name the way pywinauto does, so misspelled names still find their control."""
+
+        if name in names:
+            return name
+        matches = difflib.get_close_matches(name, names, n = 1, cutoff = 0.6)
+        if len(matches) == 0:
+            raise AttributeError("No control matching " + name)
+        return matches[0]
+
+
+    def Open_Dialog(self, title, purpose = None):
+        def open_dialog():
+            with self.lock:
+                if title not in self.dialogs:
+                    self.dialogs[title] = self.desktop.Add_Window(title, self.process_id)
+                    self.dialog_purpose = purpose
+                    self.edit_text = ""
+        self.clock.call_later(self.latencies["dialog_open"], open_dialog)
+
+
+    def Close_Dialog(self, title, delay = None):
+        def close_dialog():
+            with self.lock:
+                if title in self.dialogs:
+                    self.desktop.Remove_Window(self.dialogs.pop(title))
+        self.clock.call_later(self.latencies["dialog_close"] if delay is None else delay, close_dialog)
+
+
+    def Select_Tab(self, control, tab):
+        self.clock.sleep(self.latencies["ui_action"])
+        with self.lock:
+            if not self.hung:
+                self.selected_tabs[control] = self.TABS[control].index(tab)
+
+
+    def Click(self, window, control):
+        """Handles a click on control in the window titled window."""
+
+        self.clock.sleep(self.latencies["ui_action"])
+        with self.lock:
+            ## Like uiautomation, clicking a control in a window that isn't open does nothing,
+            ## and a hung NTA doesn't respond to anything.
+            if window not in self.dialogs or self.hung:
+                return
+
+            if window == "NTA 3.3":
+                ## Lost clicks only happen on the main window, where a dialog is expected to open.
+                if control != "Abort" and self.rng.random() < self.failure_rates["ui_click"]:
+                    return
+
+                if control == "...":
+                    self.Open_Dialog("Save As", "filename")
+                elif control == "Load Script":
+                    self.Open_Dialog("Open", "script")
+                elif control == "Open Experiment":
+                    self.Open_Dialog("Open", "experiment")
+                elif control == "Export Results":
+                    self.Open_Dialog("Export Settings")
+                elif control == "Run":
+                    self.Run_Script()
+                elif control == "Abort":
+                    self.Abort_Script()
+
+            elif window == "Save As" and control == "Save":
+                self.base_filepath = self.edit_text
+                self.mode = "acquire"
+                self.Close_Dialog("Save As")
+
+            elif window == "Open" and control == "Open":
+                if self.dialog_purpose == "script":
+                    self.loaded_script = self.edit_text
+                elif self.dialog_purpose == "experiment" and os.path.exists(self.edit_text):
+                    self.Load_Experiment(self.edit_text)
+                self.Close_Dialog("Open")
+
+            elif window == "Warning" and control == "Yes":
+                self.Close_Dialog("Warning")
+
+            elif window == "NTA" and control == "OK":
+                self.Close_Dialog("NTA")
+
+            elif window == "Export Settings" and control == "Export":
+                self.busy_time += self.latencies["export"]
+                self.clock.call_later(self.latencies["export"], self.Write_Summary)
+                self.Close_Dialog("Export Settings", self.latencies["export"])
+
+
+    def Load_Experiment(self, filepath):
+        self.loaded_experiment = filepath
+        self.loaded_samples = []
+        self.mode = "process"
+        name = os.path.splitext(os.path.basename(filepath))[0]
+
+        def loaded():
+            with self.lock:
+                self.loaded_samples = [name + "_1.avi", name + "_2.avi"]
+        self.clock.call_later(self.latencies["experiment_load"], loaded)
+
+
+    def Run_Script(self):
+        if self.rng.random() < self.failure_rates["overwrite_warning"]:
+            self.Open_Dialog("Warning")
+
+        if self.mode == "acquire":
+            duration = self.latencies["acquisition"]
+            if self.autosampler is not None and self.autosampler.waiting_for_trigger:
+                self.late_acquisitions += 1
+        else:
+            duration = self.latencies["processing"]
+        self.busy_time += duration
+        self.script_timer = self.clock.call_later(duration, self.Script_Finished, self.mode)
+
+
+    def Script_Finished(self, mode):
+        with self.lock:
+            if mode == "acquire":
+                self.acquisitions += 1
+                if self.base_filepath:
+                    with open(self.base_filepath + ".nano", "w") as nano_file:
+                        nano_file.write("Simulated experiment\n")
+            else:
+                self.processings += 1
+
+            self.script_timer = None
+            self.Open_Dialog("NTA")
+
+
+    def Abort_Script(self):
+        if self.script_timer is not None:
+            self.script_timer.cancel()
+            self.script_timer = None
+
+
+    def Write_Summary(self):
+        if self.loaded_experiment is None:
+            return
+        summary_filepath = os.path.splitext(self.loaded_experiment)[0] + "-ExperimentSummary.csv"
+        with open(summary_filepath, "w") as summary_file:
+            summary_file.write(self.Summary_Text())
+
+        if self.rng.random() < self.failure_rates["nta_lockup"]:
+            self.Hang()
+
+
+    def Summary_Text(self):
+        """Returns an ExperimentSummary.csv laid out like NTA's, with a random log normal size distribution of five captures."""
+
+        mode_size = self.rng.uniform(80, 200)
+        lines = ["NTA Version:,NTA 3.3 Simulated",
+                 "Sample Name:," + os.path.splitext(os.path.basename(self.loaded_experiment))[0],
+                 "Temperature:,25.0",
+                 "",
+                 ",Mean,Mode,SD,D10,D50,D90",
+                 "Size (nm)," + ",".join(format(mode_size * factor, ".1f") for factor in [1.1, 1.0, 0.4, 0.7, 1.05, 1.6]),
+                 "",
+                 "Bin centre (nm),Concentration average,Standard Error," + ",".join("Concentration (particles / ml) Capture " + str(j + 1) for j in range(5))]
+        capture_scales = [self.rng.uniform(0.8, 1.2) for j in range(5)]
+        for bin_centre in range(1, 1000, 2):
+            concentration = 1e7 * math.exp(-math.log(bin_centre / mode_size)**2 / 0.18)
+            captures = [concentration * scale for scale in capture_scales]
+            lines.append(str(bin_centre) + "," + format(sum(captures) / len(captures), ".4g") + "," + format(concentration * 0.1, ".4g") + "," +
+                         ",".join(format(capture, ".4g") for capture in captures))
+
+        return "\n".join(lines) + "\n"
+
+
+    def Hang(self):
+        """Stops NTA responding. Windows puts a ghost window from another process over a hung window."""
+
+        with self.lock:
+            self.hung = True
+            if self.ghost_window is None:
+                self.ghost_window = self.desktop.Add_Window("NTA 3.3 (Not Responding)", self.desktop.New_Process_ID())
+
+
+    def Restart(self):
+        """Kills NTA and starts it again, which takes the nta_restart latency. Everything loaded is lost."""
+
+        with self.lock:
+            self.Abort_Script()
+            for handle in self.dialogs.values():
+                self.desktop.Remove_Window(handle)
+            self.dialogs.clear()
+            if self.ghost_window is not None:
+                self.desktop.Remove_Window(self.ghost_window)
+                self.ghost_window = None
+            self.hung = False
+            self.selected_tabs = {name:0 for name in self.TABS}
+            self.loaded_script = None
+            self.loaded_experiment = None
+            self.loaded_samples = []
+            self.process_id = self.desktop.New_Process_ID()
+            self.restarts += 1
+
+        def started():
+            with self.lock:
+                self.dialogs["NTA 3.3"] = self.desktop.Add_Window("NTA 3.3", self.process_id)
+        self.clock.call_later(self.latencies["nta_restart"], started)
+
+
+    def Windows(self):
+        with self.lock:
+            return [SimulatedNTAWindowInfo(title) for title in self.dialogs]
+
+
+
+
+class SimulatedNTAWindowInfo(object):
+    """What pywinauto's windows() returns, printed the same way so the title regexes match."""
+
+    def __init__(self, title):
+        self.title = title
+
+    def __str__(self):
+        return "hwndwrapper.DialogWrapper - '" + self.title + "', Dialog"
+
+    def class_name(self):
+        return "#32770"
+
+
+
+
+class SimulatedNTAControl(object):
+    """A control in an NTA window. Answers the pywinauto calls BatchThread makes on it."""
+
+    def __init__(self, nta, window, name):
+        self.nta = nta
+        self.window = window
+        self.name = name
+
+    def __getattr__(self, name):
+        ## Buttons on dialogs, such as NTA_app["NTA"].OK, are reached through their window.
+        return SimulatedNTAControl(self.nta, self.window, name)
+
+    def click(self):
+        self.nta.Click(self.window, self.name)
+
+    def Click(self):
+        self.nta.Click(self.window, self.name)
+
+    def is_enabled(self):
+        return self.window in self.nta.dialogs
+
+    def set_text(self, text):
+        self.nta.clock.sleep(self.nta.latencies["ui_action"])
+        with self.nta.lock:
+            self.nta.edit_text = text
+
+    def texts(self):
+        return [self.nta.edit_text]
+
+    def item_texts(self):
+        return list(self.nta.loaded_samples)
+
+    def Select(self, tab):
+        self.nta.Select_Tab(self.name, tab)
+
+    def get_selected_tab(self):
+        return self.nta.selected_tabs[self.name]
+
+
+
+
+class SimulatedNTAWindow(object):
+    """A window of the NTA program, like a pywinauto WindowSpecification."""
+
+    def __init__(self, nta, title):
+        self.nta = nta
+        self.title = title
+
+    def __getitem__(self, name):
+        if self.title == "NTA 3.3":
+            name = self.nta.Best_Match(name, SimulatedNTA.MAIN_CONTROLS)
+        return SimulatedNTAControl(self.nta, self.title, name)
+
+    def __getattr__(self, name):
+        return self[name]
+
+    def is_enabled(self):
+        return self.title in self.nta.dialogs
+
+
+
+
+class SimulatedNTAApp(object):
+    """Answers the pywinauto Application calls BatchThread makes on the NTA program."""
+
+    def __init__(self, nta):
+        self.nta = nta
+        self.process = nta.process_id
+
+    def __getitem__(self, title):
+        return SimulatedNTAWindow(self.nta, title)
+
+    def __getattr__(self, title):
+        return SimulatedNTAWindow(self.nta, title)
+
+    def windows(self):
+        return self.nta.Windows()
+
+
+
+
+class SimulatedNTADialogControl(object):
+    """Answers the uiautomation calls BatchThread makes on the NTA dialogs."""
+
+    def __init__(self, nta, title, name = None):
+        self.nta = nta
+        self.title = title
+        self.name = name
+
+    def SetActive(self, waitTime = 1):
+        pass
+
+    def ButtonControl(self, Name):
+        return SimulatedNTADialogControl(self.nta, self.title, Name)
+
+    def SplitButtonControl(self, Name):
+        return SimulatedNTADialogControl(self.nta, self.title, Name)
+
+    def Click(self):
+        self.nta.Click(self.title, self.name)
+
+
+
+
+######################
+## GUI
+######################
+class SimulatedBatchUI(object):
+    """Stands in for the GUI. Messages are recorded instead of shown. Each question is answered Yes,
+    so that the batch retries, up to max_retries times and No after that, counting again once the 
+    step it asks about succeeds."""
+
+    def __init__(self, max_retries = 3):
+        self.max_retries = max_retries
+        self.retries = collections.Counter()
+        self.messages = []
+        self.events = []
+
+    def Show_Message(self, message, caption, style):
+        self.messages.append((caption, message))
+        if style & MESSAGE_YES_NO:
+            self.retries[(caption, message)] += 1
+            return ID_YES if self.retries[(caption, message)] <= self.max_retries else ID_NO
+        return ID_OK
+
+    def Question_Resolved(self, message, caption):
+        self.retries.pop((caption, message), None)
+
+    def Post_Event(self, event):
+        self.events.append(event.GetEventType())
+
+
+
+
+class SimulatedBatchData(object):
+    """Has the attributes of Automation_GUI that BatchThread reads."""
+
+    def __init__(self, sample_df, sample_list_filepath, pipelined_processing = False, samples_have_individual_directories = False, resume_batch = False, 
+                 program_mode = "Acquire Then Process", nta_recovery_policy = None, retry_policies = None, unattended = False):
+        self.sample_df = sample_df
+        self.sample_list_filepath = sample_list_filepath
+        self.pipelined_processing = pipelined_processing
+        self.samples_have_individual_directories = samples_have_individual_directories
+        self.resume_batch = resume_batch
+        self.program_mode = program_mode
+        self.nta_recovery_policy = nta_recovery_policy if nta_recovery_policy is not None else NTARecoveryPolicy()
+        self.retry_policies = retry_policies if retry_policies is not None else Default_Retry_Policies()
+        self.unattended = unattended
+        self.sample_statuses = SampleStatusList(len(sample_df))
+
+
+
+
+class SimulatedDrivers(object):
+    """Drivers for a simulated NTA, CETAC, autosampler, and Arduino, with the same interface as
+    WindowsDrivers. latencies and failure_rates override the entries of DEFAULT_LATENCIES and
+    DEFAULT_FAILURE_RATES. tube_count is the number of tubes selected in CETAC and defaults to
+    the number of samples. seed makes the failures repeatable."""
+
+    def __init__(self, batch_data, speedup = 100, latencies = None, failure_rates = None, tube_count = None, seed = None, max_retries = 3):
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.failure_rates = dict(DEFAULT_FAILURE_RATES, **(failure_rates or {}))
+        self.rng = random.Random(seed)
+        self.clock = ScaledClock(speedup)
+        self.ui = SimulatedBatchUI(max_retries)
+        self.desktop = SimulatedDesktop()
+        self.window_backend = self.desktop.backend
+
+        if tube_count is None:
+            tube_count = len(batch_data.sample_df)
+        self.arduino = SimulatedArduino(self.clock, self.rng, self.latencies, self.failure_rates)
+        self.autosampler = SimulatedAutosampler(self.clock, self.rng, self.latencies, self.failure_rates, self.desktop, self.arduino)
+        self.cetac = SimulatedCETAC(self.clock, self.rng, self.latencies, self.failure_rates, self.desktop, self.autosampler, tube_count)
+        self.nta = SimulatedNTA(self.clock, self.rng, self.latencies, self.failure_rates, self.desktop)
+        self.nta.autosampler = self.autosampler
+
+
+    def Find_Arduino_Ports(self):
+        return ["SIM1"]
+
+
+    def Open_Serial(self, port_name):
+        if self.arduino.closed:
+            self.arduino.Open()
+        return self.arduino
+
+
+    def Serial_Port_Identities(self):
+        return {"SIM1":(0x2341, 0x0043, "SIM1")} if self.arduino.plugged_in else {}
+
+
+    def Connect_NTA(self):
+        return SimulatedNTAApp(self.nta)
+
+
+    def Restart_NTA(self, nta_app):
+        self.nta.Restart()
+
+
+    def Connect_CETAC(self):
+        return SimulatedCETACWindow(self.cetac)
+
+
+    def Window_Control(self, name):
+        if name == "CETAC Workstation":
+            return SimulatedCETACWindow(self.cetac)
+        return SimulatedNTADialogControl(self.nta, name)
+
+
+    def Instrument_Time(self):
+        """Returns the simulated seconds the instruments spent doing work the batch has to wait for:
+        NTA running scripts and exporting, and the autosampler moving."""
+
+        return self.nta.busy_time + self.autosampler.move_time
@@ -0,0 +1,7 @@
+"""The modules under test are scripts at the top of the repository rather than a package, so the
+repository is put on the path for the tests to import them."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
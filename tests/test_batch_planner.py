@@ -0,0 +1,139 @@
+"""Tests of BatchPlanner: grouping samples by script, keeping sample list order otherwise, Priority and
+Pinned, mapping the planned order back to the sample list's rows, and counting script loads."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas
+
+from NanoSight_Automation import SCRIPT_LOAD_SECONDS, BatchPlanner
+
+
+
+
+def Sample_List(acquire_scripts, process_scripts = None, **columns):
+    number_of_samples = len(acquire_scripts)
+    sample_df = pandas.DataFrame({"Sample Name":["Sample " + str(i+1) for i in range(number_of_samples)],
+                                  "Save Directory":["C:\\Results"]*number_of_samples,
+                                  "Acquire Script":acquire_scripts,
+                                  "Process Script":process_scripts if process_scripts is not None else ["P"]*number_of_samples})
+    for column, values in columns.items():
+        sample_df[column] = values
+    return sample_df
+
+
+
+
+class PlanOrderTest(unittest.TestCase):
+
+    def test_samples_are_grouped_by_script_in_order_of_first_appearance(self):
+        sample_df = Sample_List(["B", "A", "B", "C", "A", "B"])
+
+        self.assertEqual(BatchPlanner(sample_df, "Acquire Then Process", False).Plan_Order(), [0, 2, 5, 1, 4, 3])
+
+
+    def test_process_script_splits_groups(self):
+        sample_df = Sample_List(["A", "A", "A", "A"], ["P1", "P2", "P1", "P2"])
+
+        self.assertEqual(BatchPlanner(sample_df, "Acquire Then Process", False).Plan_Order(), [0, 2, 1, 3])
+
+
+    def test_grouped_sample_list_keeps_its_order(self):
+        sample_df = Sample_List(["A", "A", "B", "B", "C"])
+        planner = BatchPlanner(sample_df, "Acquire Then Process", False)
+        order = planner.Plan_Order()
+
+        self.assertEqual(order, [0, 1, 2, 3, 4])
+        self.assertEqual(planner.Estimate(order)[2], 0)
+
+
+    def test_lower_priority_runs_first_and_blank_counts_as_zero(self):
+        sample_df = Sample_List(["A", "B", "A", "B", "A"], Priority = ["", -1, "2", None, "not a number"])
+
+        ## Row 1 has priority -1, rows 0, 3, and 4 count as 0 and are grouped, and row 2 has priority 2.
+        self.assertEqual(BatchPlanner(sample_df, "Acquire Then Process", False).Plan_Order(), [1, 0, 4, 3, 2])
+
+
+    def test_pinned_samples_keep_their_row(self):
+        sample_df = Sample_List(["A", "B", "A", "B", "A", "B"], Pinned = ["", "Yes", " x ", "no", "", "0"])
+        order = BatchPlanner(sample_df, "Acquire Then Process", False).Plan_Order()
+
+        self.assertEqual(order[1], 1)
+        self.assertEqual(order[2], 2)
+        self.assertEqual([order[position] for position in [0, 3, 4, 5]], [0, 4, 3, 5])
+
+
+    def test_order_is_a_permutation_of_the_rows(self):
+        sample_df = Sample_List(["C", "A", "B"]*5, ["P1", "P2"]*7 + ["P1"], Priority = [1, 0, 0, 2, 0]*3, Pinned = ["y", "", ""]*5)
+
+        self.assertEqual(sorted(BatchPlanner(sample_df, "Acquire Then Process", False).Plan_Order()), list(range(15)))
+
+
+
+
+class PlanMappingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_plan_maps_each_run_to_its_tube_in_the_sample_list(self):
+        sample_df = Sample_List(["B", "A", "B", "A"])
+        planner = BatchPlanner(sample_df, "Acquire Then Process", False)
+        order = planner.Plan_Order()
+        plan_filepath = os.path.join(self.directory, "Sample List Plan.csv")
+        planner.Write_Plan(plan_filepath, order)
+
+        plan_df = pandas.read_csv(plan_filepath)
+        self.assertEqual(plan_df.loc[:, "Run Order"].tolist(), [1, 2, 3, 4])
+        self.assertEqual(plan_df.loc[:, "Tube"].tolist(), [1, 3, 2, 4])
+        for position in range(len(plan_df)):
+            tube_row = plan_df.loc[position, "Tube"] - 1
+            self.assertEqual(plan_df.loc[position, "Sample Name"], sample_df.loc[tube_row, "Sample Name"])
+            self.assertEqual(plan_df.loc[position, "Acquire Script"], sample_df.loc[tube_row, "Acquire Script"])
+
+
+    def test_reordered_sample_list_rows_map_back_to_the_original_rows(self):
+        sample_df = Sample_List(["B", "A", "B", "A", "C"], ["P1", "P2", "P3", "P4", "P5"])
+        order = BatchPlanner(sample_df, "Acquire Then Process", False).Plan_Order()
+
+        ## The GUI runs the batch on the sample list reordered like this.
+        planned_df = sample_df.loc[order].reset_index(drop = True)
+
+        for position, row in enumerate(order):
+            self.assertEqual(planned_df.loc[position].tolist(), sample_df.loc[row].tolist())
+        self.assertEqual(sorted(planned_df.loc[:, "Sample Name"]), sorted(sample_df.loc[:, "Sample Name"]))
+
+
+
+
+class ScriptLoadsTest(unittest.TestCase):
+
+    def test_loads_in_each_program_mode(self):
+        sample_df = Sample_List(["A", "B", "A"], ["P1", "P1", "P2"])
+        sample_list_order = [0, 1, 2]
+
+        self.assertEqual(BatchPlanner(sample_df, "Acquire Then Process", False).Count_Script_Loads(sample_list_order), 5)
+        self.assertEqual(BatchPlanner(sample_df, "Acquire Only", False).Count_Script_Loads(sample_list_order), 3)
+        self.assertEqual(BatchPlanner(sample_df, "Process Only", False).Count_Script_Loads(sample_list_order), 2)
+        ## A, B, P1, B, A, P1, A, P2
+        self.assertEqual(BatchPlanner(sample_df, "Acquire Then Process", True).Count_Script_Loads(sample_list_order), 8)
+
+
+    def test_estimate_of_the_planned_order(self):
+        sample_df = Sample_List(["A", "B", "A", "B"])
+        planner = BatchPlanner(sample_df, "Acquire Only", False)
+        order = planner.Plan_Order()
+
+        self.assertEqual(planner.Estimate(order), (4, 2, 2*SCRIPT_LOAD_SECONDS))
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+"""Tests of the binary serial protocol's frames: the CRC-8, encoding a frame, and finding frames in
+the bytes received from the Arduino among noise, partial frames, and frames damaged on the way."""
+
+import unittest
+
+from NanoSight_Automation import FRAME_MAX_PAYLOAD, FRAME_REPLY_BIT, FRAME_SYNC, CRC8, Decode_Frame, Encode_Frame
+
+
+
+
+class CRC8Test(unittest.TestCase):
+
+    def test_known_values(self):
+        ## The standard check value of CRC-8 with polynomial 0x07 and an initial value of 0.
+        self.assertEqual(CRC8(b"123456789"), 0xF4)
+        self.assertEqual(CRC8(b""), 0)
+        self.assertEqual(CRC8(b"\x00"), 0)
+
+
+    def test_any_single_bit_error_is_caught(self):
+        body = bytearray(b"T\x07\x01\x01")
+        crc = CRC8(body)
+        for i in range(len(body) * 8):
+            damaged = bytearray(body)
+            damaged[i // 8] ^= 1 << (i % 8)
+            self.assertNotEqual(CRC8(damaged), crc)
+
+
+
+
+class EncodeFrameTest(unittest.TestCase):
+
+    def test_layout(self):
+        frame = Encode_Frame(ord("S"), 7, b"\x01")
+        self.assertEqual(bytearray(frame)[:4], bytearray([FRAME_SYNC, ord("S"), 7, 1]))
+        self.assertEqual(frame[4:-1], b"\x01")
+        self.assertEqual(bytearray(frame)[-1], CRC8(frame[1:-1]))
+
+
+    def test_empty_payload(self):
+        frame = Encode_Frame(ord("R"), 0)
+        self.assertEqual(len(frame), 5)
+        self.assertEqual(bytearray(frame)[3], 0)
+
+
+
+
+class DecodeFrameTest(unittest.TestCase):
+
+    def test_whole_frame(self):
+        frame = Encode_Frame(ord("S") | FRAME_REPLY_BIT, 3, b"\x01")
+        decoded, left, bad_frames = Decode_Frame(frame)
+
+        self.assertEqual(decoded, (ord("S") | FRAME_REPLY_BIT, 3, b"\x01", frame))
+        self.assertEqual(left, b"")
+        self.assertEqual(bad_frames, 0)
+
+
+    def test_bytes_after_the_frame_are_left(self):
+        first = Encode_Frame(ord("C") | FRAME_REPLY_BIT, 1)
+        second = Encode_Frame(ord("T") | FRAME_REPLY_BIT, 2)
+
+        decoded, left, bad_frames = Decode_Frame(first + second)
+        self.assertEqual(decoded[3], first)
+        self.assertEqual(left, second)
+        self.assertEqual(Decode_Frame(left)[0][1], 2)
+
+
+    def test_noise_before_the_sync_byte_is_skipped(self):
+        frame = Encode_Frame(ord("R") | FRAME_REPLY_BIT, 4, b"\x00")
+        decoded, left, bad_frames = Decode_Frame(b"No Signal\r\n" + frame)
+
+        self.assertEqual(decoded[3], frame)
+        self.assertEqual(left, b"")
+        self.assertEqual(bad_frames, 1)
+
+
+    def test_noise_alone_is_dropped(self):
+        self.assertEqual(Decode_Frame(b"\x00\x13\x37"), (None, b"", 1))
+        self.assertEqual(Decode_Frame(b""), (None, b"", 0))
+
+
+    def test_partial_frame_is_kept_until_the_rest_arrives(self):
+        frame = Encode_Frame(ord("S") | FRAME_REPLY_BIT, 5, b"\x01")
+
+        for split in range(1, len(frame)):
+            decoded, left, bad_frames = Decode_Frame(frame[:split])
+            self.assertIsNone(decoded)
+            self.assertEqual(left, frame[:split])
+            self.assertEqual(bad_frames, 0)
+
+            decoded, left, bad_frames = Decode_Frame(left + frame[split:])
+            self.assertEqual(decoded[3], frame)
+            self.assertEqual(bad_frames, 0)
+
+
+    def test_bad_crc_is_counted_and_skipped(self):
+        damaged = bytearray(Encode_Frame(ord("T") | FRAME_REPLY_BIT, 6))
+        damaged[-1] ^= 0xFF
+        good = Encode_Frame(ord("C") | FRAME_REPLY_BIT, 7)
+
+        decoded, left, bad_frames = Decode_Frame(bytes(damaged) + good)
+        self.assertEqual(decoded[3], good)
+        self.assertEqual(left, b"")
+        self.assertGreaterEqual(bad_frames, 1)
+
+        decoded, left, bad_frames = Decode_Frame(bytes(damaged))
+        self.assertIsNone(decoded)
+        self.assertGreaterEqual(bad_frames, 1)
+
+
+    def test_damaged_payload_is_not_taken_for_a_reply(self):
+        damaged = bytearray(Encode_Frame(ord("R") | FRAME_REPLY_BIT, 8, b"\x00"))
+        damaged[4] = 1
+
+        decoded, left, bad_frames = Decode_Frame(bytes(damaged))
+        self.assertIsNone(decoded)
+        self.assertGreaterEqual(bad_frames, 1)
+
+
+    def test_too_long_payload_length_is_a_corrupt_frame(self):
+        corrupt = bytes(bytearray([FRAME_SYNC, ord("R"), 9, FRAME_MAX_PAYLOAD + 1]))
+        good = Encode_Frame(ord("R") | FRAME_REPLY_BIT, 9, b"\x01")
+
+        decoded, left, bad_frames = Decode_Frame(corrupt + good)
+        self.assertEqual(decoded[3], good)
+        self.assertGreaterEqual(bad_frames, 1)
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
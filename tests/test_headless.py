@@ -0,0 +1,86 @@
+"""Tests of the headless batch's ConsoleBatchUI: how many times a question is answered Yes, and how
+the end of the batch is reported."""
+
+import collections
+import io
+import types
+import unittest
+
+from NanoSight_Automation import (ICON_QUESTION, ID_NO, ID_OK, ID_YES, MESSAGE_OK, MESSAGE_YES_NO, TIME_OUT, BatchThread,
+                                  ConsoleBatchUI, RetryPolicy)
+
+
+
+
+class ConsoleBatchUIRetriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ui = ConsoleBatchUI(max_retries = 2, stream = io.StringIO())
+
+
+    def Ask(self, message):
+        return self.ui.Show_Message(message, "Warning", MESSAGE_YES_NO | ICON_QUESTION)
+
+
+    def test_each_question_is_counted_on_its_own(self):
+        self.assertEqual([self.Ask("Latch?"), self.Ask("Latch?")], [ID_YES, ID_YES])
+        self.assertEqual(self.Ask("Signal?"), ID_YES)
+        self.assertEqual(self.Ask("Latch?"), ID_NO)
+        self.assertEqual(self.Ask("Signal?"), ID_YES)
+
+
+    def test_count_starts_again_once_the_step_succeeds(self):
+        for sample in range(10):
+            self.assertEqual([self.Ask("Latch?"), self.Ask("Latch?")], [ID_YES, ID_YES])
+            self.ui.Question_Resolved("Latch?", "Warning")
+
+
+    def test_notices_are_not_counted(self):
+        for i in range(5):
+            self.assertEqual(self.ui.Show_Message("Something happened.", "Warning", MESSAGE_OK), ID_OK)
+        self.assertEqual(self.Ask("Something happened."), ID_YES)
+
+
+    def test_retry_step_resolves_the_question_when_the_step_recovers(self):
+        responses = collections.deque()
+        batch_thread = types.SimpleNamespace(retry_policies = {"Reset AS Output Latch":RetryPolicy(max_attempts = 1)},
+                                             retry_counts = collections.Counter(), want_abort = False, held_messages = None,
+                                             batch_data = types.SimpleNamespace(unattended = False),
+                                             Wait_For = lambda *args, **kwargs: True, Show_Message = self.ui.Show_Message,
+                                             Question_Resolved = self.ui.Question_Resolved)
+
+        ## Over a long batch the step times out twice at a time many times, and recovers each time.
+        for sample in range(5):
+            responses.extend([TIME_OUT, TIME_OUT, "Latch Cleared"])
+            self.assertEqual(BatchThread.Retry_Step(batch_thread, "Reset AS Output Latch", responses.popleft, "No answer."), "Latch Cleared")
+
+        ## A step that keeps timing out is given up once the Yes answers in a row run out.
+        responses.extend([TIME_OUT]*3)
+        self.assertEqual(BatchThread.Retry_Step(batch_thread, "Reset AS Output Latch", responses.popleft, "No answer."), TIME_OUT)
+        self.assertEqual(len(responses), 0)
+
+
+
+
+class ConsoleBatchUIOutcomeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ui = ConsoleBatchUI(stream = io.StringIO())
+
+
+    def test_outcomes(self):
+        self.assertEqual(self.ui.Outcome("Stopped"), "Stopped")
+        self.assertEqual(self.ui.Outcome("Aborted"), "Aborted")
+        self.assertEqual(self.ui.Outcome("Aborted", aborted_by_user = True), "Aborted By User")
+
+        self.ui.pulled_plug = True
+        self.assertEqual(self.ui.Outcome("Pulled Plug"), "Arduino Disconnected")
+
+        self.ui.Show_Message("Batch Complete!", "Batch Complete", MESSAGE_OK)
+        self.assertEqual(self.ui.Outcome("Complete"), "Complete")
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests of resuming a batch from its BatchJournal: which steps a journal cut short by a crash, or
+written part way through a sample, counts as done, and where the resumed batch starts."""
+
+import functools
+import json
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import pandas
+
+from NanoSight_Automation import BatchJournal, BatchThread, Journal_Filepath
+from NanoSight_Simulation import SimulatedBatchData
+
+
+
+
+SAMPLE_NAMES = ["Sample 1", "Sample 2", "Sample 3"]
+
+
+
+
+def Record(row, step):
+    return json.dumps({"row":row, "sample_name":SAMPLE_NAMES[row], "step":step, "time":"2024-01-01 00:00:00"}) + "\n"
+
+
+def Batch_Started(resume):
+    return json.dumps({"event":"Batch Started", "resume":resume, "samples":len(SAMPLE_NAMES), "time":"2024-01-01 00:00:00"}) + "\n"
+
+
+
+
+class BatchJournalResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sample_list_filepath = os.path.join(self.directory, "Sample List.csv")
+        self.journal_filepath = Journal_Filepath(self.sample_list_filepath)
+        self.batch_thread = None
+
+    def tearDown(self):
+        if self.batch_thread is not None:
+            self.batch_thread.journal.Close()
+        shutil.rmtree(self.directory)
+
+
+    def Write_Journal(self, text):
+        with open(self.journal_filepath, "w") as journal_file:
+            journal_file.write(text)
+
+
+    def Open_Journal(self, resume):
+        """Runs BatchThread.Open_Journal as a batch of SAMPLE_NAMES starting would, and returns the batch thread."""
+
+        sample_df = pandas.DataFrame({"Sample Name":SAMPLE_NAMES})
+        batch_data = SimulatedBatchData(sample_df, self.sample_list_filepath, resume_batch = resume)
+        self.batch_thread = types.SimpleNamespace(batch_data = batch_data, sample_df = sample_df, sample_statuses = batch_data.sample_statuses,
+                                                  journal = BatchJournal(self.journal_filepath, SAMPLE_NAMES),
+                                                  Show_Message = lambda *args: self.fail("Unexpected message: " + str(args)))
+        for method_name in ["Build_Batch_Graph", "Load_Journal", "Next_Ready_Step"]:
+            setattr(self.batch_thread, method_name, functools.partial(getattr(BatchThread, method_name), self.batch_thread))
+
+        self.assertTrue(BatchThread.Open_Journal(self.batch_thread))
+        batch_data.sample_statuses.Apply_Updates()
+        return self.batch_thread
+
+
+    def test_truncated_last_line_is_ignored(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Filename Set") + Record(0, "Acquired") + Record(0, "Processed") +
+                           Record(0, "Exported") + Record(1, "Filename Set") + Record(1, "Acquired") + Record(1, "Processed")[:30])
+
+        batch_thread = self.Open_Journal(True)
+
+        self.assertEqual(batch_thread.completed_steps, set([(0, "Acquire"), (0, "Process"), (1, "Acquire")]))
+        self.assertEqual(list(batch_thread.remaining_acquisitions), [2])
+        self.assertEqual(batch_thread.first_acquisition, 2)
+        self.assertEqual(batch_thread.Next_Ready_Step("Process"), (1, "Process"))
+        self.assertEqual(batch_thread.sample_statuses.Status(0, "Processing Progress"), "Complete")
+        self.assertEqual(batch_thread.sample_statuses.Status(1, "Acquisition Progress"), "Complete")
+        self.assertNotEqual(batch_thread.sample_statuses.Status(1, "Processing Progress"), "Complete")
+
+
+    def test_records_after_a_truncated_line_are_read(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Acquired") + Record(0, "Exported")[:20])
+
+        batch_thread = self.Open_Journal(True)
+        batch_thread.journal.Record(1, "Acquired")
+
+        self.assertEqual(batch_thread.journal.Read_Records()[-2]["event"], "Batch Started")
+        self.assertEqual(dict(batch_thread.journal.Completed_Steps()), {0:set(["Acquired"]), 1:set(["Acquired"])})
+
+
+    def test_new_batch_after_a_truncated_line_starts_over(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Acquired") + Record(0, "Exported") + Record(1, "Acquired")[:20])
+
+        batch_thread = self.Open_Journal(False)
+
+        self.assertEqual(batch_thread.completed_steps, set())
+        self.assertEqual(list(batch_thread.remaining_acquisitions), [0, 1, 2])
+        ## The "Batch Started" of the new batch wasn't lost on the end of the cut short line.
+        self.assertEqual(dict(batch_thread.journal.Completed_Steps()), {})
+
+
+    def test_sample_stopped_during_acquisition_is_acquired_again(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Filename Set") + Record(0, "Acquired") + Record(1, "Filename Set"))
+
+        batch_thread = self.Open_Journal(True)
+
+        self.assertEqual(batch_thread.completed_steps, set([(0, "Acquire")]))
+        self.assertEqual(list(batch_thread.remaining_acquisitions), [1, 2])
+        self.assertEqual(batch_thread.first_acquisition, 1)
+        self.assertEqual(batch_thread.Next_Ready_Step("Acquire"), (1, "Acquire"))
+        self.assertEqual(batch_thread.Next_Ready_Step("Process"), (0, "Process"))
+
+
+    def test_sample_stopped_before_its_export_is_processed_again(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Acquired") + Record(0, "Processed") + Record(1, "Acquired"))
+
+        batch_thread = self.Open_Journal(True)
+
+        self.assertEqual(batch_thread.completed_steps, set([(0, "Acquire"), (1, "Acquire")]))
+        self.assertEqual(batch_thread.Next_Ready_Step("Process"), (0, "Process"))
+        self.assertNotEqual(batch_thread.sample_statuses.Status(0, "Processing Progress"), "Complete")
+
+
+    def test_resumed_batches_accumulate_until_a_new_batch(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Acquired") + Batch_Started(True) + Record(1, "Acquired"))
+        self.assertEqual(self.Open_Journal(True).completed_steps, set([(0, "Acquire"), (1, "Acquire")]))
+        self.batch_thread.journal.Close()
+
+        self.Write_Journal(Batch_Started(False) + Record(0, "Acquired") + Batch_Started(False) + Record(1, "Acquired"))
+        self.assertEqual(self.Open_Journal(True).completed_steps, set([(1, "Acquire")]))
+
+
+    def test_records_of_other_samples_are_ignored(self):
+        self.Write_Journal(Batch_Started(False) + Record(0, "Acquired") +
+                           json.dumps({"row":1, "sample_name":"Renamed Sample", "step":"Acquired"}) + "\n" +
+                           json.dumps({"row":7, "sample_name":"Sample 8", "step":"Acquired"}) + "\n")
+
+        self.assertEqual(self.Open_Journal(True).completed_steps, set([(0, "Acquire")]))
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
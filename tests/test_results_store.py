@@ -0,0 +1,195 @@
+"""Tests of the results store: the Parquet and HDF5 stores' partitioning by batch and sample, and the
+ResultsIngester parsing exports into them and recording the ones it can't read."""
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import types
+import unittest
+import urllib.parse
+
+import pandas
+
+from NanoSight_Automation import (RESULTS_SUMMARY_SCHEMA, RESULTS_DISTRIBUTION_SCHEMA, BatchThread, HDF5ResultsStore,
+                                  ParquetResultsStore, ResultsIngester)
+
+
+SUMMARY_TEXT = """NTA Version:,NTA 3.3
+Sample Name:,Sample 1
+Temperature:,25.0
+
+,Mean,Mode,SD
+Size (nm),110.5,100.0,40.2
+
+Bin centre (nm),Concentration average,Standard Error
+1,1.5e6,1.0e5
+3,2.5e6,2.0e5
+5,0.5e6,0.5e5
+"""
+
+
+
+
+class InstantClock(object):
+    """Clock whose sleeps pass at once, so waiting for an export that never appears doesn't take a minute."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+
+
+def Partitions(path):
+    """Returns the partition directories in path, which newer versions of pyarrow percent-encode."""
+
+    return sorted(urllib.parse.unquote(name) for name in os.listdir(path))
+
+
+
+
+def Summary_Rows(batch, sample_name, values):
+    return pandas.DataFrame([(batch, sample_name, 0, "Key " + str(j), str(value), float(value)) for j, value in enumerate(values)],
+                            columns = list(RESULTS_SUMMARY_SCHEMA)).astype(RESULTS_SUMMARY_SCHEMA)
+
+
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow") is not None, "pyarrow is not installed")
+class ParquetResultsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ParquetResultsStore(os.path.join(self.directory, "Results"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_partitioned_by_batch_then_sample(self):
+        self.store.Append("summary", Summary_Rows("Batch 1", "Sample 1", [1, 2]))
+        self.store.Append("summary", Summary_Rows("Batch 1", "Sample 2", [3]))
+        self.store.Append("summary", Summary_Rows("Batch 2", "Sample 1", [4]))
+
+        table_path = os.path.join(self.directory, "Results", "summary")
+        self.assertEqual(Partitions(table_path), ["batch=Batch 1", "batch=Batch 2"])
+        batch_path = os.path.join(table_path, next(name for name in os.listdir(table_path) if urllib.parse.unquote(name) == "batch=Batch 1"))
+        self.assertEqual(Partitions(batch_path), ["sample_name=Sample 1", "sample_name=Sample 2"])
+
+        sample_df = pandas.read_parquet(table_path, filters = [("batch", "=", "Batch 1"), ("sample_name", "=", "Sample 1")])
+        self.assertEqual(sorted(sample_df.loc[:, "numeric_value"].tolist()), [1.0, 2.0])
+        self.assertEqual(len(pandas.read_parquet(table_path, filters = [("sample_name", "=", "Sample 1")])), 3)
+
+
+    def test_append_to_existing_partition_keeps_earlier_rows(self):
+        self.store.Append("summary", Summary_Rows("Batch 1", "Sample 1", [1]))
+        self.store.Append("summary", Summary_Rows("Batch 1", "Sample 1", [2]))
+
+        table_path = os.path.join(self.directory, "Results", "summary")
+        self.assertEqual(Partitions(table_path), ["batch=Batch 1"])
+        batch_path = os.path.join(table_path, os.listdir(table_path)[0])
+        self.assertEqual(Partitions(batch_path), ["sample_name=Sample 1"])
+        self.assertEqual(len(os.listdir(os.path.join(batch_path, os.listdir(batch_path)[0]))), 2)
+        self.assertEqual(sorted(pandas.read_parquet(os.path.join(self.directory, "Results", "summary")).loc[:, "numeric_value"].tolist()), [1.0, 2.0])
+
+
+
+
+@unittest.skipUnless(importlib.util.find_spec("tables") is not None, "PyTables is not installed")
+class HDF5ResultsStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = HDF5ResultsStore(os.path.join(self.directory, "Results.h5"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_batch_and_sample_can_be_selected_on(self):
+        self.store.Append("summary", Summary_Rows("Batch 1", "Sample 1", [1, 2]))
+        self.store.Append("summary", Summary_Rows("Batch 1", "Sample 2", [3]))
+        self.store.Append("summary", Summary_Rows("Batch 2", "Sample 1", [4]))
+
+        sample_df = pandas.read_hdf(self.store.path, "summary", where = "batch == 'Batch 1' & sample_name == 'Sample 1'")
+        self.assertEqual(sorted(sample_df.loc[:, "numeric_value"].tolist()), [1.0, 2.0])
+        self.assertEqual(len(pandas.read_hdf(self.store.path, "summary", where = "sample_name == 'Sample 1'")), 3)
+        self.assertEqual(len(pandas.read_hdf(self.store.path, "summary")), 4)
+
+
+
+
+class RecordingStore(object):
+
+    def __init__(self):
+        self.path = "Recording Store"
+        self.appends = []
+
+    def Append(self, table_name, results_df):
+        self.appends.append((table_name, results_df))
+
+
+
+
+class ResultsIngesterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = RecordingStore()
+        self.ingester = ResultsIngester(self.store, "Batch 1", InstantClock())
+
+    def tearDown(self):
+        self.ingester.Close()
+        shutil.rmtree(self.directory)
+
+
+    def test_export_is_appended_with_the_fixed_schema(self):
+        summary_filepath = os.path.join(self.directory, "Sample 1-ExperimentSummary.csv")
+        with open(summary_filepath, "w") as summary_file:
+            summary_file.write(SUMMARY_TEXT)
+
+        self.ingester.Submit(4, "Sample 1", summary_filepath)
+        self.ingester.Close()
+
+        self.assertEqual(self.ingester.errors, [])
+        tables = dict(self.store.appends)
+        self.assertEqual(list(tables["summary"].dtypes.astype(str)), [str(pandas.Series([], dtype = dtype).dtype) for dtype in RESULTS_SUMMARY_SCHEMA.values()])
+        self.assertEqual(set(tables["summary"].loc[:, "row"]), set([4]))
+        self.assertIn("Size (nm) Mode", tables["summary"].loc[:, "key"].tolist())
+        self.assertEqual(list(tables["size_distribution"].columns), list(RESULTS_DISTRIBUTION_SCHEMA))
+        self.assertEqual(tables["size_distribution"].loc[:, "bin_centre_nm"].tolist(), [1.0, 3.0, 5.0])
+
+
+    def test_unreadable_export_is_recorded_and_shown_once_closed(self):
+        self.ingester.Submit(0, "Sample 1", os.path.join(self.directory, "Missing-ExperimentSummary.csv"))
+        self.ingester.Close()
+
+        self.assertEqual(len(self.ingester.errors), 1)
+        self.assertEqual(self.ingester.errors[0][0], "Sample 1")
+        self.assertEqual(self.store.appends, [])
+
+        messages = []
+        batch_thread = types.SimpleNamespace(results_ingester = self.ingester, Show_Message = lambda message, caption, style: messages.append((caption, message)))
+        BatchThread.Report_Ingest_Errors(batch_thread)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0][0], "Warning")
+        self.assertIn("Sample 1", messages[0][1])
+
+
+    def test_nothing_is_shown_without_errors(self):
+        messages = []
+        batch_thread = types.SimpleNamespace(results_ingester = self.ingester, Show_Message = lambda *args: messages.append(args))
+        BatchThread.Report_Ingest_Errors(batch_thread)
+        self.assertEqual(messages, [])
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""Tests of BatchThread.Retry_Step: retrying a step by its RetryPolicy, holding back the messages of the
+attempts that are retried, and escalating to the operator or aborting once the attempts run out."""
+
+import collections
+import threading
+import types
+import unittest
+
+from NanoSight_Automation import (ICON_ERROR, ID_NO, ID_OK, ID_YES, MESSAGE_OK, MESSAGE_YES_NO, TIME_OUT, BatchThread,
+                                  Default_Retry_Policies, RetryPolicy)
+
+
+
+
+class RecordingUI(object):
+    """Records the messages shown and answers questions from answers, with No once they run out."""
+
+    def __init__(self, answers = ()):
+        self.messages = []
+        self.answers = collections.deque(answers)
+        self.resolved = []
+
+    def Show_Message(self, message, caption, style):
+        self.messages.append((caption, message))
+        if style & MESSAGE_YES_NO:
+            return self.answers.popleft() if len(self.answers) > 0 else ID_NO
+        return ID_OK
+
+    def Question_Resolved(self, message, caption):
+        self.resolved.append(message)
+
+
+
+
+class FakeBatchThread(threading.Thread):
+    """Has what Retry_Step uses of a BatchThread, and runs one step on its own thread like a batch does."""
+
+    Show_Message = BatchThread.Show_Message
+    Question_Resolved = BatchThread.Question_Resolved
+    Retry_Step = BatchThread.Retry_Step
+
+    def __init__(self, policy, ui, unattended = False):
+        threading.Thread.__init__(self)
+        self.retry_policies = {"Step":policy}
+        self.retry_counts = collections.Counter()
+        self.want_abort = False
+        self.held_messages = None
+        self.batch_data = types.SimpleNamespace(unattended = unattended)
+        self.drivers = types.SimpleNamespace(ui = ui)
+
+    def Wait_For(self, *args, **kwargs):
+        return True
+
+    def Run_Step(self, responses, **kwargs):
+        """Runs Retry_Step on a step that returns responses in turn, showing an error each time it returns False."""
+
+        responses = collections.deque(responses)
+        def attempt():
+            response = responses.popleft()
+            if response is not True:
+                self.Show_Message("Could not click.", "NTA Error", MESSAGE_OK | ICON_ERROR)
+            return response
+
+        result = []
+        self.run = lambda: result.append(self.Retry_Step("Step", attempt, **kwargs))
+        self.start()
+        self.join()
+        self.responses_left = len(responses)
+        return result[0]
+
+
+
+
+class RetryStepTest(unittest.TestCase):
+
+    def test_failures_that_are_retried_past_show_nothing(self):
+        ui = RecordingUI()
+        batch_thread = FakeBatchThread(RetryPolicy(max_attempts = 3), ui)
+
+        self.assertTrue(batch_thread.Run_Step([False, False, True], failed = False, aborted = False))
+        self.assertEqual(ui.messages, [])
+        self.assertEqual(batch_thread.retry_counts["Step"], 2)
+
+
+    def test_step_that_keeps_failing_is_aborted_with_its_own_message(self):
+        ui = RecordingUI()
+        batch_thread = FakeBatchThread(RetryPolicy(max_attempts = 2, escalation = "Abort"), ui)
+
+        self.assertFalse(batch_thread.Run_Step([False, False], failed = False, aborted = False))
+        self.assertEqual(ui.messages, [("Error", "Could not click.\nBatch aborted.")])
+        self.assertEqual(batch_thread.responses_left, 0)
+
+
+    def test_operator_is_asked_once_the_attempts_run_out(self):
+        ui = RecordingUI([ID_YES])
+        batch_thread = FakeBatchThread(RetryPolicy(max_attempts = 2), ui)
+
+        self.assertTrue(batch_thread.Run_Step([False, False, False, True], failed = False, aborted = False))
+        self.assertEqual(ui.messages, [("Warning", "Could not click.\nClick Yes to try again.")])
+        self.assertEqual(ui.resolved, ["Could not click.\nClick Yes to try again."])
+
+
+    def test_unattended_batch_is_not_asked(self):
+        ui = RecordingUI([ID_YES])
+        batch_thread = FakeBatchThread(RetryPolicy(max_attempts = 1), ui, unattended = True)
+
+        self.assertFalse(batch_thread.Run_Step([False, True], failed = False, aborted = False))
+        self.assertEqual(ui.messages, [("Error", "Could not click.\nBatch aborted.")])
+
+
+    def test_other_failures_are_shown_and_not_retried(self):
+        ui = RecordingUI()
+        batch_thread = FakeBatchThread(RetryPolicy(), ui)
+
+        self.assertEqual(batch_thread.Run_Step(["Pulled Plug", True]), "Pulled Plug")
+        self.assertEqual(ui.messages, [("NTA Error", "Could not click.")])
+        self.assertEqual(batch_thread.retry_counts["Step"], 0)
+
+
+    def test_messages_of_other_threads_are_not_held(self):
+        ui = RecordingUI()
+        batch_thread = FakeBatchThread(RetryPolicy(), ui)
+        batch_thread.held_messages = []
+
+        self.assertEqual(batch_thread.Show_Message("CETAC Error", "Error", MESSAGE_OK), ID_OK)
+        self.assertEqual(ui.messages, [("Error", "CETAC Error")])
+        self.assertEqual(batch_thread.held_messages, [])
+
+
+    def test_step_that_is_given_up_without_aborting_says_so(self):
+        ui = RecordingUI()
+        batch_thread = FakeBatchThread(RetryPolicy(max_attempts = 1, escalation = "Abort"), ui)
+
+        self.assertEqual(batch_thread.Run_Step([TIME_OUT], gave_up = "Carrying on."), TIME_OUT)
+        self.assertEqual(ui.messages, [("Error", "Could not click.\nCarrying on.")])
+
+
+    def test_default_policies_escalate_to_the_operator(self):
+        for step, policy in Default_Retry_Policies().items():
+            self.assertEqual(policy.escalation, "Ask", step)
+            self.assertGreaterEqual(policy.max_attempts, 1, step)
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
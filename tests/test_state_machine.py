@@ -0,0 +1,195 @@
+"""Tests of the batch's state machine: BatchStateMachine on small tables, and BatchThread.Batch_States
+driven against the simulated instruments, checking the order of the states and where a batch that
+fails ends up."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from NanoSight_Automation import BATCH_FAILURE_STATES, BatchState, BatchStateMachine, BatchThread
+from NanoSight_Benchmark import Make_Sample_List
+from NanoSight_Simulation import SimulatedBatchData, SimulatedDrivers
+
+
+SPEEDUP = 400
+
+SET_UP_STATES = ["Create Save Directories", "Open Journal", "Connect To NTA", "Check Acquisitions", "Connect To Arduino",
+                 "Connect To CETAC", "Enable Arduino Modes", "Reset Latch", "Check CETAC COM", "Check CETAC Script"]
+FIRST_ACQUISITION_STATES = ["Next Acquisition", "Start Acquisition", "Prepare NTA", "Start Autosampler", "Run CETAC Script",
+                            "Wait For Sample", "Run Acquire Script", "Wait For Output Off", "Reset Latch After Start",
+                            "Wait For NTA Script", "Finish Acquisition"]
+NEXT_ACQUISITION_STATES = ["Next Acquisition", "Start Acquisition", "Prepare NTA", "Start Autosampler", "Check CETAC Errors",
+                           "Wait For Autosampler", "Wait For Autosampler Output Off", "Reset Latch Before Trigger", "Trigger Autosampler",
+                           "Check CETAC Running", "Process During Move", "Wait For Sample", "Run Acquire Script", "Wait For Output Off",
+                           "Reset Latch After Start", "Wait For NTA Script", "Finish Acquisition"]
+FINISH_STATES = ["Finish Batch", "Wait For Last Signal", "Wait For Last Output Off", "Send Last Trigger", "Check CETAC Finished", "Complete"]
+
+
+
+
+class BatchStateMachineTest(unittest.TestCase):
+
+    def test_transitions_follow_outcomes(self):
+        transitions = []
+        machine = BatchStateMachine([BatchState("A", lambda: 1, {1:"B", 2:"C"}),
+                                     BatchState("B", lambda timeout: timeout, {"*":"C"}, 7),
+                                     BatchState("C", lambda: None)])
+        machine.Add_Listener(transitions.append)
+
+        self.assertEqual(machine.Run("A"), "C")
+        self.assertEqual([(transition.state, transition.outcome, transition.next_state) for transition in transitions],
+                         [("A", 1, "B"), ("B", 7, "C"), ("C", None, None)])
+        self.assertEqual(machine.state, "C")
+
+
+    def test_can_start_part_way_through(self):
+        ran = []
+        machine = BatchStateMachine([BatchState("A", lambda: ran.append("A"), {"*":"B"}), BatchState("B", lambda: ran.append("B"))])
+
+        self.assertEqual(machine.Run("B"), "B")
+        self.assertEqual(ran, ["B"])
+
+
+    def test_compensation_only_runs_on_the_way_to_a_failure_state(self):
+        compensated = []
+        states = [BatchState("A", lambda outcome: outcome, {"Fail":"Failed", "Pass":"Done"}, None, lambda: compensated.append("A")),
+                  BatchState("Done", lambda: None), BatchState("Failed", lambda: None)]
+
+        states[0].timeout = "Pass"
+        BatchStateMachine(states, ["Failed"]).Run("A")
+        self.assertEqual(compensated, [])
+
+        states[0].timeout = "Fail"
+        self.assertEqual(BatchStateMachine(states, ["Failed"]).Run("A"), "Failed")
+        self.assertEqual(compensated, ["A"])
+
+
+    def test_bad_tables_are_rejected(self):
+        with self.assertRaises(ValueError):
+            BatchStateMachine([BatchState("A", lambda: 1, {1:"Missing"})])
+        with self.assertRaises(ValueError):
+            BatchStateMachine([BatchState("A", lambda: 1)], ["Missing"])
+        with self.assertRaises(ValueError):
+            BatchStateMachine([BatchState("A", lambda: 2, {1:"A"})]).Run("A")
+
+
+
+
+class RecordingBatchThread(BatchThread):
+    """BatchThread that records the states it runs through and calls on_transition with each transition."""
+
+    def __init__(self, batch_data, drivers, on_transition = None):
+        self.transitions = []
+        self.on_transition = on_transition
+        BatchThread.__init__(self, batch_data, drivers)
+
+
+    def Record_Transition(self, transition):
+        self.transitions.append(transition)
+        if self.on_transition is not None:
+            self.on_transition(self, transition)
+        BatchThread.Record_Transition(self, transition)
+
+
+    def States(self):
+        return [transition.state for transition in self.transitions]
+
+
+
+
+class BatchStatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def Run_Batch(self, number_of_samples, on_transition = None, pipelined_processing = False, **driver_settings):
+        """Runs a simulated batch to the end and returns the batch thread and its batch data."""
+
+        batch_data = SimulatedBatchData(Make_Sample_List(self.directory, number_of_samples), os.path.join(self.directory, "Sample List.csv"),
+                                        pipelined_processing)
+        self.drivers = SimulatedDrivers(batch_data, speedup = SPEEDUP, seed = 0, **driver_settings)
+        batch_thread = RecordingBatchThread(batch_data, self.drivers, on_transition)
+        batch_thread.join()
+        batch_data.sample_statuses.Apply_Updates()
+        return batch_thread, batch_data
+
+
+    def test_complete_batch_runs_the_states_in_order(self):
+        batch_thread, batch_data = self.Run_Batch(2)
+
+        self.assertEqual(batch_thread.States(), SET_UP_STATES + FIRST_ACQUISITION_STATES + NEXT_ACQUISITION_STATES +
+                                                ["Next Acquisition", "Finish Acquisitions"] +
+                                                ["Next Process Step", "Process Sample"]*2 + ["Next Process Step"] + FINISH_STATES)
+        self.assertEqual(batch_thread.state_machine.state, "Complete")
+        self.assertIsNone(batch_thread.state_machine.failed_state)
+        self.assertEqual([transition.outcome for transition in batch_thread.transitions if transition.state == "Process During Move"], ["Skipped"])
+        self.assertEqual([batch_data.sample_statuses.Status(i, "Processing Progress") for i in range(2)], ["Complete"]*2)
+
+
+    def test_pipelined_batch_processes_during_the_move(self):
+        ## A move long enough that processing fits in it however the test machine's timing varies.
+        batch_thread, batch_data = self.Run_Batch(2, pipelined_processing = True, latencies = {"autosampler_move":120})
+
+        states = batch_thread.States()
+        self.assertEqual(batch_thread.state_machine.state, "Complete")
+        self.assertEqual([transition.outcome for transition in batch_thread.transitions if transition.state == "Process During Move"], ["Processed"])
+        self.assertEqual(states[states.index("Process During Move") + 1], "Prepare NTA Again")
+        self.assertEqual(states.count("Process Sample"), 1)
+        self.assertEqual([batch_data.sample_statuses.Status(i, "Processing Progress") for i in range(2)], ["Complete"]*2)
+
+
+    def test_abort_cancels_the_acquisition_and_ends_aborted(self):
+        def Abort_After_Preparing(batch_thread, transition):
+            if transition.state == "Prepare NTA":
+                batch_thread.abort()
+
+        batch_thread, batch_data = self.Run_Batch(2, Abort_After_Preparing)
+
+        self.assertEqual(batch_thread.state_machine.state, "Aborted")
+        self.assertIn(batch_thread.transitions[-2].next_state, BATCH_FAILURE_STATES)
+        self.assertNotIn("Complete", batch_thread.States())
+        self.assertEqual(batch_data.sample_statuses.Status(0, "Acquisition Progress"), "Cancelled")
+
+
+    def test_cetac_error_while_waiting_ends_aborted(self):
+        batch_thread, batch_data = self.Run_Batch(2, failure_rates = {"cetac_error":1.0})
+
+        self.assertEqual(batch_thread.States(), SET_UP_STATES + FIRST_ACQUISITION_STATES[:6] + ["Aborted"])
+        self.assertEqual(batch_thread.transitions[-2].outcome, "Abort")
+        self.assertEqual(batch_thread.state_machine.failed_state, "Wait For Sample")
+        self.assertEqual([batch_data.sample_statuses.Status(i, "Acquisition Progress") for i in range(2)], ["Cancelled", "Not Started"])
+        self.assertEqual([caption for caption, message in self.drivers.ui.messages], ["CETAC Workstation Error"])
+
+
+    def test_arduino_that_does_not_come_back_ends_pulled_plug(self):
+        def Unplug_While_Waiting(batch_thread, transition):
+            if transition.state == "Run CETAC Script":
+                self.drivers.arduino.Unplug()
+
+        batch_thread, batch_data = self.Run_Batch(1, Unplug_While_Waiting, latencies = {"arduino_replug":3600})
+
+        self.assertEqual(batch_thread.state_machine.state, "Pulled Plug")
+        self.assertEqual(batch_thread.States()[-2], "Wait For Sample")
+        self.assertEqual(batch_data.sample_statuses.Status(0, "Acquisition Progress"), "Cancelled")
+
+
+    def test_missing_nta_ends_stopped(self):
+        def Close_NTA(batch_thread, transition):
+            if transition.state == "Open Journal":
+                self.drivers.desktop.Remove_Window(self.drivers.nta.dialogs["NTA 3.3"])
+
+        batch_thread, batch_data = self.Run_Batch(1, Close_NTA)
+
+        self.assertEqual(batch_thread.States(), ["Create Save Directories", "Open Journal", "Connect To NTA", "Stopped"])
+        self.assertEqual(batch_thread.state_machine.state, "Stopped")
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""Tests of BatchThread.NTA_Window_Check: what it returns, that each regex is compiled once, and how
+the wait between polls backs off."""
+
+import types
+import unittest
+
+from NanoSight_Automation import (TIME_OUT, WINDOW_CHECK_BACKOFF, WINDOW_CHECK_FIRST_INTERVAL, WINDOW_CHECK_LONG_MAX_INTERVAL,
+                                  WINDOW_CHECK_SHORT_MAX_INTERVAL, BatchProfiler, BatchThread)
+
+
+
+
+class RecordingClock(object):
+    """Clock whose sleeps pass at once and are recorded."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+
+
+class ScriptedApp(object):
+    """Stands in for the pywinauto Application, returning windows with the next list of titles in
+    windows_by_poll on each call to windows() and the last one once they run out. An exception in the
+    list is raised. The windows print the way pywinauto's do, with the title quoted."""
+
+    def __init__(self, windows_by_poll):
+        self.windows_by_poll = list(windows_by_poll)
+        self.calls = 0
+
+    def windows(self):
+        windows = self.windows_by_poll[min(self.calls, len(self.windows_by_poll)-1)]
+        self.calls += 1
+        if isinstance(windows, Exception):
+            raise windows
+        return ["<hwndwrapper.DialogWrapper - '" + title + "', Dialog>" for title in windows]
+
+
+
+
+def Batch_Thread(windows_by_poll):
+    clock = RecordingClock()
+    return types.SimpleNamespace(NTA_app = ScriptedApp(windows_by_poll), clock = clock, want_abort = False,
+                                 window_matchers = {}, window_check_stats = [], current_sample = None,
+                                 profiler = BatchProfiler(clock = clock.time))
+
+
+
+
+def Expected_Sleeps(count, max_interval):
+    sleeps = []
+    interval = WINDOW_CHECK_FIRST_INTERVAL
+    for i in range(count):
+        sleeps.append(interval)
+        interval = min(interval * WINDOW_CHECK_BACKOFF, max_interval)
+    return sleeps
+
+
+
+
+class NTAWindowCheckTest(unittest.TestCase):
+
+    def test_window_found_on_first_poll_does_not_sleep(self):
+        batch_thread = Batch_Thread([["NTA 3.3", "Save As"]])
+
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Save As'", True, 0.2), "Success")
+        self.assertEqual(batch_thread.clock.sleeps, [])
+        self.assertEqual(batch_thread.window_check_stats, [("'Save As'", True, 1, 0.0, "Success")])
+
+
+    def test_window_found_after_backing_off(self):
+        batch_thread = Batch_Thread([["NTA 3.3"]]*4 + [["NTA 3.3", "Open"]])
+
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Open'", True, 0.2), "Success")
+        self.assertEqual(batch_thread.NTA_app.calls, 5)
+        for slept, expected in zip(batch_thread.clock.sleeps, Expected_Sleeps(4, WINDOW_CHECK_SHORT_MAX_INTERVAL)):
+            self.assertAlmostEqual(slept, expected)
+
+
+    def test_window_closing_is_success_when_not_finding(self):
+        batch_thread = Batch_Thread([["NTA 3.3", "Save As"]]*2 + [["NTA 3.3"]])
+
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Save As'", False, 0.2), "Success")
+        self.assertEqual(batch_thread.NTA_app.calls, 3)
+
+
+    def test_times_out_with_the_result_callers_check_for(self):
+        batch_thread = Batch_Thread([["NTA 3.3"]])
+
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Open'", True, 0.2), TIME_OUT)
+        ## Timed out after 0.2 minutes, by less than one more poll.
+        self.assertGreater(batch_thread.clock.now, 0.2*60)
+        self.assertLessEqual(batch_thread.clock.now, 0.2*60 + WINDOW_CHECK_SHORT_MAX_INTERVAL)
+
+
+    def test_short_timeouts_back_off_to_the_short_cap(self):
+        batch_thread = Batch_Thread([["NTA 3.3"]])
+        BatchThread.NTA_Window_Check(batch_thread, "'Open'", True, 0.5)
+
+        sleeps = batch_thread.clock.sleeps
+        for slept, expected in zip(sleeps, Expected_Sleeps(len(sleeps), WINDOW_CHECK_SHORT_MAX_INTERVAL)):
+            self.assertAlmostEqual(slept, expected)
+        self.assertAlmostEqual(max(sleeps), WINDOW_CHECK_SHORT_MAX_INTERVAL)
+
+
+    def test_long_timeouts_back_off_to_the_long_cap(self):
+        batch_thread = Batch_Thread([["NTA 3.3", "Export Settings"]]*1000 + [["NTA 3.3"]])
+        BatchThread.NTA_Window_Check(batch_thread, "'Export Settings'", False, 5)
+
+        sleeps = batch_thread.clock.sleeps
+        for slept, expected in zip(sleeps, Expected_Sleeps(len(sleeps), WINDOW_CHECK_LONG_MAX_INTERVAL)):
+            self.assertAlmostEqual(slept, expected)
+        self.assertAlmostEqual(max(sleeps), WINDOW_CHECK_LONG_MAX_INTERVAL)
+
+
+    def test_regex_is_compiled_once(self):
+        batch_thread = Batch_Thread([["NTA 3.3", "Open"]])
+        BatchThread.NTA_Window_Check(batch_thread, "'Open'", True, 0.2)
+        matcher = batch_thread.window_matchers["'Open'"]
+
+        BatchThread.NTA_Window_Check(batch_thread, "'Open'", True, 0.2)
+        self.assertIs(batch_thread.window_matchers["'Open'"], matcher)
+        self.assertEqual(list(batch_thread.window_matchers), ["'Open'"])
+
+
+    def test_abort_during_the_search(self):
+        batch_thread = Batch_Thread([["NTA 3.3"]])
+        batch_thread.clock.sleep = lambda seconds: setattr(batch_thread, "want_abort", True)
+
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Open'", True, 0.2), "Abort")
+        self.assertEqual(batch_thread.NTA_app.calls, 1)
+
+
+    def test_failed_window_listing_is_neither_found_nor_gone(self):
+        batch_thread = Batch_Thread([RuntimeError("NTA is busy"), ["NTA 3.3"]])
+
+        ## A failed listing doesn't count as the window having closed.
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Open'", False, 0.2), "Success")
+        self.assertEqual(batch_thread.NTA_app.calls, 2)
+
+        batch_thread = Batch_Thread([RuntimeError("NTA is busy")])
+        self.assertEqual(BatchThread.NTA_Window_Check(batch_thread, "'Open'", False, 0.2), TIME_OUT)
+
+
+
+
+if __name__ == "__main__":
+    unittest.main()